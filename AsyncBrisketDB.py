@@ -0,0 +1,344 @@
+"""
+Asynchronous front-end to BrisketDB.
+
+sqlite3 connections are blocking, so calling them directly from a slash command handler stalls the
+Discord event loop (and the gateway heartbeat) for the duration of every query and commit.
+AsyncBrisketDB owns a single worker thread that opens, and is the only user of, the BrisketDB connection.
+Handlers submit work to that thread and await the result.
+
+The number of jobs queued on the worker is bounded by max_pending. Once that many jobs are outstanding,
+further callers wait on the event loop until a slot frees up instead of piling work onto the executor.
+
+Log inserts can additionally be routed through a WriteCoalescer, which gathers the rows arriving within a short
+window and commits them together, paying for one transaction (and one fsync) per batch instead of per row.
+
+When opened with a WAL profile (see BrisketDB.DBProfile), queries are instead served by a small pool of read-only
+connections, each owned by its own reader thread, so view commands run concurrently with each other and with writes.
+
+Jobs run in a copy of the submitting task's context, so their database time is charged to the command being served
+(see brisketmetrics). After each job on the database thread the tables it wrote are bumped once more in
+brisketutils.TABLE_VERSIONS, now that the writes are committed.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import threading
+from typing import Any, Callable, List, Optional, Tuple
+
+from BrisketDB import BrisketDB, DBProfile
+from BrisketQueries import QUERIES, SlowQueryLog
+from brisketmetrics import METRICS
+from brisketutils import TABLE_VERSIONS
+
+
+def _query(db:BrisketDB, sql:str, params=None) -> List[dict]:
+    return list(db.query(sql, params))
+
+def _get(db:BrisketDB, table_name:str, pk) -> dict:
+    return db[table_name].get(pk)
+
+def _insert(db:BrisketDB, table_name:str, record:dict):
+    pk = db[table_name].insert(record).last_pk
+    TABLE_VERSIONS.bump(table_name)
+    return pk
+
+def _update(db:BrisketDB, table_name:str, pk, updates:dict):
+    db[table_name].update(pk, updates)
+    TABLE_VERSIONS.bump(table_name)
+
+def _delete(db:BrisketDB, table_name:str, pk):
+    db[table_name].delete(pk)
+    TABLE_VERSIONS.bump(table_name)
+
+def _write(func:Callable, db:BrisketDB, *args, **kwargs):
+    # Every job on the database thread has committed or rolled back by the time it returns
+    try:
+        return func(db, *args, **kwargs)
+    finally:
+        TABLE_VERSIONS.flush()
+
+def _close(db:BrisketDB):
+    db.conn.close()
+
+def _commitBatch(db:BrisketDB, batch:List[tuple]) -> List[Any]:
+    """Insert every (insert_many, record) pair of <batch> in a single transaction.
+    If the transaction fails, each row is retried in its own transaction so that one bad row only fails its own caller.
+
+    :return: For each entry of batch, the new row ID or the exception raised inserting it
+    :rtype: List[Any]
+    """
+    # Group records by bulk insert function, remembering each record's position in the batch
+    groups = {}
+    for idx, (insert_many, record) in enumerate(batch):
+        groups.setdefault(insert_many, []).append((idx, record))
+
+    results = [None] * len(batch)
+    try:
+        with db.conn:
+            for insert_many, entries in groups.items():
+                row_ids = insert_many(db, [record for _, record in entries])
+                for (idx, _), row_id in zip(entries, row_ids):
+                    results[idx] = row_id
+        return results
+    except Exception:
+        # The insert functions may have updated in-memory state for rows that were just rolled back
+        db.resetCaches()
+
+    for idx, (insert_many, record) in enumerate(batch):
+        try:
+            with db.conn:
+                results[idx] = insert_many(db, [record])[0]
+        except Exception as err:
+            results[idx] = err
+    return results
+
+
+class WriteCoalescer():
+    """Collects single-row inserts and commits them as one transaction.
+    A batch is committed once <window> seconds have passed since its first row arrived, or as soon as it holds <max_rows> rows.
+
+    :param async_db: Database whose thread commits the batches
+    :type async_db: AsyncBrisketDB
+    :param window: Seconds to wait for more rows before committing, defaults to 0.01
+    :type window: float, optional
+    :param max_rows: Row count that triggers an immediate commit, defaults to 64
+    :type max_rows: int, optional
+    """
+
+    def __init__(self, async_db:"AsyncBrisketDB", window:float=0.01, max_rows:int=64):
+        self.window = window
+        self.max_rows = max_rows
+        self.commit_count = 0
+        self.row_count = 0
+        self._db = async_db
+        self._pending = []
+        self._timer = None
+        # Commits in flight, kept referenced until done so they are neither garbage collected nor lost on close
+        self._tasks = set()
+        self._loop = None
+
+    async def insert(self, insert_many:Callable, record:dict) -> Optional[int]:
+        """Queue <record> for insertion and wait for its batch to commit.
+
+        :param insert_many: Bulk insert function for the record's table, e.g. SkillDB.SkillLogTable.insertSkillLogs
+        :type insert_many: Callable
+        :param record: Row to insert, e.g. built by SkillDB.SkillLogTable.buildSkillLog
+        :type record: dict
+        :return: Primary key of the new row, or None if <insert_many> skipped it as a duplicate
+        :rtype: Optional[int]
+        """
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        fut = loop.create_future()
+        self._pending.append((insert_many, record, fut))
+
+        if len(self._pending) >= self.max_rows:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self.flush)
+
+        return await fut
+
+    def flush(self):
+        """Commit the pending rows now rather than waiting for the window to close
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if self._pending:
+            batch, self._pending = self._pending, []
+            task = asyncio.ensure_future(self._commit(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def drain(self):
+        """Commit the pending rows now and wait until every batch in flight is committed
+        """
+        self.flush()
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+
+    def close(self):
+        """Run drain() to completion on the event loop the rows were queued from.
+        Must be called once that loop has stopped; from a coroutine, await drain() instead.
+        """
+        if self._loop is not None and not self._loop.is_closed() and (self._pending or self._tasks):
+            self._loop.run_until_complete(self.drain())
+
+    async def _commit(self, batch:List[tuple]):
+        try:
+            results = await self._db.run(_commitBatch, [(insert_many, record) for insert_many, record, _ in batch])
+        except Exception as err:
+            results = [err] * len(batch)
+        else:
+            self.commit_count += 1
+            self.row_count += len(batch)
+
+        for (_, _, fut), result in zip(batch, results):
+            if fut.done():
+                continue
+            if isinstance(result, Exception):
+                fut.set_exception(result)
+            else:
+                fut.set_result(result)
+
+
+class AsyncBrisketDB():
+    """Awaitable wrapper running all BrisketDB work on a dedicated database thread.
+
+    :param db_file: Path of the database file, passed on to BrisketDB
+    :type db_file: str
+    :param max_pending: Maximum number of jobs queued on the database thread before callers are made to wait, defaults to 32
+    :type max_pending: int, optional
+    :param batch_window: Seconds insertBatched waits to gather rows into one commit, defaults to 0.01
+    :type batch_window: float, optional
+    :param batch_rows: Number of queued rows which forces an immediate batch commit, defaults to 64
+    :type batch_rows: int, optional
+    :param profile: Connection settings passed on to BrisketDB. Profiles with readers enable the read-only pool.
+    :type profile: DBProfile, optional
+    :param slow_log: Log receiving the slow named queries run on this database's connections, defaults to None
+    :type slow_log: SlowQueryLog, optional
+    """
+
+    def __init__(self, db_file:str, max_pending:int=32, batch_window:float=0.01, batch_rows:int=64, profile:DBProfile=None,
+                 slow_log:SlowQueryLog=None):
+        self.max_pending = max_pending
+        self.writes = WriteCoalescer(self, batch_window, batch_rows)
+        self._slots = asyncio.Semaphore(max_pending)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="brisket-db")
+
+        # The connection must be opened on the worker thread; sqlite3 connections refuse use from other threads.
+        self.db = self._executor.submit(BrisketDB, db_file, profile=profile).result()
+        self._executor.submit(METRICS.instrument, self.db.conn).result()
+        self.profile = self.db.profile
+        # Consulted by QUERIES.executeTable on every connection of this database
+        self.slow_log = slow_log
+        self.db.slow_log = slow_log
+        # In-memory and internally locked, so safe to read directly from the event loop
+        self.weapon_leaderboard = self.db.weapon_leaderboard
+
+        # Reader threads each lazily open their own read-only connection; the writer above has already switched the file to WAL
+        self._readers = None
+        self._reader_conns = []
+        self._reader_local = threading.local()
+        if self.profile.readers > 0 and db_file != ':memory:':
+            self._db_file = db_file
+            self._read_slots = asyncio.Semaphore(max_pending)
+            self._readers = concurrent.futures.ThreadPoolExecutor(max_workers=self.profile.readers, thread_name_prefix="brisket-db-read")
+
+    def _readerDB(self):
+        reader = getattr(self._reader_local, 'db', None)
+        if reader is None:
+            reader = self.profile.openReader(self._db_file)
+            METRICS.instrument(reader.conn)
+            reader.slow_log = self.slow_log
+            self._reader_local.db = reader
+            self._reader_conns.append(reader.conn)
+        return reader
+
+    def _callReader(self, func:Callable, *args, **kwargs):
+        return func(self._readerDB(), *args, **kwargs)
+
+    async def run(self, func:Callable, *args, **kwargs) -> Any:
+        """Call func(db, *args, **kwargs) on the database thread and return its result.
+        Any of the table helpers (e.g. BankTable.insertBankLog) can be passed as func.
+
+        :param func: Callable taking the database as its first argument
+        :type func: Callable
+        :return: Return value of func
+        """
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            job = functools.partial(contextvars.copy_context().run, METRICS.chargeDB, _write, func, self.db, *args, **kwargs)
+            return await loop.run_in_executor(self._executor, job)
+
+    async def read(self, func:Callable, *args, **kwargs) -> Any:
+        """Call func(db, *args, **kwargs) on a read-only connection and return its result.
+        Falls back to the database thread when the profile has no reader pool. func must not write.
+
+        :param func: Callable taking the database as its first argument
+        :type func: Callable
+        :return: Return value of func
+        """
+        if self._readers is None:
+            return await self.run(func, *args, **kwargs)
+
+        async with self._read_slots:
+            loop = asyncio.get_running_loop()
+            job = functools.partial(contextvars.copy_context().run, METRICS.chargeDB, self._callReader, func, *args, **kwargs)
+            return await loop.run_in_executor(self._readers, job)
+
+    async def query(self, sql:str, params=None) -> List[dict]:
+        """Execute a SELECT and return all result rows as dictionaries.
+        Served by the reader pool when available.
+
+        :param sql: SQL query
+        :type sql: str
+        :param params: Bound parameters for the query, defaults to None
+        :type params: Union[tuple, dict], optional
+        :return: Result rows
+        :rtype: List[dict]
+        """
+        return await self.read(_query, sql, params)
+
+    async def namedQuery(self, name:str, params=()) -> List[dict]:
+        """Execute a query registered in BrisketQueries.QUERIES with bound <params>.
+        Served by the reader pool when available.
+
+        :param name: Registered query name
+        :type name: str
+        :param params: Values bound to the query's placeholders, defaults to ()
+        :type params: Union[tuple, list, dict], optional
+        :return: Result rows
+        :rtype: List[dict]
+        """
+        return await self.read(QUERIES.execute, name, params)
+
+    async def namedTable(self, name:str, params=()) -> Tuple[List[str], List[tuple]]:
+        """Like namedQuery, but returns the column names and raw row tuples, e.g. for rendering as a table
+
+        :rtype: Tuple[List[str], List[tuple]]
+        """
+        return await self.read(QUERIES.executeTable, name, params)
+
+    async def get(self, table_name:str, pk) -> dict:
+        """Fetch a single row by primary key. Raises sqlite_utils.db.NotFoundError if the row does not exist.
+        """
+        return await self.run(_get, table_name, pk)
+
+    async def insert(self, table_name:str, record:dict):
+        """Insert a single row and return its primary key
+        """
+        return await self.run(_insert, table_name, record)
+
+    async def insertBatched(self, insert_many:Callable, record:dict) -> Optional[int]:
+        """Insert a single row through the write coalescer; see WriteCoalescer.insert.
+        The row is committed, together with any others arriving in the same window, before this returns.
+        """
+        return await self.writes.insert(insert_many, record)
+
+    async def update(self, table_name:str, pk, updates:dict):
+        """Update the row with primary key <pk> using the column values in <updates>
+        """
+        await self.run(_update, table_name, pk, updates)
+
+    async def delete(self, table_name:str, pk):
+        """Delete the row with primary key <pk>
+        """
+        await self.run(_delete, table_name, pk)
+
+    def close(self):
+        """Close the connection on the database thread and shut the thread down. Blocks until queued jobs finish.
+        Rows still waiting in the write coalescer are committed first, see WriteCoalescer.close.
+        """
+        self.writes.close()
+        if self._readers is not None:
+            self._readers.shutdown(wait=True)
+            # Reader threads are idle once shut down, so their connections can be closed from here
+            for conn in self._reader_conns:
+                conn.close()
+
+        self._executor.submit(_close, self.db).result()
+        self._executor.shutdown(wait=True)
@@ -1,10 +1,12 @@
 import sqlite3 as sql
 from sqlite_utils import Database
-from sqlite_utils.db import NotFoundError
 # from MemberTable import MemberTable
 import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import List, Optional, Tuple, Union
 
 from MemberDB import MemberTable
+import brisketutils
 
 class BankTable():
     TABLE_NAME = "banklogs"
@@ -13,6 +15,47 @@ class BankTable():
     MEMBERID_COL = "MemberID"
     AMNT_COL = "Amount"
     NOTE_COL = "Note"
+    DATE_IDX = "idx_banklogs_date"
+    MEMBER_DATE_IDX = "idx_banklogs_member_date"
+    # Covering replacements of the two indexes above (schema version 8)
+    DATE_COVER_IDX = "idx_banklogs_date_cover"
+    MEMBER_DATE_COVER_IDX = "idx_banklogs_member_date_cover"
+    # Interaction ID of the command that logged the row; a retried command cannot log it twice (schema version 9)
+    IDEMKEY_COL = "IdemKey"
+    IDEMKEY_IDX = "idx_banklogs_idemkey"
+
+    def createPageIndexes(db:Database):
+        """Create the indexes serving the date-ordered, keyset-paginated bank views. Does not commit.
+        """
+        t = BankTable
+        db.execute(f"CREATE INDEX IF NOT EXISTS [{t.DATE_IDX}] ON [{t.TABLE_NAME}] ([{t.DATE_COL}])")
+        db.execute(f"CREATE INDEX IF NOT EXISTS [{t.MEMBER_DATE_IDX}] ON [{t.TABLE_NAME}] ([{t.MEMBERID_COL}], [{t.DATE_COL}])")
+
+    def createCoveringIndexes(db:Database):
+        """Replace the page indexes with covering ones holding every column the bank views select,
+        so view pages and stats edges are read from the index alone. Does not commit.
+        """
+        t = BankTable
+        brisketutils.replaceIndexes(db, t.TABLE_NAME, {
+            t.DATE_COVER_IDX : [t.DATE_COL, t.MEMBERID_COL, t.AMNT_COL, t.NOTE_COL],
+            t.MEMBER_DATE_COVER_IDX : [t.MEMBERID_COL, t.DATE_COL, t.AMNT_COL, t.NOTE_COL]
+        }, [t.DATE_IDX, t.MEMBER_DATE_IDX])
+
+    def addIdempotencyKey(db:Database):
+        """Add the uniquely indexed idempotency key column. Does not commit.
+        """
+        brisketutils.addIdempotencyKey(db, BankTable.TABLE_NAME, BankTable.IDEMKEY_COL, BankTable.IDEMKEY_IDX)
+
+    def normalizeDates(db:Database):
+        """Rewrite logged dates as ISO text so date ranges compare chronologically. Does not commit.
+        """
+        brisketutils.normalizeDates(db, BankTable.TABLE_NAME, BankTable.DATE_COL)
+
+    def createDateIndexes(db:Database):
+        """Index logged dates by (Date) and (MemberID, Date) for the date-range filters of the bank views.
+        These are the page indexes, so only databases that predate them gain any. Does not commit.
+        """
+        BankTable.createPageIndexes(db)
 
     def initBankLogTable(db:Database, init_bal=0):
         bank_log_table = db[BankTable.TABLE_NAME]
@@ -39,21 +82,55 @@ class BankTable():
             else:
                 raise err
 
-    def insertBankLog(db:Database, member_id:int, amount:float, date:datetime.date=None,note:str=None):
+    def toCents(amount:Union[str, float, int]) -> int:
+        """Convert an amount of money to integer cents, rounding half a cent away from zero
+
+        :raises ValueError: If <amount> is not a number
+        """
+        try:
+            return int(Decimal(str(amount)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) * 100)
+        except InvalidOperation:
+            raise ValueError(f"'{amount}' is not an amount of money") from None
+
+    def formatCents(cents:int) -> str:
+        """Format integer cents for display, e.g. -123456 -> '-1,234.56'
+        """
+        sign = '-' if cents < 0 else ''
+        whole, frac = divmod(abs(cents), 100)
+        return f"{sign}{whole:,}.{frac:02d}"
+
+    def buildBankLog(member_id:int, amount:float, date:datetime.date=None, note:str=None, idem_key:int=None) -> dict:
         if date == None:
             date = datetime.date.today()
-        
-        db[BankTable.TABLE_NAME].insert({
+
+        return {
             BankTable.MEMBERID_COL : member_id,
             BankTable.AMNT_COL : amount,
             BankTable.DATE_COL : date,
-            BankTable.NOTE_COL : note
-        })
+            BankTable.NOTE_COL : note,
+            BankTable.IDEMKEY_COL : idem_key
+        }
 
+    def insertBankLogs(db:Database, records:List[dict]) -> List[Optional[int]]:
+        # Does not commit; rows whose idempotency key is already logged are skipped, see brisketutils.insertRecords
+        return brisketutils.insertRecords(db, BankTable.TABLE_NAME, records, BankTable.IDEMKEY_COL)
 
-    def updateBankLog(db:Database,xact_id:int, amount:float=None, date:datetime.date=None, note:str=None):
-        bank_log_table = db[BankTable.TABLE_NAME]
+    def insertBankLog(db:Database, member_id:int, amount:float, date:datetime.date=None,note:str=None,
+                      idem_key:int=None) -> Optional[int]:
+        """Log a transaction, unless one with the same <idem_key> was already logged
 
+        :return: ID of the new transaction, or None if it was a duplicate
+        :rtype: Optional[int]
+        """
+        with db.conn:
+            return BankTable.insertBankLogs(db, [BankTable.buildBankLog(member_id, amount, date, note, idem_key)])[0]
+
+
+    def updateBankLog(db:Database,xact_id:int, amount:float=None, date:datetime.date=None, note:str=None,
+                      member_id:int=None) -> Tuple[brisketutils.MutationResult, Optional[int]]:
+        """Update a transaction; if <member_id> is given, only when it is that member's.
+        See brisketutils.guardedUpdate for the returned outcome.
+        """
         table_data = {}
         if amount != None:
             table_data[BankTable.AMNT_COL] = amount
@@ -62,12 +139,234 @@ class BankTable():
         if note != None: 
             table_data[BankTable.NOTE_COL] = note
 
-        # Execute update if table data is non-empty
-        if table_data:
-            bank_log_table.update(xact_id, table_data)
+        with db.conn:
+            return brisketutils.guardedUpdate(db, BankTable.TABLE_NAME, BankTable.XACTID_COL, xact_id, table_data,
+                BankTable.MEMBERID_COL, member_id)
+
+    def deleteBankLog(db:Database,xact_id:int, member_id:int=None) -> Tuple[brisketutils.MutationResult, Optional[int]]:
+        """Delete a transaction; if <member_id> is given, only when it is that member's
+        """
+        with db.conn:
+            return brisketutils.guardedDelete(db, BankTable.TABLE_NAME, BankTable.XACTID_COL, xact_id,
+                BankTable.MEMBERID_COL, member_id)
+
+
+class BankLedger():
+    """Integer-cent running totals of the bank log: one company balance row and one row per member.
+    INSERT/UPDATE/DELETE triggers on the bank log keep both current within the writing transaction,
+    so reading the balance is a single-row lookup rather than a sum over every transaction.
+    Amounts are converted to cents by rounding, so float representation error never accumulates.
+    """
+    BALANCE_TABLE = "bank_balance"
+    MEMBER_TABLE = "bank_member_totals"
+    ID_COL = "Id"
+    MEMBERID_COL = BankTable.MEMBERID_COL
+    CENTS_COL = "Cents"
+    COUNT_COL = "Count"
+
+    # Cents of the bank log row <ref> (OLD or NEW)
+    _CENTS_SQL = f"COALESCE(CAST(ROUND({{ref}}.{BankTable.AMNT_COL} * 100) AS INTEGER), 0)"
+
+    def initLedger(db:Database):
+        """If not pre-existing, create the ledger tables and their triggers, then populate them from the bank log.
+        Does not commit, so it can run inside a schema migration's transaction.
+
+        :param db: A connection to an existing database file containing the bank log table
+        :type db: sqlite_utils.Database
+        """
+        t = BankLedger
+        log = BankTable.TABLE_NAME
+        is_new = not db[t.BALANCE_TABLE].exists()
+
+        db.execute(f"""CREATE TABLE IF NOT EXISTS [{t.BALANCE_TABLE}] (
+            [{t.ID_COL}] INTEGER PRIMARY KEY CHECK ([{t.ID_COL}] = 0),
+            [{t.CENTS_COL}] INTEGER NOT NULL
+        )""")
+        db.execute(f"""CREATE TABLE IF NOT EXISTS [{t.MEMBER_TABLE}] (
+            [{t.MEMBERID_COL}] INTEGER PRIMARY KEY REFERENCES [{MemberTable.TABLE_NAME}]([{MemberTable.DISCORDID_COL}]),
+            [{t.CENTS_COL}] INTEGER NOT NULL,
+            [{t.COUNT_COL}] INTEGER NOT NULL
+        )""")
+
+        add_new = f"""UPDATE [{t.BALANCE_TABLE}] SET {t.CENTS_COL} = {t.CENTS_COL} + {t._CENTS_SQL.format(ref='NEW')};
+            INSERT INTO [{t.MEMBER_TABLE}] ({t.MEMBERID_COL}, {t.CENTS_COL}, {t.COUNT_COL})
+                SELECT NEW.{t.MEMBERID_COL}, {t._CENTS_SQL.format(ref='NEW')}, 1 WHERE NEW.{t.MEMBERID_COL} IS NOT NULL
+                ON CONFLICT ({t.MEMBERID_COL}) DO UPDATE SET
+                    {t.CENTS_COL} = {t.CENTS_COL} + excluded.{t.CENTS_COL}, {t.COUNT_COL} = {t.COUNT_COL} + 1;"""
+        remove_old = f"""UPDATE [{t.BALANCE_TABLE}] SET {t.CENTS_COL} = {t.CENTS_COL} - {t._CENTS_SQL.format(ref='OLD')};
+            UPDATE [{t.MEMBER_TABLE}] SET {t.CENTS_COL} = {t.CENTS_COL} - {t._CENTS_SQL.format(ref='OLD')}, {t.COUNT_COL} = {t.COUNT_COL} - 1
+                WHERE {t.MEMBERID_COL} = OLD.{t.MEMBERID_COL};
+            DELETE FROM [{t.MEMBER_TABLE}] WHERE {t.MEMBERID_COL} = OLD.{t.MEMBERID_COL} AND {t.COUNT_COL} = 0;"""
+
+        db.execute(f"CREATE TRIGGER IF NOT EXISTS [bank_ledger_insert] AFTER INSERT ON [{log}] BEGIN {add_new} END")
+        db.execute(f"CREATE TRIGGER IF NOT EXISTS [bank_ledger_delete] AFTER DELETE ON [{log}] BEGIN {remove_old} END")
+        db.execute(f"""CREATE TRIGGER IF NOT EXISTS [bank_ledger_update]
+            AFTER UPDATE OF {BankTable.AMNT_COL}, {BankTable.MEMBERID_COL} ON [{log}] BEGIN {remove_old} {add_new} END""")
 
-    def deleteBankLog(db:Database,xact_id:int):
-        db[BankTable.TABLE_NAME].delete(xact_id)
+        if is_new:
+            BankLedger._fill(db)
+
+    def rebuildLedger(db:Database):
+        """Recompute the ledger from the full bank log, e.g. after reconcile() reported a mismatch
+        """
+        with db.conn:
+            BankLedger._fill(db)
+
+    def _fill(db:Database):
+        t = BankLedger
+        cents = t._CENTS_SQL.format(ref=BankTable.TABLE_NAME)
+        db.execute(f"DELETE FROM [{t.BALANCE_TABLE}]")
+        db.execute(f"DELETE FROM [{t.MEMBER_TABLE}]")
+        db.execute(f"""INSERT INTO [{t.BALANCE_TABLE}] ({t.ID_COL}, {t.CENTS_COL})
+            SELECT 0, TOTAL({cents}) FROM [{BankTable.TABLE_NAME}]""")
+        db.execute(f"""INSERT INTO [{t.MEMBER_TABLE}] ({t.MEMBERID_COL}, {t.CENTS_COL}, {t.COUNT_COL})
+            SELECT {BankTable.MEMBERID_COL}, SUM({cents}), COUNT(*) FROM [{BankTable.TABLE_NAME}]
+            WHERE {BankTable.MEMBERID_COL} IS NOT NULL
+            GROUP BY {BankTable.MEMBERID_COL}""")
+
+    def balanceCents(db:Database) -> int:
+        t = BankLedger
+        return db.execute(f"SELECT {t.CENTS_COL} FROM [{t.BALANCE_TABLE}] WHERE {t.ID_COL} = 0").fetchone()[0]
+
+    def reconcile(db:Database) -> List[str]:
+        """Verify the ledger against totals recomputed from the full bank log
+
+        :param db: Database containing the bank log and ledger tables
+        :type db: sqlite_utils.Database
+        :return: Description of each mismatch; empty if the ledger is consistent
+        :rtype: List[str]
+        """
+        t = BankLedger
+        cents = t._CENTS_SQL.format(ref=BankTable.TABLE_NAME)
+        problems = []
+
+        expected = db.execute(f"SELECT CAST(TOTAL({cents}) AS INTEGER) FROM [{BankTable.TABLE_NAME}]").fetchone()[0]
+        stored = t.balanceCents(db)
+        if stored != expected:
+            problems.append(f"balance: ledger {stored} cents, log {expected} cents")
+
+        expected = {r[0] : (r[1], r[2]) for r in db.execute(f"""SELECT {BankTable.MEMBERID_COL}, SUM({cents}), COUNT(*)
+            FROM [{BankTable.TABLE_NAME}] WHERE {BankTable.MEMBERID_COL} IS NOT NULL GROUP BY {BankTable.MEMBERID_COL}""")}
+        stored = {r[0] : (r[1], r[2]) for r in db.execute(f"SELECT {t.MEMBERID_COL}, {t.CENTS_COL}, {t.COUNT_COL} FROM [{t.MEMBER_TABLE}]")}
+        for member_id in expected.keys() | stored.keys():
+            if stored.get(member_id) != expected.get(member_id):
+                problems.append(f"member {member_id}: ledger (cents, count) {stored.get(member_id)}, log {expected.get(member_id)}")
+        return problems
+
+class BankRollup():
+    """Donations pre-aggregated per (member, month), kept current by INSERT/UPDATE/DELETE triggers on the bank log.
+    Totals over a date range read the rollup for the whole months inside the range and the bank log only for the
+    partial months at its edges, so their cost depends on the length of the range rather than the size of the log.
+    Rows without a member, such as the initial balance, are not donations and are left out.
+    Undated rows, which no date range includes, are left out too: a NULL Month would never match the (Month, MemberID) key.
+    """
+    TABLE_NAME = "bank_monthly"
+    MEMBERID_COL = BankTable.MEMBERID_COL
+    MONTH_COL = "Month"
+    CENTS_COL = "Cents"
+    COUNT_COL = "Count"
+
+    # 'YYYY-MM' month of the bank log row <ref>
+    _MONTH_SQL = f"substr({{ref}}.{BankTable.DATE_COL}, 1, 7)"
+    # Whether the bank log row <ref> is counted in the rollup
+    _COUNTED_SQL = f"{{ref}}.{BankTable.MEMBERID_COL} IS NOT NULL AND {{ref}}.{BankTable.DATE_COL} IS NOT NULL"
+
+    def initRollup(db:Database):
+        """If not pre-existing, create the rollup table and its triggers, then populate it from the bank log.
+        Does not commit, so it can run inside a schema migration's transaction.
+        """
+        t = BankRollup
+        log = BankTable.TABLE_NAME
+        is_new = not db[t.TABLE_NAME].exists()
+
+        db.execute(f"""CREATE TABLE IF NOT EXISTS [{t.TABLE_NAME}] (
+            [{t.MEMBERID_COL}] INTEGER REFERENCES [{MemberTable.TABLE_NAME}]([{MemberTable.DISCORDID_COL}]),
+            [{t.MONTH_COL}] TEXT,
+            [{t.CENTS_COL}] INTEGER NOT NULL,
+            [{t.COUNT_COL}] INTEGER NOT NULL,
+            PRIMARY KEY ([{t.MONTH_COL}], [{t.MEMBERID_COL}])
+        )""")
+
+        cents = BankLedger._CENTS_SQL
+        add_new = f"""INSERT INTO [{t.TABLE_NAME}] ({t.MEMBERID_COL}, {t.MONTH_COL}, {t.CENTS_COL}, {t.COUNT_COL})
+                SELECT NEW.{t.MEMBERID_COL}, {t._MONTH_SQL.format(ref='NEW')}, {cents.format(ref='NEW')}, 1
+                WHERE {t._COUNTED_SQL.format(ref='NEW')}
+                ON CONFLICT ({t.MONTH_COL}, {t.MEMBERID_COL}) DO UPDATE SET
+                    {t.CENTS_COL} = {t.CENTS_COL} + excluded.{t.CENTS_COL}, {t.COUNT_COL} = {t.COUNT_COL} + 1;"""
+        old_key = f"{t.MEMBERID_COL} = OLD.{t.MEMBERID_COL} AND {t.MONTH_COL} = {t._MONTH_SQL.format(ref='OLD')}"
+        remove_old = f"""UPDATE [{t.TABLE_NAME}] SET {t.CENTS_COL} = {t.CENTS_COL} - {cents.format(ref='OLD')}, {t.COUNT_COL} = {t.COUNT_COL} - 1
+                WHERE {old_key};
+            DELETE FROM [{t.TABLE_NAME}] WHERE {old_key} AND {t.COUNT_COL} = 0;"""
+
+        db.execute(f"CREATE TRIGGER IF NOT EXISTS [{t.TABLE_NAME}_insert] AFTER INSERT ON [{log}] BEGIN {add_new} END")
+        db.execute(f"CREATE TRIGGER IF NOT EXISTS [{t.TABLE_NAME}_delete] AFTER DELETE ON [{log}] BEGIN {remove_old} END")
+        db.execute(f"""CREATE TRIGGER IF NOT EXISTS [{t.TABLE_NAME}_update]
+            AFTER UPDATE OF {BankTable.AMNT_COL}, {BankTable.MEMBERID_COL}, {BankTable.DATE_COL} ON [{log}] BEGIN {remove_old} {add_new} END""")
+
+        if is_new:
+            BankRollup._fill(db)
+
+    def dropRollup(db:Database):
+        """Drop the rollup table and its triggers, so initRollup recreates and refills them. Does not commit.
+        """
+        for action in ('insert', 'delete', 'update'):
+            db.execute(f"DROP TRIGGER IF EXISTS [{BankRollup.TABLE_NAME}_{action}]")
+        db.execute(f"DROP TABLE IF EXISTS [{BankRollup.TABLE_NAME}]")
+
+    def rebuildRollup(db:Database):
+        """Recompute the rollup from the full bank log
+        """
+        with db.conn:
+            BankRollup._fill(db)
+
+    def _fill(db:Database):
+        t = BankRollup
+        db.execute(f"DELETE FROM [{t.TABLE_NAME}]")
+        db.execute(f"""INSERT INTO [{t.TABLE_NAME}] ({t.MEMBERID_COL}, {t.MONTH_COL}, {t.CENTS_COL}, {t.COUNT_COL})
+            SELECT {BankTable.MEMBERID_COL}, {t._MONTH_SQL.format(ref=BankTable.TABLE_NAME)},
+                SUM({BankLedger._CENTS_SQL.format(ref=BankTable.TABLE_NAME)}), COUNT(*)
+            FROM [{BankTable.TABLE_NAME}]
+            WHERE {t._COUNTED_SQL.format(ref=BankTable.TABLE_NAME)}
+            GROUP BY 1, 2""")
+
+    def rangeParams(since:datetime.date, until:datetime.date) -> tuple:
+        """Split the inclusive date range [<since>, <until>] into the whole months read from the rollup
+        and the partial edge months read from the bank log.
+
+        :return: (first whole month, last whole month, since, start of the first whole month,
+                  day after the last whole month, until), as ISO strings. When the range holds no whole month the
+                  first edge spans it entirely and the second edge is empty.
+        :rtype: tuple
+        """
+        first = since if since.day == 1 else (since.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+        after_until = until + datetime.timedelta(days=1)
+        # First day of the month following the last whole month
+        end = after_until.replace(day=1)
+
+        if first >= end:
+            return ('9999-12', '0000-01', since.isoformat(), after_until.isoformat(), after_until.isoformat(), until.isoformat())
+        last = end - datetime.timedelta(days=1)
+        return (first.strftime('%Y-%m'), last.strftime('%Y-%m'), since.isoformat(), first.isoformat(), end.isoformat(), until.isoformat())
+
+    def reconcile(db:Database) -> List[str]:
+        """Verify the rollup against per-month totals recomputed from the full bank log
+
+        :return: Description of each mismatch; empty if the rollup is consistent
+        :rtype: List[str]
+        """
+        t = BankRollup
+        expected = {(r[0], r[1]) : (r[2], r[3]) for r in db.execute(f"""SELECT {BankTable.MEMBERID_COL},
+                {t._MONTH_SQL.format(ref=BankTable.TABLE_NAME)}, SUM({BankLedger._CENTS_SQL.format(ref=BankTable.TABLE_NAME)}), COUNT(*)
+            FROM [{BankTable.TABLE_NAME}] WHERE {t._COUNTED_SQL.format(ref=BankTable.TABLE_NAME)} GROUP BY 1, 2""")}
+        stored = {(r[0], r[1]) : (r[2], r[3]) for r in db.execute(f"""SELECT {t.MEMBERID_COL}, {t.MONTH_COL}, {t.CENTS_COL}, {t.COUNT_COL}
+            FROM [{t.TABLE_NAME}]""")}
+        return [f"member {k[0]} month {k[1]}: rollup (cents, count) {stored.get(k)}, log {expected.get(k)}"
+            for k in expected.keys() | stored.keys() if stored.get(k) != expected.get(k)]
 
 if __name__ == "__main__":
-    pass
+    import sys
+
+    # Reconcile the ledger and rollup of a database file: python BankDB.py [brisket.db]
+    db = Database(sys.argv[1] if len(sys.argv) > 1 else 'brisket.db')
+    problems = BankLedger.reconcile(db) + BankRollup.reconcile(db)
+    print('\n'.join(problems) if problems else f"Ledger consistent, balance {BankTable.formatCents(BankLedger.balanceCents(db))}")
@@ -1,33 +1,221 @@
+import sqlite3
 import sqlite_utils
 from MemberDB import MemberTable
 import WeaponDB
 import SkillDB
-from BankDB import BankTable
-from CharacterDB import CharacTable 
+from BankDB import BankTable, BankLedger, BankRollup
+from CharacterDB import CharacTable
 from sqlite_utils import Database
 
 
+class DBProfile():
+    """Connection settings applied by BrisketDB when opening a database.
+
+    :param journal_mode: SQLite journal mode of the database file, e.g. 'delete' or 'wal', defaults to 'delete'
+    :type journal_mode: str, optional
+    :param synchronous: PRAGMA synchronous level, defaults to 'FULL'
+    :type synchronous: str, optional
+    :param cache_size: PRAGMA cache_size; negative values are in KiB, defaults to -2000
+    :type cache_size: int, optional
+    :param mmap_size: PRAGMA mmap_size in bytes; 0 disables memory mapping, defaults to 0
+    :type mmap_size: int, optional
+    :param readers: Number of read-only connections serving queries alongside the writer, defaults to 0.
+                    Only used with journal_mode 'wal', where readers do not block on the writer.
+    :type readers: int, optional
+    """
+
+    def __init__(self, journal_mode:str='delete', synchronous:str='FULL', cache_size:int=-2000, mmap_size:int=0, readers:int=0):
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.readers = readers if journal_mode.lower() == 'wal' else 0
+
+    def applyPragmas(self, conn:sqlite3.Connection):
+        """Apply the per-connection settings of this profile to <conn>
+        """
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        conn.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+
+    def openReader(self, db_file:str) -> Database:
+        """Open a read-only connection to <db_file> configured with this profile.
+        The connection belongs to the calling thread.
+
+        :param db_file: Path of an existing database file
+        :type db_file: str
+        :rtype: sqlite_utils.Database
+        """
+        # check_same_thread is relaxed only so the owner can close the connection at shutdown
+        conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True, check_same_thread=False)
+        self.applyPragmas(conn)
+        conn.execute("PRAGMA query_only = 1")
+        return Database(conn)
+
+
+# Rollback journal; a single connection serves readers and writers
+DEFAULT_PROFILE = DBProfile()
+
+# Write-ahead log; one writer plus a pool of readers which are never blocked by a write in progress
+WAL_PROFILE = DBProfile(journal_mode='wal', synchronous='NORMAL', cache_size=-16000, mmap_size=64*1024*1024, readers=4)
+
+PROFILES = {
+    'default' : DEFAULT_PROFILE,
+    'wal' : WAL_PROFILE
+}
+
+
+def migrateBaseSchema(db:Database):
+    """Version 1: the original company tables and the weapon and skill catalogs.
+    Built with sqlite_utils helpers which commit as they go, so this step is written to be idempotent
+    and is safely re-run if interrupted; it also adopts databases that predate schema versioning.
+    """
+    MemberTable.initMemberTable(db)
+    MemberTable.upsertMembers(db, ["hello","world","JA","HP","GT","JH"], list(range(6)))
+    WeaponDB.WeaponCategTable.initWeaponCategTable(db)
+    WeaponDB.WeaponsTable.initWeaponTable(db)
+    WeaponDB.WeaponLogTable.initWeaponLogTable(db)
+    SkillDB.SkillCategTable.initSkillCategTable(db)
+    SkillDB.SkillTable.initSkillTable(db)
+    SkillDB.SkillLogTable.initSkillLogTable(db)
+    BankTable.initBankLogTable(db,28500.13)
+    CharacTable.initCharacLogTable(db)
+
+def migrateSkillCurrent(db:Database):
+    """Version 2: materialized current skill levels
+    """
+    SkillDB.SkillCurrentTable.initSkillCurrentTable(db)
+
+def migrateMemberActive(db:Database):
+    """Version 3: members leaving the company are flagged inactive instead of deleted
+    """
+    MemberTable.addActiveColumn(db)
+
+def migratePageIndexes(db:Database):
+    """Version 4: (filter, Date) indexes backing the keyset-paginated log views
+    """
+    BankTable.createPageIndexes(db)
+    SkillDB.SkillLogTable.createPageIndexes(db)
+    WeaponDB.WeaponLogTable.createPageIndexes(db)
+
+def migrateBankLedger(db:Database):
+    """Version 5: integer-cent running balance and per-member totals of the bank log
+    """
+    BankLedger.initLedger(db)
+
+def migrateBankRollup(db:Database):
+    """Version 6: donations pre-aggregated per member and month
+    """
+    BankRollup.initRollup(db)
+
+def migrateDates(db:Database):
+    """Version 7: log dates normalized to ISO 'YYYY-MM-DD' text, with (MemberID, Date) and (Date) indexes on every log
+    """
+    for t in (BankTable, SkillDB.SkillLogTable, WeaponDB.WeaponLogTable, CharacTable):
+        t.normalizeDates(db)
+        t.createDateIndexes(db)
+
+def migrateCoveringIndexes(db:Database):
+    """Version 8: covering indexes for every view query shape, replacing the narrower date indexes
+    """
+    BankTable.createCoveringIndexes(db)
+    SkillDB.SkillLogTable.createCoveringIndexes(db)
+    WeaponDB.WeaponLogTable.createCoveringIndexes(db)
+
+def migrateIdempotencyKeys(db:Database):
+    """Version 9: uniquely indexed idempotency keys on the bank, skill and weapon logs
+    """
+    BankTable.addIdempotencyKey(db)
+    SkillDB.SkillLogTable.addIdempotencyKey(db)
+    WeaponDB.WeaponLogTable.addIdempotencyKey(db)
+
+def migrateUnpaddedDates(db:Database):
+    """Version 10: log dates normalized again, now also fixing unpadded ones such as '2021-3-5' that version 7 missed
+    """
+    for t in (BankTable, SkillDB.SkillLogTable, WeaponDB.WeaponLogTable, CharacTable):
+        t.normalizeDates(db)
+
+def migrateUndatedRollup(db:Database):
+    """Version 11: the bank rollup rebuilt without undated rows, which its triggers could neither merge nor remove
+    """
+    BankRollup.dropRollup(db)
+    BankRollup.initRollup(db)
+
+# Ordered schema migrations; applying MIGRATIONS[i] brings a database to version i + 1.
+# Append new migrations to the end; never edit or reorder ones that have shipped.
+MIGRATIONS = [
+    migrateBaseSchema,
+    migrateSkillCurrent,
+    migrateMemberActive,
+    migratePageIndexes,
+    migrateBankLedger,
+    migrateBankRollup,
+    migrateDates,
+    migrateCoveringIndexes,
+    migrateIdempotencyKeys,
+    migrateUnpaddedDates,
+    migrateUndatedRollup,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def schemaVersion(db:Database) -> int:
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+def migrateSchema(db:Database, version:int=None):
+    """Apply, in order, every migration newer than the database's PRAGMA user_version.
+    Each migration runs in its own transaction together with the user_version bump recording it.
+
+    :param db: Database to migrate
+    :type db: sqlite_utils.Database
+    :param version: Current schema version if already read, defaults to None
+    :type version: int, optional
+    """
+    if version is None:
+        version = schemaVersion(db)
+
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        db.execute("BEGIN")
+        try:
+            MIGRATIONS[target - 1](db)
+            db.execute(f"PRAGMA user_version = {target}")
+        except:
+            if db.conn.in_transaction:
+                db.conn.rollback()
+            raise
+        db.conn.commit()
+
+
 class BrisketDB(sqlite_utils.Database):
-    """BrisketDB subclasses sqlite_utils.Database class, adding to constructor initialization of company tables
+    """BrisketDB subclasses sqlite_utils.Database class, adding to constructor initialization of company tables.
+    The schema is only touched when PRAGMA user_version shows the database is behind MIGRATIONS.
+
+    :param profile: Connection settings to apply, defaults to DEFAULT_PROFILE
+    :type profile: DBProfile, optional
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, profile:DBProfile=None, **kwargs):
         super().__init__(*args, **kwargs)
 
-        MemberTable.initMemberTable(self)
-        MemberTable.upsertMembers(self, ["hello","world","JA","HP","GT","JH"], list(range(6)))
-        WeaponDB.WeaponCategTable.initWeaponCategTable(self)
-        WeaponDB.WeaponsTable.initWeaponTable(self)
-        WeaponDB.WeaponLogTable.initWeaponLogTable(self)
-        SkillDB.SkillCategTable.initSkillCategTable(self)
-        SkillDB.SkillTable.initSkillTable(self)
-        SkillDB.SkillLogTable.initSkillLogTable(self)
-        BankTable.initBankLogTable(self,28500.13)
-        CharacTable.initCharacLogTable(self)
+        self.profile = profile if profile is not None else DEFAULT_PROFILE
+        self.conn.execute(f"PRAGMA journal_mode = {self.profile.journal_mode}")
+        self.profile.applyPragmas(self.conn)
+
+        version = schemaVersion(self)
+        if version < SCHEMA_VERSION:
+            migrateSchema(self, version)
+
+        self.weapon_leaderboard = WeaponDB.WeaponLeaderboard()
+        self.weapon_leaderboard.load(self)
+
+    def resetCaches(self):
+        """Reload in-memory state derived from the database, e.g. after rolling back a transaction that had updated it
+        """
+        self.weapon_leaderboard.load(self)
 
 
 if __name__ == "__main__":
     db = BrisketDB('test.db')
     print(db.table_names())
+    print(f"Schema version {schemaVersion(db)}")
     for t_name in db.table_names():
-        print(db[t_name].schema)
\ No newline at end of file
+        print(db[t_name].schema)
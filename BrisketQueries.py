@@ -0,0 +1,436 @@
+"""
+Registry of the named SQL statements behind the bot's view commands.
+
+Each view shape has exactly one canonical statement, written with ``?`` placeholders, so every call of a shape
+sends identical SQL text and is served from sqlite3's per-connection statement cache instead of being re-parsed
+and re-planned. User-supplied values only ever reach SQLite as bound parameters.
+The registry also records the call count and execution time of each statement, and reports the slow ones,
+with their query plans, to the SlowQueryLog set as the ``slow_log`` attribute of the database they ran on, if any.
+"""
+import logging
+import logging.handlers
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from sqlite_utils import Database
+
+from MemberDB import MemberTable
+from BankDB import BankTable, BankLedger, BankRollup
+from SkillDB import SkillLogTable, SkillCurrentTable
+from WeaponDB import WeaponLogTable
+
+
+class QueryRegistry():
+    """Maps query names to SQL text and keeps per-name execution statistics
+    """
+
+    def __init__(self):
+        self._sql = {}
+        self._stats = {}
+        self._page_keys = {}
+        self._lock = threading.Lock()
+
+    def register(self, name:str, sql:str):
+        """Register <sql> under <name>
+
+        :raises ValueError: If <name> is already registered
+        """
+        if name in self._sql:
+            raise ValueError(f"Query '{name}' is already registered")
+        self._sql[name] = sql
+        self._stats[name] = {'calls' : 0, 'total_s' : 0.0, 'max_s' : 0.0}
+
+    def registerPaged(self, name:str, select:str, source:str, where:str, key:Tuple[str, str], descending:bool=True):
+        """Register a view ordered by <key> (a date column and the primary key) together with its keyset continuations.
+
+        Three queries list every row, each taking the <where> parameters first and the page size last:
+            <name>         first page
+            <name>.next    page following a key, in view order; takes (date, pk) before the page size
+            <name>.prev    page preceding a key, in reverse view order; takes (date, pk) before the page size
+        Undated rows are included, ordered as older than any dated one, and a key's date may be None.
+        <name>.range, <name>.range.next and <name>.range.prev only list the rows dated within an inclusive
+        (since, until) range, taken right after the <where> parameters.
+        Every page is a range scan of an index on (<where> columns, date), so its cost does not depend on its depth.
+
+        :param name: Name of the first-page query
+        :type name: str
+        :param select: Selected columns
+        :type select: str
+        :param source: FROM clause; the paged table must be aliased as l
+        :type source: str
+        :param where: Filter on l, or an empty string
+        :type where: str
+        :param key: Date column and primary key column of l
+        :type key: Tuple[str, str]
+        :param descending: Whether the view lists newest entries first, defaults to True
+        :type descending: bool, optional
+        """
+        date_col, pk_col = key
+        keyset = f"(l.{date_col}, l.{pk_col})"
+
+        def order(desc, prefix='l.'):
+            direction = 'DESC' if desc else 'ASC'
+            return f"ORDER BY {prefix}{date_col} {direction}, {prefix}{pk_col} {direction}"
+
+        def query(conds, desc):
+            where_sql = f"WHERE {' AND '.join(conds)}" if conds else ""
+            return f"SELECT {select}\n    FROM {source}\n    {where_sql}\n    {order(desc)}\n    LIMIT ?"
+
+        # Undated rows would need an OR next to any date comparison, which no index range serves.
+        # The open views instead merge two index range scans, one over the dated rows and one over the undated ones,
+        # ordered like SQLite orders NULLs: below every date. Both halves take the same numbered parameters.
+        filters = [re.sub(r'\?', lambda _, n=iter(range(1, 100)): f"?{next(n)}", where)] if where else []
+        d, pk = (f"?{paramCount(where) + i}" for i in (1, 2))
+
+        def merged(dated, undated, desc):
+            halves = [f"SELECT {select}\n    FROM {source}\n    WHERE {' AND '.join(filters + [c])}" for c in (dated, undated)]
+            return f"{halves[0]}\nUNION ALL\n{halves[1]}\n    {order(desc, prefix='')}\n    LIMIT ?"
+
+        undated = f"l.{date_col} IS NULL"
+        # Rows past the key (<d>, <pk>) in ascending and descending order; <d> is None for an undated row
+        greater = (f"{keyset} > (COALESCE({d}, ''), {pk})", f"{undated} AND {d} IS NULL AND l.{pk_col} > {pk}")
+        less = (f"{keyset} < ({d}, {pk})", f"{undated} AND ({d} IS NOT NULL OR l.{pk_col} < {pk})")
+        self.register(name, merged(f"l.{date_col} IS NOT NULL", undated, descending))
+        self.register(f"{name}.next", merged(*(less if descending else greater), descending))
+        self.register(f"{name}.prev", merged(*(greater if descending else less), not descending))
+        self._page_keys[name] = key
+
+        conds = ([where] if where else []) + [f"l.{date_col} BETWEEN ? AND ?"]
+        self.register(f"{name}.range", query(conds, descending))
+        self.register(f"{name}.range.next", query(conds + [f"{keyset} {'<' if descending else '>'} (?, ?)"], descending))
+        self.register(f"{name}.range.prev", query(conds + [f"{keyset} {'>' if descending else '<'} (?, ?)"], not descending))
+        self._page_keys[f"{name}.range"] = key
+
+    def pageKey(self, name:str) -> Tuple[str, str]:
+        """(date, primary key) columns ordering a view registered with registerPaged
+
+        :raises KeyError: If <name> is not a paged view
+        """
+        return self._page_keys[name]
+
+    def sql(self, name:str) -> str:
+        return self._sql[name]
+
+    def names(self) -> List[str]:
+        return list(self._sql)
+
+    def execute(self, db:Database, name:str, params=()) -> List[dict]:
+        """Run the named query on <db> and return all result rows as dictionaries
+
+        :param db: Database to query
+        :type db: sqlite_utils.Database
+        :param name: Registered query name
+        :type name: str
+        :param params: Values bound to the query's placeholders, defaults to ()
+        :type params: Union[tuple, list, dict], optional
+        :rtype: List[dict]
+        """
+        columns, rows = self.executeTable(db, name, params)
+        return [dict(zip(columns, r)) for r in rows]
+
+    def executeTable(self, db:Database, name:str, params=()) -> Tuple[List[str], List[tuple]]:
+        """Run the named query on <db> and return its column names and the raw row tuples
+
+        :param db: Database to query
+        :type db: sqlite_utils.Database
+        :param name: Registered query name
+        :type name: str
+        :param params: Values bound to the query's placeholders, defaults to ()
+        :type params: Union[tuple, list, dict], optional
+        :rtype: Tuple[List[str], List[tuple]]
+        """
+        sql = self._sql[name]
+        start = time.perf_counter()
+        cursor = db.execute(sql, params)
+        rows = cursor.fetchall()
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            stats = self._stats[name]
+            stats['calls'] += 1
+            stats['total_s'] += elapsed
+            stats['max_s'] = max(stats['max_s'], elapsed)
+        slow_log = getattr(db, 'slow_log', None)
+        if slow_log is not None:
+            slow_log.observe(db, name, sql, params, elapsed)
+        return [d[0] for d in cursor.description], rows
+
+    def fullScans(self, db:Database) -> Dict[str, List[str]]:
+        """EXPLAIN QUERY PLAN every registered query and collect the steps that read a whole table or index.
+        Scans of subquery results, table-valued functions and constant rows are not counted.
+
+        :param db: Database with the current schema
+        :type db: sqlite_utils.Database
+        :return: Query name -> offending plan steps, for queries having any
+        :rtype: Dict[str, List[str]]
+        """
+        scans = {}
+        for name, sql in self._sql.items():
+            plan = [r[3] for r in db.execute(f"EXPLAIN QUERY PLAN {sql}", [None] * paramCount(sql))]
+            subqueries = {step.split()[-1] for step in plan if step.startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+            bad = [step for step in plan if step.startswith('SCAN ')
+                and step.split()[1] not in subqueries and 'VIRTUAL TABLE' not in step and step != 'SCAN CONSTANT ROW']
+            if bad:
+                scans[name] = bad
+        return scans
+
+    def stats(self) -> dict:
+        """Per-query call counts and timings in milliseconds, for queries called at least once
+        """
+        with self._lock:
+            return {name : {
+                    'calls' : s['calls'],
+                    'total_ms' : 1000 * s['total_s'],
+                    'mean_ms' : 1000 * s['total_s'] / s['calls'],
+                    'max_ms' : 1000 * s['max_s']
+                } for name, s in self._stats.items() if s['calls']}
+
+
+def paramCount(sql:str) -> int:
+    """Number of parameters bound by <sql>, whose placeholders are ``?`` or numbered ``?NNN``.
+    Like SQLite, a plain ``?`` takes the number following the largest one used before it.
+    """
+    count = 0
+    for number in re.findall(r'\?(\d*)', sql):
+        count = max(count, int(number)) if number else count + 1
+    return count
+
+def queryPlan(db:Database, sql:str, params=()) -> List[str]:
+    """EXPLAIN QUERY PLAN of <sql> bound to <params>, one step per line, indented by depth in the plan tree
+    """
+    depth = {0 : -1}
+    lines = []
+    for step_id, parent, _, detail in db.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+        depth[step_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[step_id] + detail)
+    return lines
+
+
+class SlowQueryLog():
+    """Logs query executions slower than a threshold, with their bound parameters, duration and query plan.
+
+    Executions are deduplicated by query shape (the registered name, i.e. identical SQL text): the first slow execution
+    of a shape is logged in full, and the query plan is captured only then. Later ones are counted, and summarized
+    whenever the count of a shape reaches a power of two.
+
+    :param threshold_ms: Executions taking at least this many milliseconds are slow, defaults to 100
+    :type threshold_ms: float, optional
+    :param logger: Logger receiving the entries, defaults to the 'brisket.slowqueries' logger
+    :type logger: logging.Logger, optional
+    """
+
+    def __init__(self, threshold_ms:float=100, logger:logging.Logger=None):
+        self.threshold_s = threshold_ms / 1000
+        self.logger = logger if logger is not None else logging.getLogger('brisket.slowqueries')
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def observe(self, db:Database, name:str, sql:str, params, elapsed:float):
+        """Account for an execution of query shape <name> which took <elapsed> seconds.
+        Must be called on the thread owning <db>, which is used to explain new slow shapes.
+        """
+        if elapsed < self.threshold_s:
+            return
+
+        with self._lock:
+            shape = self._shapes.setdefault(name, {'count' : 0, 'max_s' : 0.0})
+            shape['count'] += 1
+            shape['max_s'] = max(shape['max_s'], elapsed)
+            count, max_s = shape['count'], shape['max_s']
+
+        if count == 1:
+            try:
+                plan = queryPlan(db, sql, params)
+            except Exception as err:
+                plan = [f"(EXPLAIN failed: {err})"]
+            self.logger.warning("Slow query %s: %.1f ms\n  params: %r\n  sql: %s\n  plan:\n%s", name, 1000 * elapsed, params,
+                ' '.join(sql.split()), '\n'.join('    ' + step for step in plan))
+        elif count & (count - 1) == 0:
+            self.logger.warning("Slow query %s: %d slow executions, slowest %.1f ms; latest %.1f ms with params %r",
+                name, count, 1000 * max_s, 1000 * elapsed, params)
+
+    def shapes(self) -> Dict[str, dict]:
+        """Slow execution count and slowest duration in milliseconds of every shape logged so far
+        """
+        with self._lock:
+            return {name : {'count' : s['count'], 'max_ms' : 1000 * s['max_s']} for name, s in self._shapes.items()}
+
+def openSlowQueryLog(path:str, threshold_ms:float=100, max_bytes:int=1024*1024, backups:int=3) -> SlowQueryLog:
+    """A SlowQueryLog writing to the file <path>, rotated once it reaches <max_bytes> with <backups> old files kept.
+    Each file has its own logger, whose entries do not propagate to the other handlers of the 'brisket' loggers.
+    The file handler is attached once per path, however many logs are opened on it.
+    """
+    path = os.path.abspath(path)
+    logger = _slow_loggers.get(path)
+    if logger is None:
+        logger = logging.getLogger(f'brisket.slowqueries.file{len(_slow_loggers)}')
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+        _slow_loggers[path] = logger
+    return SlowQueryLog(threshold_ms, logger)
+
+# Absolute path -> logger writing to that file, see openSlowQueryLog
+_slow_loggers : Dict[str, logging.Logger] = {}
+
+
+QUERIES = QueryRegistry()
+
+# Bounds of an open date range; dates are stored as ISO 'YYYY-MM-DD' text
+MIN_DATE = '0000-01-01'
+MAX_DATE = '9999-12-31'
+
+## Members ######################################################
+# Member names are resolved in SQL: every view LEFT JOINs the members table and returns a Member column
+# next to MemberID. Member is NULL only for IDs never recorded in the members table.
+_MEMBER_JOIN = f"LEFT JOIN {MemberTable.TABLE_NAME} m ON m.{MemberTable.DISCORDID_COL} = l.{{}}"
+MEMBER_NAME_COL = "Member"
+_MEMBER_NAME = f"m.{MemberTable.NAME_COL} AS {MEMBER_NAME_COL}"
+
+# (json array of member_ids); names for rows that do not come from SQL, e.g. the weapon leaderboard
+# CROSS JOIN pins the ID list as the outer loop, so members is only ever searched by primary key
+QUERIES.register('members.names', f"""SELECT m.{MemberTable.DISCORDID_COL}, m.{MemberTable.NAME_COL}
+    FROM json_each(?) ids CROSS JOIN {MemberTable.TABLE_NAME} m ON m.{MemberTable.DISCORDID_COL} = ids.value""")
+
+def _registerBestInRange(name:str, log, select:str, filter_col:str, partition_col:str, limit:bool):
+    """Register a ranking of the best (highest level, then earliest) entry of <log> per <partition_col>,
+    among the entries matching <filter_col> that are dated within a range.
+    Takes (filter value, since, until) and, if <limit>, the number of rows.
+    """
+    QUERIES.register(name, f"""SELECT {select}
+    FROM (
+        SELECT *, ROW_NUMBER() OVER (PARTITION BY {partition_col} ORDER BY {log.LEVEL_COL} DESC, {log.UPDATEID_COL} ASC) AS rank
+        FROM {log.TABLE_NAME}
+        WHERE {filter_col} = ? AND {log.DATE_COL} BETWEEN ? AND ?
+    ) l {_MEMBER_JOIN.format(log.MEMBERID_COL)}
+    WHERE l.rank = 1
+    ORDER BY l.{log.LEVEL_COL} DESC, l.{log.UPDATEID_COL} ASC""" + ("\n    LIMIT ?" if limit else ""))
+
+## Bank #########################################################
+# Log views are keyset-paginated on (Date, primary key); see QueryRegistry.registerPaged
+_BANK_COLS = f"""l.{BankTable.XACTID_COL}, l.{BankTable.DATE_COL}, l.{BankTable.MEMBERID_COL}, {_MEMBER_NAME},
+    l.{BankTable.AMNT_COL}, l.{BankTable.NOTE_COL}"""
+_BANK_FROM = f"{BankTable.TABLE_NAME} l {_MEMBER_JOIN.format(BankTable.MEMBERID_COL)}"
+
+_BANK_KEY = (BankTable.DATE_COL, BankTable.XACTID_COL)
+
+# (lastn)
+QUERIES.registerPaged('bank.view.recent', _BANK_COLS, _BANK_FROM, "", _BANK_KEY)
+
+# (member_id, lastn)
+QUERIES.registerPaged('bank.view.member', _BANK_COLS, _BANK_FROM, f"l.{BankTable.MEMBERID_COL} = ?", _BANK_KEY)
+
+# Ledger lookups, in integer cents
+QUERIES.register('bank.balance', f"SELECT {BankLedger.CENTS_COL} AS cents FROM {BankLedger.BALANCE_TABLE} WHERE {BankLedger.ID_COL} = 0")
+
+# (member_id)
+QUERIES.register('bank.member_total', f"""SELECT {BankLedger.CENTS_COL} AS cents, {BankLedger.COUNT_COL} AS count
+    FROM {BankLedger.MEMBER_TABLE}
+    WHERE {BankLedger.MEMBERID_COL} = ?""")
+
+# (first month, last month, since, edge end, edge start, until, top); see BankRollup.rangeParams.
+# Whole months come from the rollup, the partial months at either edge from the log's Date index.
+_LOG_CENTS = BankLedger._CENTS_SQL.format(ref='b')
+QUERIES.register('bank.stats.donors', f"""SELECT l.{BankTable.MEMBERID_COL}, {_MEMBER_NAME}, SUM(l.cents) AS cents, SUM(l.n) AS count
+    FROM (
+        SELECT {BankRollup.MEMBERID_COL}, {BankRollup.CENTS_COL} AS cents, {BankRollup.COUNT_COL} AS n
+            FROM {BankRollup.TABLE_NAME} WHERE {BankRollup.MONTH_COL} BETWEEN ? AND ?
+        UNION ALL
+        SELECT b.{BankTable.MEMBERID_COL}, {_LOG_CENTS}, 1
+            FROM {BankTable.TABLE_NAME} b WHERE b.{BankTable.DATE_COL} >= ? AND b.{BankTable.DATE_COL} < ? AND b.{BankTable.MEMBERID_COL} IS NOT NULL
+        UNION ALL
+        SELECT b.{BankTable.MEMBERID_COL}, {_LOG_CENTS}, 1
+            FROM {BankTable.TABLE_NAME} b WHERE b.{BankTable.DATE_COL} >= ? AND b.{BankTable.DATE_COL} <= ? AND b.{BankTable.MEMBERID_COL} IS NOT NULL
+    ) l {_MEMBER_JOIN.format(BankTable.MEMBERID_COL)}
+    GROUP BY l.{BankTable.MEMBERID_COL}
+    ORDER BY cents DESC
+    LIMIT ?""")
+
+## Skills #######################################################
+_SKILL_LOG_COLS = f"""l.{SkillLogTable.UPDATEID_COL}, l.{SkillLogTable.DATE_COL}, l.{SkillLogTable.MEMBERID_COL}, {_MEMBER_NAME},
+    l.{SkillLogTable.SKILLID_COL}, l.{SkillLogTable.LEVEL_COL}"""
+_SKILL_LOG_FROM = f"{SkillLogTable.TABLE_NAME} l {_MEMBER_JOIN.format(SkillLogTable.MEMBERID_COL)}"
+_SKILL_CURRENT_COLS = f"""l.{SkillCurrentTable.UPDATEID_COL}, l.{SkillCurrentTable.DATE_COL}, l.{SkillCurrentTable.MEMBERID_COL}, {_MEMBER_NAME},
+    l.{SkillCurrentTable.SKILLID_COL}, l.{SkillCurrentTable.LEVEL_COL}"""
+_SKILL_CURRENT_FROM = f"{SkillCurrentTable.TABLE_NAME} l {_MEMBER_JOIN.format(SkillCurrentTable.MEMBERID_COL)}"
+
+_SKILL_LOG_KEY = (SkillLogTable.DATE_COL, SkillLogTable.UPDATEID_COL)
+
+# (lastn)
+QUERIES.registerPaged('skill.view.recent', _SKILL_LOG_COLS, _SKILL_LOG_FROM, "", _SKILL_LOG_KEY)
+
+# (skill_id, member_id, lastn)
+QUERIES.registerPaged('skill.view.member_skill', _SKILL_LOG_COLS, _SKILL_LOG_FROM,
+    f"l.{SkillLogTable.SKILLID_COL} = ? AND l.{SkillLogTable.MEMBERID_COL} = ?", _SKILL_LOG_KEY)
+
+# (skill_id, lastn)
+QUERIES.registerPaged('skill.view.skill', _SKILL_LOG_COLS, _SKILL_LOG_FROM,
+    f"l.{SkillLogTable.SKILLID_COL} = ?", _SKILL_LOG_KEY, descending=False)
+
+# (skill_id, lastn)
+QUERIES.register('skill.view.skill_best', f"""SELECT {_SKILL_CURRENT_COLS}
+    FROM {_SKILL_CURRENT_FROM}
+    WHERE l.{SkillCurrentTable.SKILLID_COL} = ?
+    ORDER BY l.{SkillCurrentTable.LEVEL_COL} DESC
+    LIMIT ?""")
+
+# (member_id)
+QUERIES.register('skill.view.member_best', f"""SELECT {_SKILL_CURRENT_COLS}
+    FROM {_SKILL_CURRENT_FROM}
+    WHERE l.{SkillCurrentTable.MEMBERID_COL} = ?
+    ORDER BY l.{SkillCurrentTable.LEVEL_COL} DESC""")
+
+# Best levels reached within a date range are ranked from the log instead of the materialized current levels
+# (skill_id, since, until, lastn)
+_registerBestInRange('skill.view.skill_best.range', SkillLogTable, _SKILL_LOG_COLS,
+    SkillLogTable.SKILLID_COL, SkillLogTable.MEMBERID_COL, limit=True)
+# (member_id, since, until)
+_registerBestInRange('skill.view.member_best.range', SkillLogTable, _SKILL_LOG_COLS,
+    SkillLogTable.MEMBERID_COL, SkillLogTable.SKILLID_COL, limit=False)
+
+## Weapons ######################################################
+# Best-level views are served by WeaponDB.WeaponLeaderboard
+_WEAPON_LOG_COLS = f"""l.{WeaponLogTable.UPDATEID_COL}, l.{WeaponLogTable.DATE_COL}, l.{WeaponLogTable.MEMBERID_COL}, {_MEMBER_NAME},
+    l.{WeaponLogTable.WEAPONID_COL}, l.{WeaponLogTable.LEVEL_COL}"""
+_WEAPON_LOG_FROM = f"{WeaponLogTable.TABLE_NAME} l {_MEMBER_JOIN.format(WeaponLogTable.MEMBERID_COL)}"
+
+_WEAPON_LOG_KEY = (WeaponLogTable.DATE_COL, WeaponLogTable.UPDATEID_COL)
+
+# (lastn)
+QUERIES.registerPaged('weapon.view.recent', _WEAPON_LOG_COLS, _WEAPON_LOG_FROM, "", _WEAPON_LOG_KEY)
+
+# (weapon_id, member_id, lastn)
+QUERIES.registerPaged('weapon.view.member_weapon', _WEAPON_LOG_COLS, _WEAPON_LOG_FROM,
+    f"l.{WeaponLogTable.WEAPONID_COL} = ? AND l.{WeaponLogTable.MEMBERID_COL} = ?", _WEAPON_LOG_KEY)
+
+# (weapon_id, lastn)
+QUERIES.registerPaged('weapon.view.weapon', _WEAPON_LOG_COLS, _WEAPON_LOG_FROM,
+    f"l.{WeaponLogTable.WEAPONID_COL} = ?", _WEAPON_LOG_KEY, descending=False)
+
+# Best levels reached within a date range; unbounded rankings come from WeaponDB.WeaponLeaderboard
+# (weapon_id, since, until, lastn)
+_registerBestInRange('weapon.view.weapon_best.range', WeaponLogTable, _WEAPON_LOG_COLS,
+    WeaponLogTable.WEAPONID_COL, WeaponLogTable.MEMBERID_COL, limit=True)
+# (member_id, since, until)
+_registerBestInRange('weapon.view.member_best.range', WeaponLogTable, _WEAPON_LOG_COLS,
+    WeaponLogTable.MEMBERID_COL, WeaponLogTable.WEAPONID_COL, limit=False)
+
+
+if __name__ == "__main__":
+    import sys
+    from BrisketDB import BrisketDB
+
+    # Plan check: every registered query shape must be served by index searches.
+    # Checks a freshly migrated schema, or the database file given as argument (migrated first if behind),
+    # whose sqlite_stat1 statistics may steer the planner differently.
+    # python BrisketQueries.py [brisket.db]
+    db = BrisketDB(sys.argv[1]) if len(sys.argv) > 1 else BrisketDB(memory=True)
+    scans = QUERIES.fullScans(db)
+    for name, steps in scans.items():
+        print(f"{name}: {'; '.join(steps)}")
+    print(f"{len(QUERIES.names())} queries checked, {len(scans)} with full scans")
+    sys.exit(1 if scans else 0)
@@ -1,8 +1,10 @@
 import datetime
 import sqlite3 as sql
+from typing import List
 from sqlite_utils import Database
 
 from MemberDB import MemberTable
+import brisketutils
 # from MemberTable import MemberTable
 
 class CharacTable():
@@ -11,6 +13,8 @@ class CharacTable():
     DATE_COL = "Date"
     MEMBERID_COL = "MemberID"
     LEVEL_COL = "CharacterLevel"
+    DATE_IDX = "idx_characterlevellog_date"
+    MEMBER_DATE_IDX = "idx_characterlevellog_member_date"
 
     def initCharacLogTable(db:Database):
         char_table = db[CharacTable.TABLE_NAME]
@@ -27,13 +31,32 @@ class CharacTable():
             if 'already exists' in str(err):
                 pass
     
-    def insertCharacLog(db:Database, member_id:int, lvl:int, date:datetime.date=None):
-        table_data = {
+    def normalizeDates(db:Database):
+        """Rewrite logged dates as ISO text so date ranges compare chronologically. Does not commit.
+        """
+        brisketutils.normalizeDates(db, CharacTable.TABLE_NAME, CharacTable.DATE_COL)
+
+    def createDateIndexes(db:Database):
+        """Index logged dates by (Date) and (MemberID, Date). Does not commit.
+        """
+        t = CharacTable
+        db.execute(f"CREATE INDEX IF NOT EXISTS [{t.DATE_IDX}] ON [{t.TABLE_NAME}] ([{t.DATE_COL}])")
+        db.execute(f"CREATE INDEX IF NOT EXISTS [{t.MEMBER_DATE_IDX}] ON [{t.TABLE_NAME}] ([{t.MEMBERID_COL}], [{t.DATE_COL}])")
+
+    def buildCharacLog(member_id:int, lvl:int, date:datetime.date=None) -> dict:
+        return {
             CharacTable.MEMBERID_COL : member_id,
             CharacTable.LEVEL_COL : lvl,
             CharacTable.DATE_COL : date
         }
-        db[CharacTable.TABLE_NAME].insert(table_data)
+
+    def insertCharacLogs(db:Database, records:List[dict]) -> List[int]:
+        # Does not commit; see brisketutils.insertRecords
+        return brisketutils.insertRecords(db, CharacTable.TABLE_NAME, records)
+
+    def insertCharacLog(db:Database, member_id:int, lvl:int, date:datetime.date=None) -> int:
+        with db.conn:
+            return CharacTable.insertCharacLogs(db, [CharacTable.buildCharacLog(member_id, lvl, date)])[0]
     
     def updateCharacLog(db:Database, log_id:int, lvl:int=None, date:datetime.date=None):
         table_data = {}
@@ -45,9 +68,11 @@ class CharacTable():
         # Execute update if table data is non-empty
         if table_data:
             db[CharacTable.TABLE_NAME].update(log_id, table_data)
+            brisketutils.TABLE_VERSIONS.bump(CharacTable.TABLE_NAME)
 
     def deleteCharacLog(db:Database, id:int):
         db[CharacTable.TABLE_NAME].delete(id)
+        brisketutils.TABLE_VERSIONS.bump(CharacTable.TABLE_NAME)
 
     
     if __name__ == "__main__":
@@ -1,11 +1,13 @@
 import sqlite3 as sql
 from sqlite_utils import Database
-from typing import List, Union
+from typing import Dict, Iterable, List, Tuple, Union
+from brisketutils import TABLE_VERSIONS
 
 class MemberTable():
     TABLE_NAME = "members"
     DISCORDID_COL = "DiscordID"
     NAME_COL = "Name"
+    ACTIVE_COL = "Active"
     DISCORD_IDX = "idx_discord_id"
 
     def initMemberTable(db : Database):
@@ -33,9 +35,71 @@ class MemberTable():
             raise TypeError("Member names and IDs must be either a string and int or a list of strings and a list of ints")
 
         db[MemberTable.TABLE_NAME].upsert_all(table_data,pk=MemberTable.DISCORDID_COL)
+        TABLE_VERSIONS.bump(MemberTable.TABLE_NAME)
 
     def deleteMember(db:Database,discord_id:int):
         db[MemberTable.TABLE_NAME].delete(discord_id)
+        TABLE_VERSIONS.bump(MemberTable.TABLE_NAME)
+
+    def addActiveColumn(db:Database):
+        """Add the Active flag to the members table. Members leaving the company are marked inactive rather than
+        deleted, so their logged history keeps resolving to a name. Does not commit.
+        """
+        db.execute(f"ALTER TABLE [{MemberTable.TABLE_NAME}] ADD COLUMN [{MemberTable.ACTIVE_COL}] INTEGER NOT NULL DEFAULT 1")
+
+    def activeMembers(db:Database) -> Dict[int, str]:
+        """Snapshot of the active members as stored in the database
+
+        :return: Discord ID -> name
+        :rtype: Dict[int, str]
+        """
+        rows = db.execute(f"SELECT {MemberTable.DISCORDID_COL}, {MemberTable.NAME_COL} FROM [{MemberTable.TABLE_NAME}] WHERE {MemberTable.ACTIVE_COL} = 1")
+        return dict(rows.fetchall())
+
+    def setMember(db:Database, discord_id:int, member_name:str):
+        """Insert or rename a single member, marking them active
+        """
+        with db.conn:
+            MemberTable._writeMembers(db, {discord_id : member_name})
+
+    def deactivateMember(db:Database, discord_id:int):
+        with db.conn:
+            MemberTable._deactivate(db, [discord_id])
+
+    def syncMembers(db:Database, current:Dict[int, str]) -> Tuple[int, int]:
+        """Bring the active members in line with <current>, writing only the rows that differ.
+        New and renamed members are upserted; active members absent from <current> are marked inactive.
+
+        :param db: Database containing the members table
+        :type db: sqlite_utils.Database
+        :param current: Discord ID -> display name of everyone who should be active
+        :type current: Dict[int, str]
+        :return: Number of members written and number deactivated
+        :rtype: Tuple[int, int]
+        """
+        stored = MemberTable.activeMembers(db)
+        changed = {i : name for i, name in current.items() if stored.get(i) != name}
+        removed = stored.keys() - current.keys()
+
+        with db.conn:
+            MemberTable._writeMembers(db, changed)
+            MemberTable._deactivate(db, removed)
+        return len(changed), len(removed)
+
+    def _writeMembers(db:Database, members:Dict[int, str]):
+        db.conn.executemany(f"""INSERT INTO [{MemberTable.TABLE_NAME}] ({MemberTable.DISCORDID_COL}, {MemberTable.NAME_COL}, {MemberTable.ACTIVE_COL})
+            VALUES (?, ?, 1)
+            ON CONFLICT ({MemberTable.DISCORDID_COL}) DO UPDATE SET {MemberTable.NAME_COL} = excluded.{MemberTable.NAME_COL}, {MemberTable.ACTIVE_COL} = 1""",
+            list(members.items()))
+        if members:
+            TABLE_VERSIONS.bump(MemberTable.TABLE_NAME)
+
+    def _deactivate(db:Database, discord_ids:Iterable[int]):
+        params = [(i,) for i in discord_ids]
+        db.conn.executemany(f"UPDATE [{MemberTable.TABLE_NAME}] SET {MemberTable.ACTIVE_COL} = 0 WHERE {MemberTable.DISCORDID_COL} = ?",
+            params)
+        if params:
+            TABLE_VERSIONS.bump(MemberTable.TABLE_NAME)
 
 if __name__ == "__main__":
     import sqlite3 as sql
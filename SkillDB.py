@@ -9,6 +9,8 @@ Contains classes defining three database tables for tracking member trade skills
 
 3. SkillLogTable - Table containing dates of when a member achieved a trade skill level
 
+4. SkillCurrentTable - Each member's highest logged level in each skill, kept in sync with SkillLogTable by triggers
+
 For each table, three methods are defined
 """
 from os import name
@@ -16,6 +18,7 @@ import random
 from sqlite_utils import Database
 import sqlite3 as sql
 import datetime
+from typing import List, Optional, Tuple
 from MemberDB import MemberTable
 from enum import Enum, IntEnum, auto
 import brisketutils
@@ -95,6 +98,55 @@ class SkillLogTable():
     MEMBERID_COL = "MemberID"
     SKILLID_COL = "SKillID"
     LEVEL_COL = "Level"
+    DATE_IDX = "idx_skilllogs_date"
+    SKILL_DATE_IDX = "idx_skilllogs_skill_date"
+    MEMBER_SKILL_DATE_IDX = "idx_skilllogs_member_skill_date"
+    MEMBER_DATE_IDX = "idx_skilllogs_member_date"
+    # Covering replacements of the four date indexes above (schema version 8)
+    DATE_COVER_IDX = "idx_skilllogs_date_cover"
+    SKILL_DATE_COVER_IDX = "idx_skilllogs_skill_date_cover"
+    MEMBER_SKILL_DATE_COVER_IDX = "idx_skilllogs_member_skill_date_cover"
+    MEMBER_DATE_COVER_IDX = "idx_skilllogs_member_date_cover"
+    # Interaction ID of the command that logged the row; a retried command cannot log it twice (schema version 9)
+    IDEMKEY_COL = "IdemKey"
+    IDEMKEY_IDX = "idx_skilllogs_idemkey"
+
+    def createPageIndexes(db:Database):
+        """Create the indexes serving the date-ordered, keyset-paginated skill log views. Does not commit.
+        """
+        t = SkillLogTable
+        db.execute(f"CREATE INDEX IF NOT EXISTS [{t.DATE_IDX}] ON [{t.TABLE_NAME}] ([{t.DATE_COL}])")
+        db.execute(f"CREATE INDEX IF NOT EXISTS [{t.SKILL_DATE_IDX}] ON [{t.TABLE_NAME}] ([{t.SKILLID_COL}], [{t.DATE_COL}])")
+        db.execute(f"""CREATE INDEX IF NOT EXISTS [{t.MEMBER_SKILL_DATE_IDX}]
+            ON [{t.TABLE_NAME}] ([{t.MEMBERID_COL}], [{t.SKILLID_COL}], [{t.DATE_COL}])""")
+
+    def createCoveringIndexes(db:Database):
+        """Replace the date indexes with covering ones holding every column the skill views select,
+        so view pages and date-range rankings are read from the index alone. Does not commit.
+        """
+        t = SkillLogTable
+        brisketutils.replaceIndexes(db, t.TABLE_NAME, {
+            t.DATE_COVER_IDX : [t.DATE_COL, t.MEMBERID_COL, t.SKILLID_COL, t.LEVEL_COL],
+            t.SKILL_DATE_COVER_IDX : [t.SKILLID_COL, t.DATE_COL, t.MEMBERID_COL, t.LEVEL_COL],
+            t.MEMBER_SKILL_DATE_COVER_IDX : [t.MEMBERID_COL, t.SKILLID_COL, t.DATE_COL, t.LEVEL_COL],
+            t.MEMBER_DATE_COVER_IDX : [t.MEMBERID_COL, t.DATE_COL, t.SKILLID_COL, t.LEVEL_COL]
+        }, [t.DATE_IDX, t.SKILL_DATE_IDX, t.MEMBER_SKILL_DATE_IDX, t.MEMBER_DATE_IDX])
+
+    def addIdempotencyKey(db:Database):
+        """Add the uniquely indexed idempotency key column. Does not commit.
+        """
+        brisketutils.addIdempotencyKey(db, SkillLogTable.TABLE_NAME, SkillLogTable.IDEMKEY_COL, SkillLogTable.IDEMKEY_IDX)
+
+    def normalizeDates(db:Database):
+        """Rewrite logged dates as ISO text so date ranges compare chronologically. Does not commit.
+        """
+        brisketutils.normalizeDates(db, SkillLogTable.TABLE_NAME, SkillLogTable.DATE_COL)
+
+    def createDateIndexes(db:Database):
+        """Index logged dates by (MemberID, Date) for the date-range filters of the skill views. Does not commit.
+        """
+        t = SkillLogTable
+        db.execute(f"CREATE INDEX IF NOT EXISTS [{t.MEMBER_DATE_IDX}] ON [{t.TABLE_NAME}] ([{t.MEMBERID_COL}], [{t.DATE_COL}])")
 
     def initSkillLogTable(db: Database):
         """If not pre-existing, create the skill log table in database <db>
@@ -124,7 +176,31 @@ class SkillLogTable():
             else:
                 raise err
     
-    def insertSkillLog(db: Database, member_id:int, skill_id:int, lvl:int, date:datetime.date=None):
+    def buildSkillLog(member_id:int, skill_id:int, lvl:int, date:datetime.date=None, idem_key:int=None) -> dict:
+        """Build a skill log row suitable for insertSkillLogs. Date defaults to today.
+        """
+        if date == None:
+            date = datetime.date.today()
+
+        return {
+            SkillLogTable.MEMBERID_COL: member_id,
+            SkillLogTable.SKILLID_COL: skill_id,
+            SkillLogTable.DATE_COL: date,
+            SkillLogTable.LEVEL_COL: lvl,
+            SkillLogTable.IDEMKEY_COL: idem_key
+        }
+
+    def insertSkillLogs(db: Database, records:List[dict]) -> List[Optional[int]]:
+        """Insert several rows built by buildSkillLog in one statement. Does not commit.
+        Rows whose idempotency key is already logged are skipped.
+
+        :return: Update IDs of the new rows in order, None for a skipped row
+        :rtype: List[Optional[int]]
+        """
+        return brisketutils.insertRecords(db, SkillLogTable.TABLE_NAME, records, SkillLogTable.IDEMKEY_COL)
+
+    def insertSkillLog(db: Database, member_id:int, skill_id:int, lvl:int, date:datetime.date=None,
+                       idem_key:int=None) -> Optional[int]:
         """Insert an entry into the skill log table. 
 
         :param db: [description]
@@ -135,22 +211,19 @@ class SkillLogTable():
         :type skill_id: [type]
         :param date: [description], defaults to None
         :type date: str, optional
-        :param log_id: [description], defaults to None
-        :type log_id: [type], optional
+        :param idem_key: Idempotency key, e.g. the interaction ID of the logging command, defaults to None
+        :type idem_key: int, optional
+        :return: Update ID of the new row, or None if a row with <idem_key> was already logged
+        :rtype: Optional[int]
         """     
-        if date == None:
-            date = datetime.date.today()
-        
-        table_data = {
-            SkillLogTable.MEMBERID_COL: member_id,
-            SkillLogTable.SKILLID_COL: skill_id,
-            SkillLogTable.DATE_COL: date,
-            SkillLogTable.LEVEL_COL: lvl
-        }
-        
-        db[SkillLogTable.TABLE_NAME].insert(table_data)
+        with db.conn:
+            return SkillLogTable.insertSkillLogs(db, [SkillLogTable.buildSkillLog(member_id, skill_id, lvl, date, idem_key)])[0]
 
-    def updateSkillLog(db:Database, log_id:int, skill_id:int=None, lvl:int=None, date:datetime.date=None):
+    def updateSkillLog(db:Database, log_id:int, skill_id:int=None, lvl:int=None, date:datetime.date=None,
+                       member_id:int=None) -> Tuple[brisketutils.MutationResult, Optional[int]]:
+        """Update a skill log; if <member_id> is given, only when it is that member's.
+        See brisketutils.guardedUpdate for the returned outcome.
+        """
         new_data = {}
         if skill_id != None:
             new_data[SkillLogTable.SKILLID_COL] = skill_id
@@ -159,13 +232,110 @@ class SkillLogTable():
         if date != None:
             new_data[SkillLogTable.DATE_COL] = date
         
-        # Execute if non-empty dict
-        if new_data:
-            db[SkillLogTable.TABLE_NAME].update(log_id, new_data)
+        with db.conn:
+            return brisketutils.guardedUpdate(db, SkillLogTable.TABLE_NAME, SkillLogTable.UPDATEID_COL, log_id, new_data,
+                SkillLogTable.MEMBERID_COL, member_id)
 
-
-    def deleteSkillLog(db: Database, log_id:int):
-        db[SkillTable.TABLE_NAME].delete(log_id)
+    def deleteSkillLog(db: Database, log_id:int, member_id:int=None) -> Tuple[brisketutils.MutationResult, Optional[int]]:
+        """Delete a skill log; if <member_id> is given, only when it is that member's
+        """
+        with db.conn:
+            return brisketutils.guardedDelete(db, SkillLogTable.TABLE_NAME, SkillLogTable.UPDATEID_COL, log_id,
+                SkillLogTable.MEMBERID_COL, member_id)
+
+class SkillCurrentTable():
+    """Materialized view of SkillLogTable holding one row per (member, skill): the log entry with the highest level.
+    Ties are resolved in favour of the earliest entry. INSERT/UPDATE/DELETE triggers on the skill log keep it current,
+    so reading a member's or a skill's current levels costs a lookup on this table rather than an aggregate over all history.
+    """
+    TABLE_NAME = "skill_current"
+    MEMBERID_COL = SkillLogTable.MEMBERID_COL
+    SKILLID_COL = SkillLogTable.SKILLID_COL
+    LEVEL_COL = SkillLogTable.LEVEL_COL
+    UPDATEID_COL = SkillLogTable.UPDATEID_COL
+    DATE_COL = SkillLogTable.DATE_COL
+    SKILL_LEVEL_IDX = "idx_skill_current_skill_level"
+    LOG_BEST_IDX = "idx_skilllogs_member_skill_level"
+
+    # Selects the current-best log row for the (member, skill) pair given by the trigger row <ref> (OLD or NEW)
+    _BEST_ROW_SQL = f"""SELECT {MEMBERID_COL}, {SKILLID_COL}, {LEVEL_COL}, {UPDATEID_COL}, {DATE_COL}
+            FROM {SkillLogTable.TABLE_NAME}
+            WHERE {MEMBERID_COL} = {{ref}}.{MEMBERID_COL} AND {SKILLID_COL} = {{ref}}.{SKILLID_COL}
+            ORDER BY {LEVEL_COL} DESC, {UPDATEID_COL} ASC
+            LIMIT 1"""
+
+    def initSkillCurrentTable(db:Database):
+        """If not pre-existing, create the current-level table and its triggers, then populate it from the skill log.
+        Does not commit, so it can run inside a schema migration's transaction.
+
+        :param db: A connection to an existing database file containing the skill log table
+        :type db: sqlite_utils.Database
+        """
+        t = SkillCurrentTable
+        log = SkillLogTable.TABLE_NAME
+        cols = f"{t.MEMBERID_COL}, {t.SKILLID_COL}, {t.LEVEL_COL}, {t.UPDATEID_COL}, {t.DATE_COL}"
+        is_new = not db[t.TABLE_NAME].exists()
+
+        db.execute(f"""CREATE TABLE IF NOT EXISTS [{t.TABLE_NAME}] (
+            [{t.MEMBERID_COL}] INTEGER REFERENCES [{MemberTable.TABLE_NAME}]([{MemberTable.DISCORDID_COL}]),
+            [{t.SKILLID_COL}] INTEGER REFERENCES [{SkillTable.TABLE_NAME}]([{SkillTable.SKILLID_COL}]),
+            [{t.LEVEL_COL}] INTEGER,
+            [{t.UPDATEID_COL}] INTEGER,
+            [{t.DATE_COL}] TEXT,
+            PRIMARY KEY ([{t.MEMBERID_COL}], [{t.SKILLID_COL}])
+        )""")
+        db.execute(f"CREATE INDEX IF NOT EXISTS [{t.SKILL_LEVEL_IDX}] ON [{t.TABLE_NAME}] ([{t.SKILLID_COL}], [{t.LEVEL_COL}])")
+        # Lets the triggers find a (member, skill) pair's best log row without scanning the log
+        db.execute(f"CREATE INDEX IF NOT EXISTS [{t.LOG_BEST_IDX}] ON [{log}] ([{t.MEMBERID_COL}], [{t.SKILLID_COL}], [{t.LEVEL_COL}])")
+
+        db.execute(f"""CREATE TRIGGER IF NOT EXISTS [{t.TABLE_NAME}_insert] AFTER INSERT ON [{log}] BEGIN
+            INSERT INTO [{t.TABLE_NAME}] ({cols})
+                VALUES (NEW.{t.MEMBERID_COL}, NEW.{t.SKILLID_COL}, NEW.{t.LEVEL_COL}, NEW.{t.UPDATEID_COL}, NEW.{t.DATE_COL})
+                ON CONFLICT ({t.MEMBERID_COL}, {t.SKILLID_COL}) DO UPDATE
+                SET {t.LEVEL_COL} = excluded.{t.LEVEL_COL}, {t.UPDATEID_COL} = excluded.{t.UPDATEID_COL}, {t.DATE_COL} = excluded.{t.DATE_COL}
+                WHERE excluded.{t.LEVEL_COL} > {t.TABLE_NAME}.{t.LEVEL_COL};
+        END""")
+        db.execute(f"""CREATE TRIGGER IF NOT EXISTS [{t.TABLE_NAME}_delete] AFTER DELETE ON [{log}] BEGIN
+            DELETE FROM [{t.TABLE_NAME}] WHERE {t.UPDATEID_COL} = OLD.{t.UPDATEID_COL}
+                AND {t.MEMBERID_COL} = OLD.{t.MEMBERID_COL} AND {t.SKILLID_COL} = OLD.{t.SKILLID_COL};
+            INSERT OR IGNORE INTO [{t.TABLE_NAME}] ({cols}) {t._BEST_ROW_SQL.format(ref='OLD')};
+        END""")
+        db.execute(f"""CREATE TRIGGER IF NOT EXISTS [{t.TABLE_NAME}_update] AFTER UPDATE ON [{log}] BEGIN
+            DELETE FROM [{t.TABLE_NAME}]
+                WHERE ({t.MEMBERID_COL} = OLD.{t.MEMBERID_COL} AND {t.SKILLID_COL} = OLD.{t.SKILLID_COL})
+                OR ({t.MEMBERID_COL} = NEW.{t.MEMBERID_COL} AND {t.SKILLID_COL} = NEW.{t.SKILLID_COL});
+            INSERT OR IGNORE INTO [{t.TABLE_NAME}] ({cols}) {t._BEST_ROW_SQL.format(ref='OLD')};
+            INSERT OR IGNORE INTO [{t.TABLE_NAME}] ({cols}) {t._BEST_ROW_SQL.format(ref='NEW')};
+        END""")
+
+        # Databases created before this table existed already hold history
+        if is_new:
+            SkillCurrentTable._fillSkillCurrent(db)
+
+    def rebuildSkillCurrent(db:Database):
+        """Recompute the whole current-level table from the skill log in a single transaction
+
+        :param db: A connection to an existing database file containing both tables
+        :type db: sqlite_utils.Database
+        """
+        with db.conn:
+            SkillCurrentTable._fillSkillCurrent(db)
+        # Committed: bump again, so skill views cached while the rebuild was in flight are dropped too
+        brisketutils.TABLE_VERSIONS.flush()
+
+    def _fillSkillCurrent(db:Database):
+        # Does not commit, so it can run inside a caller's transaction
+        t = SkillCurrentTable
+        cols = f"{t.MEMBERID_COL}, {t.SKILLID_COL}, {t.LEVEL_COL}, {t.UPDATEID_COL}, {t.DATE_COL}"
+        brisketutils.TABLE_VERSIONS.bump(t.TABLE_NAME)
+        db.execute(f"DELETE FROM [{t.TABLE_NAME}]")
+        db.execute(f"""INSERT INTO [{t.TABLE_NAME}] ({cols})
+            SELECT {cols} FROM (
+                SELECT {cols}, ROW_NUMBER() OVER (
+                    PARTITION BY {t.MEMBERID_COL}, {t.SKILLID_COL}
+                    ORDER BY {t.LEVEL_COL} DESC, {t.UPDATEID_COL} ASC) rn
+                FROM [{SkillLogTable.TABLE_NAME}])
+            WHERE rn = 1""")
 
 
 if __name__ == "__main__":
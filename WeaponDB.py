@@ -1,11 +1,16 @@
 """
-Defines the look-up tables containing weapons and weapon categories
+Defines the look-up tables containing weapons and weapon categories, the weapon level log,
+and WeaponLeaderboard, an in-memory ranking of each member's best level per weapon
 """
+import bisect
+import threading
 from sqlite_utils import Database
 import sqlite3 as sql
 import datetime
+from typing import List, Optional, Tuple
 from enum import IntEnum, auto
 from MemberDB import MemberTable
+import brisketutils
 
 class WeaponCategs(IntEnum):
         ONEHAND =  1
@@ -102,6 +107,56 @@ class WeaponLogTable():
     MEMBERID_COL = "MemberID"
     WEAPONID_COL = "WeaponID"
     LEVEL_COL = "Level"
+    BEST_IDX = "idx_weaponlogs_member_weapon_level"
+    DATE_IDX = "idx_weaponlogs_date"
+    WEAPON_DATE_IDX = "idx_weaponlogs_weapon_date"
+    MEMBER_WEAPON_DATE_IDX = "idx_weaponlogs_member_weapon_date"
+    MEMBER_DATE_IDX = "idx_weaponlogs_member_date"
+    # Covering replacements of the four date indexes above (schema version 8)
+    DATE_COVER_IDX = "idx_weaponlogs_date_cover"
+    WEAPON_DATE_COVER_IDX = "idx_weaponlogs_weapon_date_cover"
+    MEMBER_WEAPON_DATE_COVER_IDX = "idx_weaponlogs_member_weapon_date_cover"
+    MEMBER_DATE_COVER_IDX = "idx_weaponlogs_member_date_cover"
+    # Interaction ID of the command that logged the row; a retried command cannot log it twice (schema version 9)
+    IDEMKEY_COL = "IdemKey"
+    IDEMKEY_IDX = "idx_weaponlogs_idemkey"
+
+    def createPageIndexes(db:Database):
+        """Create the indexes serving the date-ordered, keyset-paginated weapon log views. Does not commit.
+        """
+        t = WeaponLogTable
+        db.execute(f"CREATE INDEX IF NOT EXISTS [{t.DATE_IDX}] ON [{t.TABLE_NAME}] ([{t.DATE_COL}])")
+        db.execute(f"CREATE INDEX IF NOT EXISTS [{t.WEAPON_DATE_IDX}] ON [{t.TABLE_NAME}] ([{t.WEAPONID_COL}], [{t.DATE_COL}])")
+        db.execute(f"""CREATE INDEX IF NOT EXISTS [{t.MEMBER_WEAPON_DATE_IDX}]
+            ON [{t.TABLE_NAME}] ([{t.MEMBERID_COL}], [{t.WEAPONID_COL}], [{t.DATE_COL}])""")
+
+    def createCoveringIndexes(db:Database):
+        """Replace the date indexes with covering ones holding every column the weapon views select,
+        so view pages and date-range rankings are read from the index alone. Does not commit.
+        """
+        t = WeaponLogTable
+        brisketutils.replaceIndexes(db, t.TABLE_NAME, {
+            t.DATE_COVER_IDX : [t.DATE_COL, t.MEMBERID_COL, t.WEAPONID_COL, t.LEVEL_COL],
+            t.WEAPON_DATE_COVER_IDX : [t.WEAPONID_COL, t.DATE_COL, t.MEMBERID_COL, t.LEVEL_COL],
+            t.MEMBER_WEAPON_DATE_COVER_IDX : [t.MEMBERID_COL, t.WEAPONID_COL, t.DATE_COL, t.LEVEL_COL],
+            t.MEMBER_DATE_COVER_IDX : [t.MEMBERID_COL, t.DATE_COL, t.WEAPONID_COL, t.LEVEL_COL]
+        }, [t.DATE_IDX, t.WEAPON_DATE_IDX, t.MEMBER_WEAPON_DATE_IDX, t.MEMBER_DATE_IDX])
+
+    def addIdempotencyKey(db:Database):
+        """Add the uniquely indexed idempotency key column. Does not commit.
+        """
+        brisketutils.addIdempotencyKey(db, WeaponLogTable.TABLE_NAME, WeaponLogTable.IDEMKEY_COL, WeaponLogTable.IDEMKEY_IDX)
+
+    def normalizeDates(db:Database):
+        """Rewrite logged dates as ISO text so date ranges compare chronologically. Does not commit.
+        """
+        brisketutils.normalizeDates(db, WeaponLogTable.TABLE_NAME, WeaponLogTable.DATE_COL)
+
+    def createDateIndexes(db:Database):
+        """Index logged dates by (MemberID, Date) for the date-range filters of the weapon views. Does not commit.
+        """
+        t = WeaponLogTable
+        db.execute(f"CREATE INDEX IF NOT EXISTS [{t.MEMBER_DATE_IDX}] ON [{t.TABLE_NAME}] ([{t.MEMBERID_COL}], [{t.DATE_COL}])")
             
     def initWeaponLogTable(db: Database):
         weapon_log_table = db[WeaponLogTable.TABLE_NAME]
@@ -125,20 +180,49 @@ class WeaponLogTable():
                 pass
             else:
                 raise err
+
+        # Serves a member's best level per weapon, used when refreshing WeaponLeaderboard
+        weapon_log_table.create_index([WeaponLogTable.MEMBERID_COL, WeaponLogTable.WEAPONID_COL, WeaponLogTable.LEVEL_COL],
+            index_name=WeaponLogTable.BEST_IDX, if_not_exists=True)
     
-    def insertWeaponLog(db: Database, member_id:int, weapon_id:int, lvl:int, date:datetime.date=None):
+    def buildWeaponLog(member_id:int, weapon_id:int, lvl:int, date:datetime.date=None, idem_key:int=None) -> dict:
         if date == None:
             date = datetime.date.today()
 
-        table_data = {
+        return {
             WeaponLogTable.MEMBERID_COL : member_id,
             WeaponLogTable.WEAPONID_COL : weapon_id,
             WeaponLogTable.LEVEL_COL : lvl,
-            WeaponLogTable.DATE_COL : date
+            WeaponLogTable.DATE_COL : date,
+            WeaponLogTable.IDEMKEY_COL : idem_key
         }
-        db[WeaponLogTable.TABLE_NAME].insert(table_data)
 
-    def updateWeaponLog(db: Database, log_id:int, weapon_id:int=None, lvl:int=None, date:datetime.date=None):
+    def insertWeaponLogs(db: Database, records:List[dict]) -> List[Optional[int]]:
+        # Does not commit; rows whose idempotency key is already logged are skipped, see brisketutils.insertRecords
+        log_ids = brisketutils.insertRecords(db, WeaponLogTable.TABLE_NAME, records, WeaponLogTable.IDEMKEY_COL)
+
+        leaderboard = getattr(db, 'weapon_leaderboard', None)
+        if leaderboard is not None:
+            for log_id, record in zip(log_ids, records):
+                if log_id is not None:
+                    leaderboard.logInserted(log_id, record)
+        return log_ids
+
+    def insertWeaponLog(db: Database, member_id:int, weapon_id:int, lvl:int, date:datetime.date=None,
+                        idem_key:int=None) -> Optional[int]:
+        """Log a weapon level, unless one with the same <idem_key> was already logged
+
+        :return: Update ID of the new row, or None if it was a duplicate
+        :rtype: Optional[int]
+        """
+        with db.conn:
+            return WeaponLogTable.insertWeaponLogs(db, [WeaponLogTable.buildWeaponLog(member_id, weapon_id, lvl, date, idem_key)])[0]
+
+    def updateWeaponLog(db: Database, log_id:int, weapon_id:int=None, lvl:int=None, date:datetime.date=None,
+                        member_id:int=None) -> Tuple[brisketutils.MutationResult, Optional[int]]:
+        """Update a weapon log; if <member_id> is given, only when it is that member's.
+        See brisketutils.guardedUpdate for the returned outcome.
+        """
         # Construct new data 
         table_data = {}
         if lvl != None:
@@ -148,12 +232,180 @@ class WeaponLogTable():
         if date != None:
             table_data[WeaponLogTable.DATE_COL] = date 
         
-        # Execute update if table data is non-empty
-        if table_data:
-            db[WeaponLogTable].update(log_id, table_data)
+        with db.conn:
+            result = brisketutils.guardedUpdate(db, WeaponLogTable.TABLE_NAME, WeaponLogTable.UPDATEID_COL, log_id, table_data,
+                WeaponLogTable.MEMBERID_COL, member_id)
+        if result[0] == brisketutils.MutationResult.DONE and table_data:
+            WeaponLogTable._refreshLeaderboard(db, log_id)
+        return result
+
+    def deleteWeaponLog(db: Database, log_id:int, member_id:int=None) -> Tuple[brisketutils.MutationResult, Optional[int]]:
+        """Delete a weapon log; if <member_id> is given, only when it is that member's
+        """
+        # A guarded delete only succeeds on <member_id>'s log, so the owner needs looking up only when unguarded
+        owner_id = member_id if member_id is not None else WeaponLogTable._logMember(db, log_id)
+        with db.conn:
+            result = brisketutils.guardedDelete(db, WeaponLogTable.TABLE_NAME, WeaponLogTable.UPDATEID_COL, log_id,
+                WeaponLogTable.MEMBERID_COL, member_id)
+
+        leaderboard = getattr(db, 'weapon_leaderboard', None)
+        if result[0] == brisketutils.MutationResult.DONE and leaderboard is not None and owner_id is not None:
+            leaderboard.refreshMember(db, owner_id)
+        return result
+
+    def _logMember(db: Database, log_id:int):
+        row = db.execute(f"SELECT {WeaponLogTable.MEMBERID_COL} FROM {WeaponLogTable.TABLE_NAME} WHERE {WeaponLogTable.UPDATEID_COL} = ?", [log_id]).fetchone()
+        return row[0] if row else None
+
+    def _refreshLeaderboard(db: Database, log_id:int):
+        leaderboard = getattr(db, 'weapon_leaderboard', None)
+        if leaderboard is not None:
+            member_id = WeaponLogTable._logMember(db, log_id)
+            if member_id is not None:
+                leaderboard.refreshMember(db, member_id)
+
+
+class WeaponLeaderboard():
+    """In-memory ranking of every member's best level in each weapon.
+
+    Loaded once from the weapon log, then kept current by WeaponLogTable's insert, update and delete functions
+    whenever the database carries it as its weapon_leaderboard attribute (as BrisketDB does).
+    Inserts are applied incrementally; updates and deletes re-read the affected member's best levels.
+    For each weapon a list of members sorted by level is maintained, so reading the top N is O(N).
+    As in SkillDB.SkillCurrentTable, ties are resolved in favour of the earliest log entry.
+
+    Mutations happen on the database thread while reads may come from the event loop, so all access is locked.
+    """
+
+    _BEST_ROWS_SQL = f"""SELECT {WeaponLogTable.UPDATEID_COL}, {WeaponLogTable.DATE_COL}, {WeaponLogTable.MEMBERID_COL}, {WeaponLogTable.WEAPONID_COL}, {WeaponLogTable.LEVEL_COL}
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY {WeaponLogTable.MEMBERID_COL}, {WeaponLogTable.WEAPONID_COL}
+                ORDER BY {WeaponLogTable.LEVEL_COL} DESC, {WeaponLogTable.UPDATEID_COL} ASC) rn
+            FROM {WeaponLogTable.TABLE_NAME}
+            {{where}})
+        WHERE rn = 1"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._best = {}     # weapon id -> {member id -> row dict}
+        self._ranked = {}   # weapon id -> sorted [(-level, log id, member id)]
+
+    def load(self, db:Database):
+        """Discard current state and rebuild the leaderboard from the weapon log
+
+        :param db: Database containing the weapon log table
+        :type db: sqlite_utils.Database
+        """
+        rows = db.query(WeaponLeaderboard._BEST_ROWS_SQL.format(where=''))
+        with self._lock:
+            self._best = {}
+            self._ranked = {}
+            for row in rows:
+                self._set(row)
+
+    def logInserted(self, log_id:int, record:dict):
+        """Account for a newly inserted weapon log row
+
+        :param log_id: UpdateId of the new row
+        :type log_id: int
+        :param record: Inserted column values, as built by WeaponLogTable.buildWeaponLog
+        :type record: dict
+        """
+        row = WeaponLeaderboard._row(log_id, record)
+        with self._lock:
+            current = self._best.get(row[WeaponLogTable.WEAPONID_COL], {}).get(row[WeaponLogTable.MEMBERID_COL])
+            if current is None or row[WeaponLogTable.LEVEL_COL] > current[WeaponLogTable.LEVEL_COL]:
+                self._set(row)
+
+    def refreshMember(self, db:Database, member_id:int):
+        """Re-read a member's best level in every weapon, e.g. after one of their logs was edited or deleted
+
+        :param db: Database containing the weapon log table
+        :type db: sqlite_utils.Database
+        :param member_id: Discord ID of the member
+        :type member_id: int
+        """
+        rows = db.query(WeaponLeaderboard._BEST_ROWS_SQL.format(where=f"WHERE {WeaponLogTable.MEMBERID_COL} = ?"), [member_id])
+        with self._lock:
+            for weapon_id in list(self._best):
+                self._unset(weapon_id, member_id)
+            for row in rows:
+                self._set(row)
+
+    def top(self, weapon_id:int, n:int=None) -> List[dict]:
+        """Best log row of the <n> highest-levelled members in a weapon, highest first
+
+        :param weapon_id: Weapon to rank
+        :type weapon_id: int
+        :param n: Number of rows, defaults to None for all members
+        :type n: int, optional
+        :rtype: List[dict]
+        """
+        with self._lock:
+            best = self._best.get(weapon_id, {})
+            ranked = self._ranked.get(weapon_id, [])
+            return [dict(best[member_id]) for _, _, member_id in ranked[:n]]
+
+    def memberBest(self, member_id:int) -> List[dict]:
+        """Best log row of a member in each weapon they have logged, highest level first
+
+        :param member_id: Discord ID of the member
+        :type member_id: int
+        :rtype: List[dict]
+        """
+        with self._lock:
+            rows = [dict(best[member_id]) for best in self._best.values() if member_id in best]
+        rows.sort(key=lambda r: (-r[WeaponLogTable.LEVEL_COL], r[WeaponLogTable.UPDATEID_COL]))
+        return rows
+
+    def checkConsistency(self, db:Database) -> List[str]:
+        """Compare the leaderboard against the same ranking computed in SQL
+
+        :param db: Database containing the weapon log table
+        :type db: sqlite_utils.Database
+        :return: Description of each mismatch; empty if consistent
+        :rtype: List[str]
+        """
+        expected = {(r[WeaponLogTable.WEAPONID_COL], r[WeaponLogTable.MEMBERID_COL]) : r
+            for r in db.query(WeaponLeaderboard._BEST_ROWS_SQL.format(where=''))}
+        with self._lock:
+            actual = {(w, m) : dict(row) for w, best in self._best.items() for m, row in best.items()}
+            ranked_ok = all(ranked == sorted(ranked) for ranked in self._ranked.values())
+
+        problems = []
+        for key in sorted(expected.keys() | actual.keys(), key=str):
+            if expected.get(key) != actual.get(key):
+                problems.append(f"weapon {key[0]}, member {key[1]}: expected {expected.get(key)}, leaderboard has {actual.get(key)}")
+        if not ranked_ok:
+            problems.append("ranking list out of order")
+        return problems
+
+    def _row(log_id:int, record:dict) -> dict:
+        date = record[WeaponLogTable.DATE_COL]
+        return {
+            WeaponLogTable.UPDATEID_COL : log_id,
+            WeaponLogTable.DATE_COL : date.isoformat() if isinstance(date, datetime.date) else date,
+            WeaponLogTable.MEMBERID_COL : record[WeaponLogTable.MEMBERID_COL],
+            WeaponLogTable.WEAPONID_COL : record[WeaponLogTable.WEAPONID_COL],
+            WeaponLogTable.LEVEL_COL : record[WeaponLogTable.LEVEL_COL]
+        }
+
+    def _key(row:dict) -> tuple:
+        return (-row[WeaponLogTable.LEVEL_COL], row[WeaponLogTable.UPDATEID_COL], row[WeaponLogTable.MEMBERID_COL])
+
+    def _set(self, row:dict):
+        weapon_id = row[WeaponLogTable.WEAPONID_COL]
+        member_id = row[WeaponLogTable.MEMBERID_COL]
+        self._unset(weapon_id, member_id)
+        self._best.setdefault(weapon_id, {})[member_id] = row
+        bisect.insort(self._ranked.setdefault(weapon_id, []), WeaponLeaderboard._key(row))
 
-    def deleteWeaponLog(db: Database, log_id:int):
-        db[WeaponsTable.TABLE_NAME].delete(log_id)
+    def _unset(self, weapon_id:int, member_id:int):
+        old = self._best.get(weapon_id, {}).pop(member_id, None)
+        if old is not None:
+            ranked = self._ranked[weapon_id]
+            del ranked[bisect.bisect_left(ranked, WeaponLeaderboard._key(old))]
 
 if __name__ == "__main__":
     import sqlite3 as sql
@@ -0,0 +1,65 @@
+"""
+Slash command sync on startup, against the fakediscord stand-in for Discord's command API.
+
+Three consecutive starts share one command hash file and one fake Discord: the first syncs, the second finds the
+definitions unchanged and makes no request at all, and the third follows a change to one command and syncs again.
+For comparison, discord_slash's unconditional sync is also timed on unchanged definitions.
+
+Run from the repository root:
+    python -m benchmarks.command_sync [--request-ms 100]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from brisketsync import readHash, syncIfChanged
+from benchmarks import fakediscord
+
+
+def start(db_file:str, hash_file:str, discord:fakediscord.FakeSlashCommandRequest, change=None, force:bool=False) -> dict:
+    """One bot start syncing its commands with <discord>, after applying change(slash) if given.
+    With <force> discord_slash's own sync is run instead of syncIfChanged.
+    """
+    bot, slash, brisket_db = fakediscord.createApp(db_file, command_hash_file=hash_file)
+    slash.req = discord
+    if change is not None:
+        change(slash)
+    # Commands are only hashed and sent once the client is ready
+    bot._handle_ready()
+
+    before = discord.requests()
+    started = time.perf_counter()
+    if force:
+        bot.loop.run_until_complete(slash.sync_all_commands())
+        synced = True
+    else:
+        synced = bot.loop.run_until_complete(syncIfChanged(slash, hash_file))
+    elapsed = time.perf_counter() - started
+    brisket_db.close()
+    return {'synced' : synced, 'requests' : discord.requests() - before, 'ms' : 1000 * elapsed, 'hash' : readHash(hash_file)}
+
+
+def describePing(slash):
+    slash.commands['ping'].description = "Latency check"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--request-ms', type=float, default=100, help="simulated Discord round trip per request")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    db_file = os.path.join(tmp.name, 'brisket.db')
+    hash_file = os.path.join(tmp.name, 'command_hash.txt')
+    discord = fakediscord.FakeSlashCommandRequest(delay=args.request_ms / 1000)
+
+    runs = [
+        ('first start', start(db_file, hash_file, discord)),
+        ('restart, unchanged', start(db_file, hash_file, discord)),
+        ('restart, ping changed', start(db_file, hash_file, discord, describePing)),
+        ('unconditional sync, unchanged', start(db_file, hash_file, discord, describePing, force=True)),
+    ]
+    for name, r in runs:
+        print(f"{name:>30}: {'synced ' if r['synced'] else 'skipped'}  {r['requests']:3d} requests  {r['ms']:8.1f} ms  "
+            f"hash {r['hash'][:12]}")
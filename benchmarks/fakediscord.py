@@ -0,0 +1,173 @@
+"""
+In-process stand-ins for the Discord objects the slash handlers touch, so handlers can be driven without a network
+connection or a bot token: a guild with members and roles, and slash command and component contexts recording
+what the handler sends, and a command-sync endpoint standing in for Discord's application command API.
+
+createApp() builds a brisketbot instance on a given database file. The bot is never started and does not sync its
+commands, so nothing talks to Discord.
+"""
+import asyncio
+import copy
+import itertools
+from typing import Dict, List
+
+import brisketbot
+
+# Guild ID of the fake guild, also configured as the bot's guilds
+FAKE_GUILD_ID = 1
+
+_interaction_ids = itertools.count(1)
+
+
+class FakeRole():
+    def __init__(self, id:int, members:List["FakeMember"]=None):
+        self.id = id
+        self.members = members if members is not None else []
+
+
+class FakeMember():
+    def __init__(self, id:int, display_name:str, guild:"FakeGuild"=None, roles:List[FakeRole]=None):
+        self.id = id
+        self.display_name = display_name
+        self.guild = guild
+        self.roles = roles if roles is not None else []
+
+
+class FakeGuild():
+    """Guild whose member cache holds every member of <members>, each with every role of <role_ids>
+
+    :param members: Discord ID -> display name
+    :type members: Dict[int, str]
+    :param role_ids: IDs of the roles given to every member, defaults to none
+    :type role_ids: List[int], optional
+    """
+
+    def __init__(self, members:Dict[int, str], role_ids:List[int]=(), id:int=FAKE_GUILD_ID):
+        self.id = id
+        self.roles = {rid : FakeRole(rid) for rid in role_ids}
+        self.members = {mid : FakeMember(mid, name, self, list(self.roles.values())) for mid, name in members.items()}
+        for role in self.roles.values():
+            role.members = list(self.members.values())
+
+    def get_member(self, member_id:int) -> FakeMember:
+        return self.members.get(member_id)
+
+    def get_role(self, role_id:int) -> FakeRole:
+        return self.roles.get(role_id)
+
+
+class FakeContext():
+    """SlashContext stand-in for an invocation of <command> served by <bot>, e.g. 'bank balance get'.
+    Every instance gets a fresh interaction ID. Messages are recorded in <sent> as (content, options) pairs.
+    Each send and edit takes send_delay seconds, standing in for the round trip to Discord.
+    """
+    send_delay = 0.0
+
+    def __init__(self, bot, guild:FakeGuild, author:FakeMember, command:str=None):
+        self.bot = bot
+        self.guild = guild
+        self.guild_id = guild.id if guild is not None else None
+        self.author = author
+        self.author_id = author.id
+        # Named as in /admin stats: base [group] subcommand
+        parts = command.split() if command else [None]
+        self.name = parts[0]
+        self.subcommand_group = parts[1] if len(parts) == 3 else None
+        self.subcommand_name = parts[-1] if len(parts) > 1 else None
+        self.interaction_id = str(next(_interaction_ids))
+        self.sent = []
+
+    async def send(self, content:str="", **kwargs):
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        self.sent.append((content, kwargs))
+
+    def customIds(self) -> List[str]:
+        """custom_id of every button attached to the messages sent so far
+        """
+        return [button['custom_id'] for _, kwargs in self.sent for row in (kwargs.get('components') or [])
+            for button in row['components']]
+
+
+class FakeComponentContext(FakeContext):
+    """ComponentContext stand-in for a click on the button <custom_id>; edits of the original message land in <edits>
+    """
+
+    def __init__(self, bot, guild:FakeGuild, author:FakeMember, custom_id:str):
+        super().__init__(bot, guild, author)
+        self.custom_id = custom_id
+        self.edits = []
+
+    async def edit_origin(self, **kwargs):
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        self.edits.append(kwargs)
+
+
+class FakeSlashCommandRequest():
+    """Stand-in for discord_slash's SlashCommandRequest covering the calls made by SlashCommand.sync_all_commands.
+    Commands and permissions are kept per scope (guild ID, None for global) like Discord does, and every call
+    is counted in <calls> by method name. Each call takes <delay> seconds, standing in for the round trip to Discord.
+
+    Install it with ``slash.req = FakeSlashCommandRequest()``; the same instance can be moved to another app to
+    stand in for Discord across a restart.
+    """
+
+    def __init__(self, application_id:int=1, delay:float=0.0):
+        self.application_id = application_id
+        self.delay = delay
+        self.commands : Dict[int, List[dict]] = {}
+        self.permissions : Dict[int, List[dict]] = {}
+        self.calls : Dict[str, int] = {}
+        self._ids = itertools.count(1)
+
+    async def _request(self, method:str):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+    async def get_all_commands(self, guild_id=None) -> List[dict]:
+        await self._request('get_all_commands')
+        return copy.deepcopy(self.commands.get(guild_id, []))
+
+    async def put_slash_commands(self, slash_commands:list, guild_id) -> List[dict]:
+        await self._request('put_slash_commands')
+        # Commands keep their ID when sent with it, as Discord does for an overwrite
+        self.commands[guild_id] = [{**copy.deepcopy(cmd), 'id' : cmd.get('id') or next(self._ids),
+            'application_id' : self.application_id} for cmd in slash_commands]
+        return copy.deepcopy(self.commands[guild_id])
+
+    async def get_all_guild_commands_permissions(self, guild_id) -> List[dict]:
+        await self._request('get_all_guild_commands_permissions')
+        return copy.deepcopy(self.permissions.get(guild_id, []))
+
+    async def update_guild_commands_permissions(self, guild_id, perms_dict:list) -> List[dict]:
+        await self._request('update_guild_commands_permissions')
+        self.permissions[guild_id] = copy.deepcopy(perms_dict)
+        return copy.deepcopy(perms_dict)
+
+    def requests(self) -> int:
+        return sum(self.calls.values())
+
+
+def createApp(db_file:str, **config):
+    """brisketbot.create_app on <db_file>, with command sync, metrics logging and the slow-query log disabled
+    and the fake guild as its guilds. <config> overrides further BotConfig settings.
+
+    :return: The bot, its slash command registry and its database
+    """
+    settings = dict(debug_guild_id=FAKE_GUILD_ID, brisket_guild_id=FAKE_GUILD_ID, db_file=db_file,
+        metrics_interval=0, slow_query_log='', sync_commands=False)
+    settings.update(config)
+    return brisketbot.create_app(brisketbot.BotConfig(**settings))
+
+
+def resolveCommand(slash, command:str):
+    """Command object registered on <slash> for <command>, named as 'base [group] subcommand'
+    """
+    parts = command.split()
+    if len(parts) == 1:
+        return slash.commands[parts[0]]
+    if len(parts) == 2:
+        return slash.subcommands[parts[0]][parts[1]]
+    return slash.subcommands[parts[0]][parts[1]][parts[2]]
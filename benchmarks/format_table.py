@@ -0,0 +1,51 @@
+"""
+Table rendering cost of brisketutils.renderTable against the original formatTable implementation,
+which built its output by repeated string concatenation.
+
+Run from the repository root:
+    python -m benchmarks.format_table [--repeat 20]
+"""
+import argparse
+import datetime
+import random
+import timeit
+
+import brisketutils as bu
+
+COLUMNS = ['XactID', 'Date', 'Member', 'Amount', 'Note']
+
+
+def legacyFormatTable(dictlist:dict) -> str:
+    # formatTable as it was before the renderer rewrite
+    header_str = '|'.join(k.center(10) for k in dictlist.keys())
+    header_str = '|'+header_str + '|\n'
+    header_str = header_str + len(header_str)*'-'+'\n'
+    for row in zip(*dictlist.values()):
+        for s in row:
+            header_str = header_str + '|' + str(s).center(10)
+        header_str = header_str + '|\n'
+    return header_str
+
+
+def makeRows(n:int) -> list:
+    today = datetime.date.today()
+    return [(i, (today - datetime.timedelta(days=i)).isoformat(), f"member{random.randrange(50)}",
+        round(random.uniform(1, 500), 2), random.choice([None, 'donation', 'war tax'])) for i in range(n)]
+
+
+def legacy(rows:list) -> str:
+    # The old path also copied the rows into a dictionary of lists first
+    return legacyFormatTable(bu.listDictToDictList([dict(zip(COLUMNS, r)) for r in rows]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20, help="timed runs per case; the best is reported")
+    args = parser.parse_args()
+
+    for n in (10, 100, 1000):
+        rows = makeRows(n)
+        old = min(timeit.repeat(lambda: legacy(rows), number=1, repeat=args.repeat))
+        new = min(timeit.repeat(lambda: bu.renderTable(COLUMNS, rows), number=1, repeat=args.repeat))
+        pages = len(bu.renderTable(COLUMNS, rows))
+        print(f"{n:5d} rows: formatTable {1000 * old:8.3f} ms  renderTable {1000 * new:8.3f} ms  ({pages} page(s))")
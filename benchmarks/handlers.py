@@ -0,0 +1,216 @@
+"""
+Latency of every slash command handler of brisketbot against a synthetic guild database,
+driven in process through the fakediscord stand-ins; views are timed with each combination of their options.
+
+Results are written as JSON. Pass an earlier result file to --compare to see each case's change, e.g. across commits.
+Write commands include the WriteCoalescer window (10 ms by default) in their latency.
+The bot's view cache is off by default so views time their queries; --view-cache N times cache hits instead.
+Results are only compared against a baseline taken with the same view cache size.
+
+Run from the repository root:
+    python -m benchmarks.handlers [--rows 100000] [--members 200] [--repeat 20] [--db synthetic.db]
+                                  [--view-cache 0] [--out handlers.json] [--compare baseline.json]
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import Callable, List
+
+from BankDB import BankTable
+import brisketbot
+from BrisketDB import BrisketDB
+from MemberDB import MemberTable
+import SkillDB
+import WeaponDB
+from benchmarks import fakediscord, synthetic_guild
+
+
+class Case():
+    """One timed handler invocation
+
+    :param name: Case name in the results
+    :param command: Invoked command, e.g. 'bank balance get'
+    :param kwargs: Option values, or a callable returning them given the iteration number
+    """
+
+    def __init__(self, name:str, command:str, kwargs=None):
+        self.name = name
+        self.command = command
+        self.kwargs = kwargs if kwargs is not None else {}
+
+    def options(self, iteration:int) -> dict:
+        return self.kwargs(iteration) if callable(self.kwargs) else self.kwargs
+
+
+def gitCommit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def ownedRows(brisket_db, insert:Callable, author_id:int, n:int) -> List[int]:
+    """IDs of <n> fresh log rows of <author_id>, inserted with insert(db, author_id)"""
+    return [await brisket_db.run(insert, author_id) for _ in range(n)]
+
+
+async def buildCases(brisket_db, guild:fakediscord.FakeGuild, author:fakediscord.FakeMember, runs:int) -> List[Case]:
+    """Every handler, with the views in each combination of their options.
+    Edits and deletes act on rows of <author>, deletes on <runs> rows created for them.
+    """
+    today = datetime.date.today()
+    since = (today - datetime.timedelta(days=90)).isoformat()
+    other = next(m for m in guild.members.values() if m is not author)
+
+    bank_ids = await ownedRows(brisket_db, lambda db, m: BankTable.insertBankLog(db, m, 1.0), author.id, runs)
+    skill_ids = await ownedRows(brisket_db, lambda db, m: SkillDB.SkillLogTable.insertSkillLog(db, m, 1, 1), author.id, runs)
+    weapon_ids = await ownedRows(brisket_db, lambda db, m: WeaponDB.WeaponLogTable.insertWeaponLog(db, m, 1, 1), author.id, runs)
+
+    cases = [
+        Case('ping', 'ping'),
+        Case('bank add', 'bank add', {'amount' : 12.5, 'note' : 'bench'}),
+        Case('bank edit', 'bank edit', lambda i: {'xactid' : bank_ids[0], 'note' : f'edit {i}'}),
+        Case('bank delete', 'bank delete', lambda i: {'xactid' : bank_ids[i]}),
+        Case('bank balance get', 'bank balance get'),
+        Case('bank balance setinit', 'bank balance setinit', {'initbal' : '28500.13'}),
+        Case('bank stats month', 'bank stats'),
+        Case('bank stats year', 'bank stats', {'since' : (today - datetime.timedelta(days=365)).isoformat(), 'until' : today.isoformat()}),
+        Case('skilllvls add', 'skilllvls add', {'skill' : 1, 'lvl' : 150}),
+        Case('skilllvls edit', 'skilllvls edit', lambda i: {'log_id' : skill_ids[0], 'lvl' : 100 + i}),
+        Case('skilllvls delete', 'skilllvls delete', lambda i: {'log_id' : skill_ids[i]}),
+        Case('weaponlog add', 'weaponlog add', {'weapon' : 1, 'lvl' : 15}),
+        Case('weaponlog edit', 'weaponlog edit', lambda i: {'logid' : weapon_ids[0], 'lvl' : 1 + i % 20}),
+        Case('weaponlog delete', 'weaponlog delete', lambda i: {'logid' : weapon_ids[i]}),
+        Case('admin stats', 'admin stats'),
+    ]
+
+    # View cases are named after the options they set, e.g. 'skilllvls view user skill best 90d'
+    for user, ranged in itertools.product((None, other), (False, True)):
+        options = {'user' : user, 'lastn' : 10, 'since' : since if ranged else None}
+        cases.append(Case(viewName('bank view', user=user, **{'90d' : ranged}), 'bank view', options))
+
+    for base, filter_name in (('skilllvls', 'skill'), ('weaponlog', 'weapon')):
+        for user, filtered, best, ranged in itertools.product((None, other), (False, True), (False, True), (False, True)):
+            options = {'user' : user, filter_name : 1 if filtered else None, 'best' : best, 'lastn' : 10, 'since' : since if ranged else None}
+            cases.append(Case(viewName(f'{base} view', user=user, **{filter_name : filtered, 'best' : best, '90d' : ranged}),
+                f'{base} view', options))
+    return cases
+
+
+def viewName(prefix:str, **flags) -> str:
+    return ' '.join([prefix] + [flag for flag, on in flags.items() if on])
+
+
+def summarize(latencies:List[float]) -> dict:
+    latencies = sorted(latencies)
+    return {
+        'runs' : len(latencies),
+        'p50_ms' : 1000 * statistics.median(latencies),
+        'mean_ms' : 1000 * statistics.fmean(latencies),
+        'min_ms' : 1000 * latencies[0],
+        'max_ms' : 1000 * latencies[-1],
+    }
+
+
+async def timeCase(bot, slash, guild, author, case:Case, runs:int, warmup:int=1) -> dict:
+    handler = fakediscord.resolveCommand(slash, case.command)
+    latencies = []
+    for i in range(warmup + runs):
+        ctx = fakediscord.FakeContext(bot, guild, author, case.command)
+        start = time.perf_counter()
+        await handler.invoke(ctx, **case.options(i))
+        if i >= warmup:
+            latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+async def timePageTurn(bot, slash, guild, author, runs:int) -> dict:
+    # Page forward through the recent bank view, starting over whenever the last page is reached
+    latencies = []
+    custom_id = None
+    while len(latencies) < runs:
+        if custom_id is None:
+            ctx = fakediscord.FakeContext(bot, guild, author, 'bank view')
+            await fakediscord.resolveCommand(slash, 'bank view').invoke(ctx, lastn=10)
+            custom_id = ctx.customIds()[-1]
+        ctx = fakediscord.FakeComponentContext(bot, guild, author, custom_id)
+        start = time.perf_counter()
+        await bot.on_component(ctx)
+        latencies.append(time.perf_counter() - start)
+        # Next is the last button; a page turn that does not fit one message sends instead of editing
+        ids = [b['custom_id'] for e in ctx.edits for row in e['components'] for b in row['components']] or ctx.customIds()
+        custom_id = ids[-1] if ids else None
+    return summarize(latencies)
+
+
+async def runAll(bot, slash, members:dict, runs:int) -> dict:
+    guild = fakediscord.FakeGuild(members, sorted(brisketbot.allowed_role_ids))
+    author = guild.get_member(min(members))
+    results = {}
+    for case in await buildCases(bot.brisket_db, guild, author, runs + 1):
+        results[case.name] = await timeCase(bot, slash, guild, author, case, runs)
+    results['page turn'] = await timePageTurn(bot, slash, guild, author, runs)
+    return results
+
+
+def compare(results:dict, baseline:dict):
+    for name, r in results.items():
+        old = baseline.get(name)
+        change = f"{100 * (r['p50_ms'] / old['p50_ms'] - 1):+6.1f}%" if old and old['p50_ms'] else "   new"
+        print(f"{name:>45}: p50 {r['p50_ms']:8.2f} ms  {change}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help="log rows generated when --db does not exist yet")
+    parser.add_argument('--members', type=int, default=200, help="members generated when --db does not exist yet")
+    parser.add_argument('--repeat', type=int, default=20, help="timed runs per case")
+    parser.add_argument('--db', help="synthetic database to use, generated if missing; defaults to a temporary file")
+    parser.add_argument('--view-cache', type=int, default=0, help="view cache size of the bot, 0 to disable it")
+    parser.add_argument('--out', default='handlers.json', help="JSON file receiving the results")
+    parser.add_argument('--compare', help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    db_file = args.db if args.db else os.path.join(tmp.name, 'synthetic.db')
+    db = BrisketDB(db_file)
+    if not db[SkillDB.SkillLogTable.TABLE_NAME].count:
+        synthetic_guild.populate(db, args.members, args.rows)
+    members = {i : name for i, name in MemberTable.activeMembers(db).items() if i >= synthetic_guild.FIRST_MEMBER_ID}
+    rows = {t : db[t].count for t in synthetic_guild.TABLE_SHARES}
+    db.conn.close()
+
+    bot, slash, brisket_db = fakediscord.createApp(db_file, view_cache_size=args.view_cache)
+    results = bot.loop.run_until_complete(runAll(bot, slash, members, args.repeat))
+    brisket_db.close()
+
+    report = {
+        'commit' : gitCommit(),
+        'created' : datetime.datetime.now().isoformat(timespec='seconds'),
+        'rows' : rows,
+        'members' : len(members),
+        'repeat' : args.repeat,
+        'view_cache' : args.view_cache,
+        'results' : results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        # Reports older than the view cache carry no setting; they were taken without one
+        if baseline.get('view_cache', 0) != args.view_cache:
+            parser.error(f"{args.compare} was taken with --view-cache {baseline.get('view_cache', 0)}, "
+                f"this run with {args.view_cache}; their view timings are not comparable")
+        compare(results, baseline['results'])
+    else:
+        for name, r in results.items():
+            print(f"{name:>45}: p50 {r['p50_ms']:8.2f} ms  max {r['max_ms']:8.2f} ms")
+    print(f"Results written to {args.out}")
@@ -0,0 +1,204 @@
+"""
+Load test replaying a trace of slash command invocations against brisketbot's handlers at a target rate,
+with the Discord side replaced by the fakediscord stand-ins.
+
+Invocations are started on schedule whether or not earlier ones have finished (open loop), up to --concurrency
+at a time. Latency is measured from each invocation's scheduled start, so time spent waiting for a free slot counts.
+A monitor task measures how late the event loop wakes it up, which is the delay every gateway event would see.
+
+A trace is a JSON lines file, one invocation per line:
+    {"at": 0.125, "command": "skilllvls view", "author": 100000000000000000, "options": {"skill": 3, "best": true}}
+<at> is in seconds from the start, <command> the name as in /admin stats, and a "user" option holds a member ID.
+Without --trace a synthetic raid-night mix of views and log additions is generated; --write-trace saves it.
+
+Run from the repository root:
+    python -m benchmarks.load_replay [--rate 200] [--duration 30] [--concurrency 300] [--send-ms 50]
+                                     [--rows 100000] [--db synthetic.db] [--trace trace.jsonl] [--write-trace trace.jsonl]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List
+
+import brisketbot
+from BrisketDB import BrisketDB
+from MemberDB import MemberTable
+import SkillDB
+import WeaponDB
+from benchmarks import fakediscord, synthetic_guild
+
+# Interval of the event loop lag monitor, in seconds
+LAG_INTERVAL = 0.01
+
+
+def syntheticTrace(members:List[int], rate:float, duration:float, seed:int=0) -> List[dict]:
+    """Poisson arrivals at <rate> per second for <duration> seconds: mostly views, with a steady stream of log additions
+    """
+    rng = random.Random(seed)
+    since = (datetime.date.today() - datetime.timedelta(days=30)).isoformat()
+    skills = [s.value for s in SkillDB.Skills]
+    weapons = [w.value for w in WeaponDB.Weapons]
+
+    def view(filter_name, values):
+        options = {'lastn' : 10}
+        if rng.random() < 0.5:
+            options['user'] = rng.choice(members)
+        if rng.random() < 0.6:
+            options[filter_name] = rng.choice(values)
+        if rng.random() < 0.3:
+            options['best'] = True
+        if rng.random() < 0.2:
+            options['since'] = since
+        return options
+
+    mix = [
+        (0.25, 'skilllvls view', lambda: view('skill', skills)),
+        (0.20, 'weaponlog view', lambda: view('weapon', weapons)),
+        (0.10, 'bank view', lambda: {'lastn' : 10, **({'user' : rng.choice(members)} if rng.random() < 0.5 else {})}),
+        (0.15, 'skilllvls add', lambda: {'skill' : rng.choice(skills), 'lvl' : rng.randrange(1, 201)}),
+        (0.15, 'weaponlog add', lambda: {'weapon' : rng.choice(weapons), 'lvl' : rng.randrange(1, 21)}),
+        (0.05, 'bank add', lambda: {'amount' : round(rng.uniform(1, 5000), 2)}),
+        (0.05, 'bank balance get', lambda: {}),
+        (0.05, 'bank stats', lambda: {}),
+    ]
+    weights = [w for w, _, _ in mix]
+
+    trace = []
+    at = rng.expovariate(rate)
+    while at < duration:
+        _, command, options = rng.choices(mix, weights)[0]
+        trace.append({'at' : at, 'command' : command, 'author' : rng.choice(members), 'options' : options()})
+        at += rng.expovariate(rate)
+    return trace
+
+
+def loadTrace(path:str, rate:float=None) -> List[dict]:
+    """Read a trace file; if <rate> is given its timestamps are rescaled to that average rate
+    """
+    with open(path) as f:
+        trace = sorted((json.loads(line) for line in f if line.strip()), key=lambda inv: inv['at'])
+    if rate and len(trace) > 1 and trace[-1]['at'] > 0:
+        scale = trace[-1]['at'] / len(trace) * rate
+        for inv in trace:
+            inv['at'] /= scale
+    return trace
+
+
+def quantile(values:List[float], q:float) -> float:
+    return values[max(0, math.ceil(q * len(values)) - 1)] if values else 0.0
+
+
+def latencySummary(latencies:List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {'count' : len(latencies), **{f'p{int(100 * q)}_ms' : 1000 * quantile(latencies, q) for q in (0.50, 0.95, 0.99)},
+        'max_ms' : 1000 * latencies[-1] if latencies else 0.0}
+
+
+async def monitorLag(lags:List[float], stop:asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(time.perf_counter() - start - LAG_INTERVAL)
+
+
+async def replay(bot, slash, guild:fakediscord.FakeGuild, trace:List[dict], concurrency:int) -> dict:
+    slots = asyncio.Semaphore(concurrency)
+    latencies = {}
+    errors = {}
+    lags = []
+    stop = asyncio.Event()
+    monitor = asyncio.ensure_future(monitorLag(lags, stop))
+
+    async def invoke(inv, handler, scheduled):
+        async with slots:
+            options = dict(inv['options'])
+            if options.get('user') is not None:
+                options['user'] = guild.get_member(options['user'])
+            author = guild.get_member(inv['author']) or fakediscord.FakeMember(inv['author'], str(inv['author']), guild)
+            ctx = fakediscord.FakeContext(bot, guild, author, inv['command'])
+            try:
+                await handler.invoke(ctx, **options)
+            except Exception:
+                errors[inv['command']] = errors.get(inv['command'], 0) + 1
+            latencies.setdefault(inv['command'], []).append(time.perf_counter() - scheduled)
+
+    tasks = []
+    start = time.perf_counter()
+    for inv in trace:
+        handler = fakediscord.resolveCommand(slash, inv['command'])
+        scheduled = start + inv['at']
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(invoke(inv, handler, scheduled)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+
+    all_latencies = [t for ts in latencies.values() for t in ts]
+    return {
+        'invocations' : len(trace),
+        'offered_per_s' : len(trace) / trace[-1]['at'] if trace and trace[-1]['at'] > 0 else 0.0,
+        'throughput_per_s' : len(all_latencies) / elapsed,
+        'errors' : errors,
+        'latency' : latencySummary(all_latencies),
+        'commands' : {name : latencySummary(ts) for name, ts in sorted(latencies.items())},
+        'loop_lag' : latencySummary(lags),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=200, help="target invocations per second")
+    parser.add_argument('--duration', type=float, default=30, help="seconds of synthetic trace")
+    parser.add_argument('--concurrency', type=int, default=300, help="invocations in flight at most")
+    parser.add_argument('--send-ms', type=float, default=50, help="simulated Discord round trip per message sent")
+    parser.add_argument('--rows', type=int, default=100000, help="log rows generated when --db does not exist yet")
+    parser.add_argument('--members', type=int, default=200, help="members generated when --db does not exist yet")
+    parser.add_argument('--db', help="synthetic database to use, generated if missing; defaults to a temporary file")
+    parser.add_argument('--trace', help="trace to replay instead of a synthetic one")
+    parser.add_argument('--write-trace', help="save the replayed trace to this file")
+    parser.add_argument('--out', help="JSON file receiving the results")
+    parser.add_argument('--seed', type=int, default=0, help="random seed of the synthetic trace")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    db_file = args.db if args.db else os.path.join(tmp.name, 'synthetic.db')
+    db = BrisketDB(db_file)
+    if not db[SkillDB.SkillLogTable.TABLE_NAME].count:
+        synthetic_guild.populate(db, args.members, args.rows)
+    members = {i : name for i, name in MemberTable.activeMembers(db).items() if i >= synthetic_guild.FIRST_MEMBER_ID}
+    db.conn.close()
+
+    if args.trace:
+        trace = loadTrace(args.trace, args.rate)
+    else:
+        trace = syntheticTrace(sorted(members), args.rate, args.duration, args.seed)
+    if args.write_trace:
+        with open(args.write_trace, 'w') as f:
+            f.writelines(json.dumps(inv) + '\n' for inv in trace)
+
+    bot, slash, brisket_db = fakediscord.createApp(db_file)
+    fakediscord.FakeContext.send_delay = args.send_ms / 1000
+    guild = fakediscord.FakeGuild(members, sorted(brisketbot.allowed_role_ids))
+    result = bot.loop.run_until_complete(replay(bot, slash, guild, trace, args.concurrency))
+    brisket_db.close()
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    lat, lag = result['latency'], result['loop_lag']
+    print(f"{result['invocations']} invocations, offered {result['offered_per_s']:.1f}/s, "
+        f"completed {result['throughput_per_s']:.1f}/s, {sum(result['errors'].values())} errors")
+    print(f"latency   p50 {lat['p50_ms']:8.2f} ms  p95 {lat['p95_ms']:8.2f} ms  p99 {lat['p99_ms']:8.2f} ms  max {lat['max_ms']:8.2f} ms")
+    print(f"loop lag  p50 {lag['p50_ms']:8.2f} ms  p95 {lag['p95_ms']:8.2f} ms  p99 {lag['p99_ms']:8.2f} ms  max {lag['max_ms']:8.2f} ms")
+    for name, s in result['commands'].items():
+        print(f"{name:>18}: {s['count']:6d}  p50 {s['p50_ms']:8.2f} ms  p99 {s['p99_ms']:8.2f} ms")
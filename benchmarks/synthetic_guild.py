@@ -0,0 +1,104 @@
+"""
+Synthetic guild database: a configurable number of members and log rows spread over skilllogs, weaponlogs,
+banklogs and characterlevellog, dated across the past year.
+
+Rows are inserted through the same table helpers as the bot, so the ledger, monthly rollup and current skill
+level tables are kept up to date by their triggers exactly as in production.
+
+Run from the repository root:
+    python -m benchmarks.synthetic_guild synthetic.db [--members 200] [--rows 100000] [--days 365] [--seed 0]
+"""
+import argparse
+import datetime
+import random
+import time
+from typing import Dict
+
+from BankDB import BankTable
+from BrisketDB import BrisketDB
+from CharacterDB import CharacTable
+from MemberDB import MemberTable
+import SkillDB
+import WeaponDB
+
+# Share of the rows logged to each table
+TABLE_SHARES = {
+    SkillDB.SkillLogTable.TABLE_NAME : 0.40,
+    WeaponDB.WeaponLogTable.TABLE_NAME : 0.40,
+    BankTable.TABLE_NAME : 0.15,
+    CharacTable.TABLE_NAME : 0.05,
+}
+# Rows inserted per transaction
+CHUNK_ROWS = 10000
+# Synthetic Discord IDs are allocated upwards from here, out of the way of the default members
+FIRST_MEMBER_ID = 10**17
+
+
+def memberIds(members:int) -> list:
+    return [FIRST_MEMBER_ID + i for i in range(members)]
+
+
+def populate(db:BrisketDB, members:int=200, rows:int=100000, days:int=365, seed:int=0) -> Dict[str, int]:
+    """Add <members> active members and <rows> log rows to <db>
+
+    :param db: Database to fill
+    :type db: BrisketDB
+    :param members: Number of members logging rows, defaults to 200
+    :type members: int, optional
+    :param rows: Total number of log rows, split according to TABLE_SHARES, defaults to 100000
+    :type rows: int, optional
+    :param days: Rows are dated uniformly over this many days up to today, defaults to 365
+    :type days: int, optional
+    :param seed: Random seed; the same arguments always produce the same data, defaults to 0
+    :type seed: int, optional
+    :return: Table name -> number of rows inserted
+    :rtype: Dict[str, int]
+    """
+    rng = random.Random(seed)
+    ids = memberIds(members)
+    MemberTable.syncMembers(db, {i : f"member{n}" for n, i in enumerate(ids)})
+
+    today = datetime.date.today()
+    dates = [today - datetime.timedelta(days=d) for d in range(days)]
+    skills = [s.value for s in SkillDB.Skills]
+    weapons = [w.value for w in WeaponDB.Weapons]
+
+    builders = {
+        SkillDB.SkillLogTable.TABLE_NAME : (SkillDB.SkillLogTable.insertSkillLogs,
+            lambda: SkillDB.SkillLogTable.buildSkillLog(rng.choice(ids), rng.choice(skills), rng.randrange(1, 201), rng.choice(dates))),
+        WeaponDB.WeaponLogTable.TABLE_NAME : (WeaponDB.WeaponLogTable.insertWeaponLogs,
+            lambda: WeaponDB.WeaponLogTable.buildWeaponLog(rng.choice(ids), rng.choice(weapons), rng.randrange(1, 21), rng.choice(dates))),
+        BankTable.TABLE_NAME : (BankTable.insertBankLogs,
+            lambda: BankTable.buildBankLog(rng.choice(ids), round(rng.uniform(1, 5000), 2), rng.choice(dates), None)),
+        CharacTable.TABLE_NAME : (CharacTable.insertCharacLogs,
+            lambda: CharacTable.buildCharacLog(rng.choice(ids), rng.randrange(1, 61), rng.choice(dates))),
+    }
+
+    counts = {}
+    for table_name, share in TABLE_SHARES.items():
+        insert_many, build = builders[table_name]
+        counts[table_name] = remaining = int(rows * share)
+        while remaining > 0:
+            chunk = min(remaining, CHUNK_ROWS)
+            with db.conn:
+                insert_many(db, [build() for _ in range(chunk)])
+            remaining -= chunk
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('db_file', help="database to create or add to")
+    parser.add_argument('--members', type=int, default=200, help="members logging rows")
+    parser.add_argument('--rows', type=int, default=100000, help="log rows across all four log tables")
+    parser.add_argument('--days', type=int, default=365, help="days the rows are dated over")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    db = BrisketDB(args.db_file)
+    counts = populate(db, args.members, args.rows, args.days, args.seed)
+    db.conn.close()
+    for table_name, n in counts.items():
+        print(f"{table_name:>18}: {n} rows")
+    print(f"Generated in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,88 @@
+"""
+Read latency of view-style queries while a burst of write transactions is being committed,
+for each BrisketDB connection profile.
+
+With the default profile reads queue on the single database thread behind every pending write;
+with the WAL profile they are served by the read-only pool while the writer is busy.
+
+Run from the repository root:
+    python -m benchmarks.wal_read_latency [--rows 20000] [--writes 200] [--batch 100] [--reads 200] [--concurrency 1]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from AsyncBrisketDB import AsyncBrisketDB
+from BankDB import BankTable
+from BrisketDB import PROFILES
+
+READ_SQL = f"""SELECT {BankTable.MEMBERID_COL}, SUM({BankTable.AMNT_COL}) total, COUNT(*) n
+    FROM {BankTable.TABLE_NAME}
+    GROUP BY {BankTable.MEMBERID_COL}
+    ORDER BY total DESC
+    LIMIT 5"""
+
+
+def seed(db, rows:int):
+    records = [BankTable.buildBankLog(random.randrange(50), round(random.uniform(1, 500), 2)) for _ in range(rows)]
+    with db.conn:
+        BankTable.insertBankLogs(db, records)
+
+
+def writeTransaction(db, batch:int):
+    with db.conn:
+        BankTable.insertBankLogs(db, [BankTable.buildBankLog(i % 50, 1.0) for i in range(batch)])
+
+
+async def writeBurst(db:AsyncBrisketDB, writes:int, batch:int):
+    for _ in range(writes):
+        await db.run(writeTransaction, batch)
+
+
+async def readDuringBurst(db:AsyncBrisketDB, reads:int, burst:asyncio.Task) -> list:
+    latencies = []
+    while len(latencies) < reads and not burst.done():
+        start = time.perf_counter()
+        await db.query(READ_SQL)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.002)
+    return latencies
+
+
+async def runProfile(name:str, rows:int, writes:int, batch:int, reads:int, concurrency:int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = AsyncBrisketDB(os.path.join(tmp, 'bench.db'), profile=PROFILES[name])
+        await db.run(seed, rows)
+
+        burst = asyncio.ensure_future(writeBurst(db, writes, batch))
+        readers = [asyncio.ensure_future(readDuringBurst(db, reads // concurrency, burst)) for _ in range(concurrency)]
+        latencies = [t for r in await asyncio.gather(*readers) for t in r]
+        await burst
+        db.close()
+
+    latencies.sort()
+    return {
+        'profile' : name,
+        'reads' : len(latencies),
+        'p50_ms' : 1000 * statistics.median(latencies),
+        'p95_ms' : 1000 * latencies[int(0.95 * (len(latencies) - 1))],
+        'max_ms' : 1000 * latencies[-1],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000, help="rows seeded into banklogs")
+    parser.add_argument('--writes', type=int, default=200, help="transactions committed in the write burst")
+    parser.add_argument('--batch', type=int, default=100, help="rows inserted per transaction")
+    parser.add_argument('--reads', type=int, default=200, help="reads to time during the burst")
+    parser.add_argument('--concurrency', type=int, default=1, help="concurrent reader loops")
+    args = parser.parse_args()
+
+    for name in PROFILES:
+        result = asyncio.run(runProfile(name, args.rows, args.writes, args.batch, args.reads, args.concurrency))
+        print("{profile:>8}: {reads:4d} reads  p50 {p50_ms:7.2f} ms  p95 {p95_ms:7.2f} ms  max {max_ms:7.2f} ms".format(**result))
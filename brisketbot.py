@@ -1,18 +1,30 @@
+# Started before every other import when run as a script, so the startup report covers them
+from brisketstartup import StartupReport, loadPlugins
+startup = StartupReport() if __name__ == "__main__" else None
+
+import asyncio
 import datetime
+import json
+import logging
 import os
 import re
-from typing import Generator, List
+from typing import Callable, Dict, Generator, List, Tuple
 import discord  
 from discord import Guild, Member
 from discord.ext import commands
-from discord_slash import SlashCommand, SlashContext
-from discord_slash.model import SlashCommandOptionType, SlashCommandPermissionType
+from discord_slash import ComponentContext, SlashCommand, SlashContext
+from discord_slash.model import ButtonStyle, SlashCommandOptionType, SlashCommandPermissionType
+from discord_slash.utils.manage_components import create_actionrow, create_button
 from discord_slash.utils.manage_commands import create_choice, create_option, create_permission
 from sqlite_utils import Database
 from enum import IntEnum
 from dotenv import load_dotenv
-from sqlite_utils.db import NotFoundError, Table
-from BrisketDB import BrisketDB
+from sqlite_utils.db import Table
+from AsyncBrisketDB import AsyncBrisketDB
+from BrisketDB import PROFILES
+from BrisketQueries import MAX_DATE, MEMBER_NAME_COL, MIN_DATE, QUERIES, openSlowQueryLog
+from brisketmetrics import METRICS
+from brisketsync import syncIfChanged
 import brisketutils as bu
 
 # Database imports
@@ -20,14 +32,73 @@ from MemberDB import MemberTable
 import WeaponDB
 import SkillDB
 from CharacterDB import CharacTable
-from BankDB import BankTable
+from BankDB import BankTable, BankRollup
 
-load_dotenv()
-TOKEN = os.getenv('DISCORD_TOKEN')
-DEBUG_GUILD_ID = int(os.getenv('DEBUG_GUILD'))
-BRISKET_GUILD_ID = int(os.getenv('BRISKET_GUILD'))
 CMD_FLAG = '>>'
-DB_FILE = 'brisket.db'
+
+class BotConfig():
+    """Settings of one bot instance. See configFromEnv for the environment variables setting them when run as a script.
+
+    :param token: Discord bot token, defaults to None
+    :type token: str, optional
+    :param debug_guild_id: ID of the development guild, defaults to 0
+    :type debug_guild_id: int, optional
+    :param brisket_guild_id: ID of the company guild whose members are tracked, defaults to 0
+    :type brisket_guild_id: int, optional
+    :param db_file: Database file, or ':memory:', defaults to 'brisket.db'
+    :type db_file: str, optional
+    :param db_profile: Name of the BrisketDB.PROFILES connection profile, defaults to 'default'
+    :type db_profile: str, optional
+    :param metrics_interval: Seconds between command metrics log lines; 0 disables them, defaults to 600
+    :type metrics_interval: float, optional
+    :param slow_query_log: Rotating log file receiving view queries taking at least <slow_query_ms>, with their query plan;
+                           empty disables it, defaults to ''. configFromEnv defaults it to 'slow_queries.log'
+    :type slow_query_log: str, optional
+    :param slow_query_ms: Slow query threshold in milliseconds, defaults to 100
+    :type slow_query_ms: float, optional
+    :param sync_commands: Whether the slash commands are synced with Discord once the bot connects, defaults to True
+    :type sync_commands: bool, optional
+    :param command_hash_file: File recording the hash of the last synced command definitions; the sync is skipped
+                              while they are unchanged, defaults to 'command_hash.txt'
+    :type command_hash_file: str, optional
+    :param view_cache_size: Rendered skill and weapon views kept in the response cache; 0 disables it, defaults to 256
+    :type view_cache_size: int, optional
+    """
+
+    def __init__(self, token:str=None, debug_guild_id:int=0, brisket_guild_id:int=0, db_file:str='brisket.db',
+                 db_profile:str='default', metrics_interval:float=600, slow_query_log:str='',
+                 slow_query_ms:float=100, sync_commands:bool=True, command_hash_file:str='command_hash.txt',
+                 view_cache_size:int=256):
+        self.token = token
+        self.debug_guild_id = debug_guild_id
+        self.brisket_guild_id = brisket_guild_id
+        self.db_file = db_file
+        self.db_profile = db_profile
+        self.metrics_interval = metrics_interval
+        self.slow_query_log = slow_query_log
+        self.slow_query_ms = slow_query_ms
+        self.sync_commands = sync_commands
+        self.command_hash_file = command_hash_file
+        self.view_cache_size = view_cache_size
+
+def configFromEnv() -> BotConfig:
+    """Settings read from the environment, after loading any .env file:
+    DISCORD_TOKEN, DEBUG_GUILD, BRISKET_GUILD, BRISKET_DB, DB_PROFILE, METRICS_INTERVAL, SLOW_QUERY_LOG, SLOW_QUERY_MS,
+    COMMAND_HASH_FILE and VIEW_CACHE_SIZE
+    """
+    load_dotenv()
+    return BotConfig(
+        token=os.getenv('DISCORD_TOKEN'),
+        debug_guild_id=int(os.getenv('DEBUG_GUILD')),
+        brisket_guild_id=int(os.getenv('BRISKET_GUILD')),
+        db_file=os.getenv('BRISKET_DB', 'brisket.db'),
+        db_profile=os.getenv('DB_PROFILE', 'default'),
+        metrics_interval=float(os.getenv('METRICS_INTERVAL', '600')),
+        slow_query_log=os.getenv('SLOW_QUERY_LOG', 'slow_queries.log'),
+        slow_query_ms=float(os.getenv('SLOW_QUERY_MS', '100')),
+        command_hash_file=os.getenv('COMMAND_HASH_FILE', 'command_hash.txt'),
+        view_cache_size=int(os.getenv('VIEW_CACHE_SIZE', '256'))
+    )
 
 ## Brisket Brethren Role IDs
 allowed_roles = {
@@ -36,88 +107,406 @@ allowed_roles = {
     'officer'  : 894807444230914068,
     'settler'  : 894807523654238229
 }
+allowed_role_ids = set(allowed_roles.values())
 
 ## Restrict slash commands to users with Dev role
 allowed_slash_roles = []
-brisket_perms = {BRISKET_GUILD_ID : [create_permission(898814200040812585, SlashCommandPermissionType.ROLE, True)]}
-allow_me = {DEBUG_GUILD_ID : [create_permission(406849788303114241, SlashCommandPermissionType.USER,True)]}
-all_perms = {**brisket_perms, **allow_me}
+# Permission sets named by the command declarations; create_app resolves them against the configured guilds
+BRISKET_PERMS = 'brisket'
+ALL_PERMS = 'all'
+
+def commandPermissions(config:BotConfig) -> Dict[str, dict]:
+    brisket_perms = {config.brisket_guild_id : [create_permission(898814200040812585, SlashCommandPermissionType.ROLE, True)]}
+    allow_me = {config.debug_guild_id : [create_permission(406849788303114241, SlashCommandPermissionType.USER,True)]}
+    return {BRISKET_PERMS : brisket_perms, ALL_PERMS : {**brisket_perms, **allow_me}}
+
+## Command declarations
+# Handlers are declared at import and only registered, on the SlashCommand of each app, by create_app.
+# They reach the database of the app serving them as ctx.bot.brisket_db.
+_COMMANDS : List[Tuple[str, dict, Callable]] = []
+
+def command(**options):
+    """Declare a top-level slash command; takes the options of SlashCommand.slash
+    """
+    def declare(func):
+        _COMMANDS.append(('slash', options, func))
+        return func
+    return declare
 
-## Instantiating Bot and slash objects
-intents = discord.Intents.default()
-intents.members = True
-bot = commands.Bot(command_prefix=CMD_FLAG, intents=intents)
-slash = SlashCommand(bot, sync_commands=True)
+def subcommand(**options):
+    """Declare a slash subcommand; takes the options of SlashCommand.subcommand
+    """
+    def declare(func):
+        _COMMANDS.append(('subcommand', options, func))
+        return func
+    return declare
 
-## Initializing database
-brisket_db = BrisketDB(DB_FILE)
+def registerCommands(slash:SlashCommand, permissions:Dict[str, dict]):
+    """Register every declared command on <slash>, with permission set names replaced from <permissions>
+    """
+    for kind, options, func in _COMMANDS:
+        options = {k : permissions[v] if k in ('permissions', 'base_permissions') else v for k, v in options.items()}
+        getattr(slash, kind)(**options)(func)
 
 ## Reply decorator
+class CommandRefused(Exception):
+    """Raised by a handler wrapped in replydec to turn down a request, replying with its message instead of "Success!"
+    """
+
 def replydec(func):
     async def wrapper(ctxt:SlashContext,*args, **kwargs):
         try:
             await func(ctxt,*args,**kwargs)
             await ctxt.send(f"Success!", hidden=True)
+        except CommandRefused as err:
+            await ctxt.send(str(err))
         except Exception as err:
             await ctxt.send(f"Got Error: {str(err)}",hidden=True)
             raise(err)
     
     return wrapper
 
-## Bot Events ###################################################
-@bot.event
-async def on_ready():
-    print("Ready!")  
-    
-    # Get Brisket Brethren guild object
-    # If found, populate members table 
-    brisket_guild = bot.get_guild(BRISKET_GUILD_ID)
-    print(brisket_guild)
-    allowed_role_obj = [brisket_guild.get_role(rid) for rid in allowed_roles.values()]
-    
-    member_ids = []
-    member_names = []
-    for rid in allowed_roles.values():
-        role = brisket_guild.get_role(rid)
-        for m in role.members:
-            if m.id not in member_ids:
-                member_ids.append(m.id)
-                member_names.append(m.display_name)   
-    
-    MemberTable.upsertMembers(brisket_db, member_name=member_names, discord_ids=member_ids)
-    for r in brisket_db[MemberTable.TABLE_NAME].rows:
-        print(r)
-
-@bot.event
-async def on_error(event:str, *args, **kwargs):
-    print("Error Event!")
-    await bot.close()
+## Bot ##########################################################
+class BrisketBot(commands.Bot):
+    """Discord client of one bot instance, handling the gateway events. Slash handlers reach its database as ctx.bot.brisket_db.
+
+    :param config: Settings of the instance
+    :type config: BotConfig
+    :param brisket_db: Database of the instance
+    :type brisket_db: AsyncBrisketDB
+    :param startup: Startup report completed on the first on_ready, defaults to None
+    :type startup: StartupReport, optional
+    """
+
+    def __init__(self, config:BotConfig, brisket_db:AsyncBrisketDB, startup:StartupReport=None, **kwargs):
+        super().__init__(**kwargs)
+        self.config = config
+        self.brisket_db = brisket_db
+        self.startup = startup
+        # Rendered skill and weapon views, see _sendCachedView
+        self.view_cache = bu.ResponseCache(config.view_cache_size)
+        self._metrics_task = None
+        self._sync_task = None
+
+    async def close(self):
+        # Batched log inserts still waiting in the write coalescer are committed before the loop stops
+        await self.brisket_db.writes.drain()
+        await super().close()
+
+    def _syncDone(self, task:asyncio.Task):
+        """Report the outcome of the startup command sync, which nothing else awaits
+        """
+        if task.cancelled():
+            return
+        err = task.exception()
+        if err is not None:
+            # The hash is left unchanged, so the next start retries the sync
+            logging.getLogger('brisket.sync').error("Slash command sync failed", exc_info=err)
+            label = f"command sync failed ({type(err).__name__})"
+        else:
+            label = "command sync" if task.result() else "command sync skipped"
+        if self.startup is not None:
+            self.startup.mark(label)
+
+    async def on_ready(self):
+        print("Ready!")  
+        if self.startup is not None and 'on_ready' not in dict(self.startup.marks):
+            self.startup.stop()
+            self.startup.mark('on_ready')
+            print(self.startup.report())
+        if self.config.metrics_interval > 0 and self._metrics_task is None:
+            self._metrics_task = self.loop.create_task(METRICS.logPeriodically(self.config.metrics_interval))
+        # Once per process; skipped altogether when the definitions match the last sync
+        if self.config.sync_commands and self._sync_task is None:
+            self._sync_task = self.loop.create_task(syncIfChanged(self.slash, self.config.command_hash_file))
+            self._sync_task.add_done_callback(self._syncDone)
+        
+        # Get Brisket Brethren guild object
+        # If found, bring members table in line with the guild; only differing rows are written
+        brisket_guild = self.get_guild(self.config.brisket_guild_id)
+        print(brisket_guild)
+        
+        current = {}
+        for rid in allowed_roles.values():
+            role = brisket_guild.get_role(rid)
+            for m in role.members:
+                current[m.id] = m.display_name
+        
+        written, removed = await self.brisket_db.run(MemberTable.syncMembers, current)
+        print(f"Member sync: {len(current)} members, {written} written, {removed} deactivated")
+
+    def _isTracked(self, member:Member) -> bool:
+        """Whether <member> belongs to the Brisket guild and holds one of the allowed roles
+        """
+        return member.guild.id == self.config.brisket_guild_id and any(r.id in allowed_role_ids for r in member.roles)
+
+    async def on_member_join(self, member:Member):
+        if self._isTracked(member):
+            await self.brisket_db.run(MemberTable.setMember, member.id, member.display_name)
+
+    async def on_member_update(self, before:Member, after:Member):
+        # Only role and nickname changes affect the members table
+        was_tracked, is_tracked = self._isTracked(before), self._isTracked(after)
+        if is_tracked and (not was_tracked or before.display_name != after.display_name):
+            await self.brisket_db.run(MemberTable.setMember, after.id, after.display_name)
+        elif was_tracked and not is_tracked:
+            await self.brisket_db.run(MemberTable.deactivateMember, after.id)
+
+    async def on_member_remove(self, member:Member):
+        if self._isTracked(member):
+            await self.brisket_db.run(MemberTable.deactivateMember, member.id)
+
+    async def on_component(self, ctx:ComponentContext):
+        if ctx.custom_id.startswith(PAGE_PREFIX + '|'):
+            await _turnPage(ctx)
+
+    async def on_error(self, event:str, *args, **kwargs):
+        print("Error Event!")
+        await self.close()
+
+## Member name resolution #######################################
+# View queries JOIN the members table for names; the guild is only consulted, through a bounded cache,
+# for IDs the table has never recorded
+member_name_cache = bu.LRUCache(maxsize=256)
+
+def _guildName(guild:Guild, member_id:int) -> str:
+    """Display name of <member_id> from <guild>'s member cache, else the raw ID
+    """
+    def lookup(member_id):
+        member = guild.get_member(member_id) if guild is not None else None
+        return member.display_name if member is not None else None
+
+    name = member_name_cache.get(member_id, lookup)
+    return name if name is not None else str(member_id)
+
+# Columns of weapon leaderboard tables, matching the SQL weapon views
+LEADERBOARD_COLS = [WeaponDB.WeaponLogTable.UPDATEID_COL, WeaponDB.WeaponLogTable.DATE_COL, WeaponDB.WeaponLogTable.MEMBERID_COL,
+    MEMBER_NAME_COL, WeaponDB.WeaponLogTable.WEAPONID_COL, WeaponDB.WeaponLogTable.LEVEL_COL]
+
+async def _leaderboardTable(brisket_db:AsyncBrisketDB, rows:List[dict]) -> Tuple[List[str], List[tuple]]:
+    """Lay out weapon leaderboard rows like a view query result, naming their members with a single query
+    """
+    member_ids = list({r[WeaponDB.WeaponLogTable.MEMBERID_COL] for r in rows})
+    names = dict((await brisket_db.namedTable('members.names', (json.dumps(member_ids),)))[1])
+    for r in rows:
+        r[MEMBER_NAME_COL] = names.get(r[WeaponDB.WeaponLogTable.MEMBERID_COL])
+    return LEADERBOARD_COLS, [tuple(r[c] for c in LEADERBOARD_COLS) for r in rows]
+
+def _displayTable(guild:Guild, columns:List[str], rows:List[tuple]) -> Tuple[List[str], List[tuple]]:
+    """Drop the MemberID column of a view result in favour of its already resolved Member column
+    """
+    id_idx = columns.index(BankTable.MEMBERID_COL)
+    name_idx = columns.index(MEMBER_NAME_COL)
+
+    display = []
+    for r in rows:
+        if r[name_idx] is None and r[id_idx] is not None:
+            r = r[:name_idx] + (_guildName(guild, r[id_idx]),) + r[name_idx + 1:]
+        display.append(r[:id_idx] + r[id_idx + 1:])
+    return columns[:id_idx] + columns[id_idx + 1:], display
+
+def _renderTable(guild:Guild, columns:List[str], rows:List[tuple], components:List[dict]=None) -> Tuple[List[str], List[dict]]:
+    """A view result rendered as messages within Discord's length limit, with the <components> of the last one
+    """
+    return bu.renderTable(*_displayTable(guild, columns, rows)), components
+
+async def _sendPages(ctx:SlashContext, pages:List[str], components:List[dict]=None):
+    """Send rendered <pages> as one message each, <components> attached to the last one
+    """
+    for page in pages[:-1]:
+        await ctx.send(page)
+    await ctx.send(pages[-1], components=components)
+
+async def _sendTable(ctx:SlashContext, columns:List[str], rows:List[tuple], components:List[dict]=None):
+    """Send a view result as one or more messages within Discord's length limit.
+    <components> are attached to the last message.
+    """
+    await _sendPages(ctx, *_renderTable(ctx.guild, columns, rows, components))
+
+def _checkMutation(ctx:SlashContext, result:Tuple[bu.MutationResult, int], not_found:str):
+    """Refuse the command, telling the caller why, if an ownership-guarded update or delete changed nothing
+
+    :raises CommandRefused: If the record does not exist or belongs to another member
+    """
+    outcome, owner_id = result
+    if outcome == bu.MutationResult.NOT_FOUND:
+        raise CommandRefused(not_found)
+    elif outcome == bu.MutationResult.NOT_OWNER:
+        raise CommandRefused(f"You do not have permission to modify this record by {_guildName(ctx.guild, owner_id)}.")
+
+## Keyset pagination ############################################
+# Previous/Next buttons carry the whole page cursor in their custom_id:
+#   page|<view>|<next or prev>|<date>|<pk>|<page size>|<comma separated filter values>|<since>|<until>
+# with since/until as YYYYMMDD, empty when open, and date empty for an undated row
+# so turning a page needs no state on the bot and costs one index range scan, however deep the page.
+PAGE_PREFIX = 'page'
+CUSTOM_ID_LIMIT = 100
+# Largest lastn a view accepts; further rows are reached with the page buttons
+MAX_VIEW_ROWS = 50
+
+def _dateRange(since:str, until:str) -> Tuple[str, str]:
+    """Validated, inclusive ISO date range of a view; open ends become MIN_DATE and MAX_DATE
+
+    :raises ValueError: If a date is not formatted YYYY-MM-DD
+    """
+    since = datetime.date.fromisoformat(since).isoformat() if since != None else MIN_DATE
+    until = datetime.date.fromisoformat(until).isoformat() if until != None else MAX_DATE
+    return since, until
+
+def _viewQuery(view:str, since:str, until:str) -> Tuple[str, tuple]:
+    """Name of the query serving paginated <view> over a date range, and the range parameters it takes.
+    Only an open range lists undated rows, see QueryRegistry.registerPaged.
+    """
+    if (since, until) == (MIN_DATE, MAX_DATE):
+        return view, ()
+    return f"{view}.range", (since, until)
+
+def _pageButtons(view:str, columns:List[str], rows:List[tuple], filters:tuple, lastn:int, since:str, until:str) -> List[dict]:
+    """Previous/Next buttons continuing <view> from the first and last of the shown <rows>
+    """
+    if not rows:
+        return []
+
+    date_idx, pk_idx = (columns.index(c) for c in QUERIES.pageKey(view))
+    bounds = ['' if d in (MIN_DATE, MAX_DATE) else d.replace('-', '') for d in (since, until)]
+    def custom_id(direction, row):
+        date = '' if row[date_idx] is None else str(row[date_idx])
+        return '|'.join([PAGE_PREFIX, view, direction, date, str(row[pk_idx]), str(lastn),
+            ','.join(str(f) for f in filters), *bounds])
+
+    ids = custom_id('prev', rows[0]), custom_id('next', rows[-1])
+    if max(len(i) for i in ids) > CUSTOM_ID_LIMIT:
+        return []
+    return [create_actionrow(
+        create_button(style=ButtonStyle.gray, label="Previous", custom_id=ids[0]),
+        create_button(style=ButtonStyle.gray, label="Next", custom_id=ids[1])
+    )]
+
+async def _viewPage(brisket_db:AsyncBrisketDB, view:str, filters:tuple, lastn:int, since:str=MIN_DATE,
+                    until:str=MAX_DATE) -> Tuple[List[str], List[tuple], List[dict]]:
+    """First page of a paginated view with its Previous/Next buttons
+    """
+    name, bounds = _viewQuery(view, since, until)
+    columns, rows = await brisket_db.namedTable(name, (*filters, *bounds, lastn))
+    return columns, rows, _pageButtons(view, columns, rows, filters, lastn, since, until)
+
+async def _sendView(ctx:SlashContext, view:str, filters:tuple, lastn:int, since:str=MIN_DATE, until:str=MAX_DATE):
+    """Send the first page of a paginated view with its Previous/Next buttons
+    """
+    await _sendTable(ctx, *await _viewPage(ctx.bot.brisket_db, view, filters, lastn, since, until))
+
+## View response cache ##########################################
+# Rendered skill and weapon views are kept in the bot's view_cache, keyed by command and normalized options,
+# and served until one of the tables they read is written (see brisketutils.ResponseCache)
+SKILL_VIEW_TABLES = (SkillDB.SkillLogTable.TABLE_NAME, SkillDB.SkillCurrentTable.TABLE_NAME, MemberTable.TABLE_NAME)
+WEAPON_VIEW_TABLES = (WeaponDB.WeaponLogTable.TABLE_NAME, MemberTable.TABLE_NAME)
+
+def _viewKey(command:str, guild_id:int, member_id:int, item:int, lastn:int, best:bool, since:str, until:str) -> tuple:
+    """Cache key of a skill or weapon view of <item>. Options the selected view ignores are dropped,
+    so invocations showing the same result share an entry.
+    """
+    if member_id is not None and item is None:
+        # A member's best levels take neither a page size nor best
+        lastn, best = None, False
+    elif member_id is not None or item is None:
+        best = False
+    return (command, guild_id, member_id, item, lastn, bool(best), since, until)
+
+async def _sendCachedView(ctx:SlashContext, key:tuple, table_names:Tuple[str, ...], load:Callable):
+    """Send the view whose (columns, rows, components) load() returns, rendered once and then served from the cache
+    until one of <table_names> is written
+    """
+    async def render():
+        columns, rows, components = await load()
+        return _renderTable(ctx.guild, columns, rows, components)
+
+    await _sendPages(ctx, *await ctx.bot.view_cache.get(key, table_names, render))
+
+@METRICS.timed
+async def _turnPage(ctx:ComponentContext):
+    _, view, direction, date, pk, lastn, filters, since, until = ctx.custom_id.split('|')
+    filters = tuple(int(f) for f in filters.split(',') if f)
+    lastn = min(int(lastn), MAX_VIEW_ROWS)
+    since, until = (f"{d[:4]}-{d[4:6]}-{d[6:]}" if d else default for d, default in ((since, MIN_DATE), (until, MAX_DATE)))
+
+    name, bounds = _viewQuery(view, since, until)
+    columns, rows = await ctx.bot.brisket_db.namedTable(f"{name}.{direction}", (*filters, *bounds, date or None, int(pk), lastn))
+    if not rows:
+        await ctx.send("No more entries.", hidden=True)
+        return
+    if direction == 'prev':
+        # Fetched walking backwards from the cursor
+        rows.reverse()
+
+    components = _pageButtons(view, columns, rows, filters, lastn, since, until)
+    pages = bu.renderTable(*_displayTable(ctx.guild, columns, rows))
+    if len(pages) == 1:
+        await ctx.edit_origin(content=pages[0], components=components)
+    else:
+        await _sendTable(ctx, columns, rows, components)
+
 ###################################################################
 
 ## Test Slash Commands ############################################
-@slash.slash(name="ping",
+@command(name="ping",
     description="A test slash command",
     default_permission=False,
-    permissions=all_perms,
+    permissions=ALL_PERMS,
 )
+@METRICS.timed
 async def ping(ctx: SlashContext):
     await ctx.send("pong")
 
-@slash.slash(name='closebot',
+@command(name='closebot',
     default_permission=False,
     description="Close bot"
 )
+@METRICS.timed
 @replydec
 async def _close_bot(ctx:SlashContext):
-    await bot.close()
+    await ctx.bot.close()
+
+@subcommand(base='admin',
+    name='stats',
+    description="Per-command latency, error and database time statistics",
+    base_default_permission=False,
+    base_permissions=ALL_PERMS
+)
+@METRICS.timed
+async def _admin_stats(ctx:SlashContext):
+    columns, rows = METRICS.table()
+    if not rows:
+        await ctx.send("No commands recorded yet.", hidden=True)
+        return
+    for page in bu.renderTable(columns, rows):
+        await ctx.send(page, hidden=True)
+
+    cache = ctx.bot.view_cache
+    lookups = cache.hits + cache.misses
+    await ctx.send(f"View cache: {len(cache)}/{cache.maxsize} entries, {cache.hits} hits, {cache.misses} misses"
+        + (f" ({100 * cache.hits / lookups:.0f}% hit rate)" if lookups else ""), hidden=True)
 ##########################################################################
 
 ## Bank Slash Commands ###################################################
-@slash.subcommand(base='bank',
+# Date range options shared by the view subcommands
+view_date_options = [
+    create_option(name='since',
+        description="Only entries dated on or after YYYY-MM-DD",
+        required=False,
+        option_type=SlashCommandOptionType.STRING
+    ),
+    create_option(name='until',
+        description="Only entries dated on or before YYYY-MM-DD",
+        required=False,
+        option_type=SlashCommandOptionType.STRING
+    )
+]
+
+@subcommand(base='bank',
     name='add',
     description="Record donation to company bank",
     base_default_permission=False,
-    base_permissions=brisket_perms,
+    base_permissions=BRISKET_PERMS,
     options=[
         create_option(name="amount",
             description="Donation amount",
@@ -136,21 +525,22 @@ async def _close_bot(ctx:SlashContext):
         )
     ]
 )
+@METRICS.timed
 @replydec
 async def _bank_add(ctx:SlashContext,amount:float,note:str=None,date:str=None):
     if date != None:
         try:
             date = datetime.date.fromisoformat(date)
         except ValueError as err:
-            new_err = str(err) + '. Require date format YYYY-MM-DD.'
-            await ctx.send(new_err)
-            return
+            raise CommandRefused(str(err) + '. Require date format YYYY-MM-DD.') from err
 
     id = ctx.author_id
-    BankTable.insertBankLog(brisket_db, member_id=id, amount=amount, note=note, date=date)
+    amount = BankTable.toCents(amount) / 100
+    await ctx.bot.brisket_db.insertBatched(BankTable.insertBankLogs, BankTable.buildBankLog(member_id=id, amount=amount, note=note, date=date,
+        idem_key=int(ctx.interaction_id)))
     
 
-@slash.subcommand(base='bank',
+@subcommand(base='bank',
     name='delete',
     description="Delete company bank donation",
     base_default_permission=False,
@@ -162,26 +552,14 @@ async def _bank_add(ctx:SlashContext,amount:float,note:str=None,date:str=None):
         )
     ]
 )
+@METRICS.timed
 @replydec
 async def _bank_delete(ctx:SlashContext,xactid:int):
-    # Check if record exists
-    try:
-        xaction = brisket_db[BankTable.TABLE_NAME].get(xactid)
-    except NotFoundError:
-        await ctx.send(f"Transaction #{xactid} does not exist.")
-        return
-    
-    # Check that caller created record to delete
-    caller_id = ctx.author_id
-    record_id = xaction[BankTable.MEMBERID_COL] 
-    if record_id != caller_id:
-        record_name = ctx.guild.get_member(record_id).display_name
-        await ctx.send(f"You do not have permission to modify this record by {record_name}.")
-        return
-    else:
-        BankTable.deleteBankLog(brisket_db, xactid)
+    # Ownership is checked by the DELETE itself
+    result = await ctx.bot.brisket_db.run(BankTable.deleteBankLog, xactid, member_id=ctx.author_id)
+    _checkMutation(ctx, result, f"Transaction #{xactid} does not exist.")
 
-@slash.subcommand(base='bank',
+@subcommand(base='bank',
     name='edit',
     description="Edit an existing record.",
     base_default_permission=False,
@@ -208,27 +586,27 @@ async def _bank_delete(ctx:SlashContext,xactid:int):
         )
     ]
 )
+@METRICS.timed
 @replydec
 async def _bank_edit(ctx: SlashContext, xactid:int, amount:str=None, date:str=None, note:str=None):
-    # Check if record exists
-    try:
-        xaction = brisket_db[BankTable.TABLE_NAME].get(xactid)
-    except NotFoundError:
-        await ctx.send(f"Transaction #{xactid} does not exist.")
-        return
-    
-    # Check that caller created record to delete
-    caller_id = ctx.author_id
-    record_id = xaction[BankTable.MEMBERID_COL] 
-    if record_id != caller_id:
-        record_name = ctx.guild.get_member(record_id).display_name
-        await ctx.send(f"You do not have permission to modify this record by {record_name}.")
-        return
-    else:
-        amount = float(amount) // 0.01 / 100
-        BankTable.updateBankLog(brisket_db, xactid, amount, date, note)
+    # Dates are stored as ISO text; anything else is rejected before reaching the log
+    if date != None:
+        try:
+            date = datetime.date.fromisoformat(date)
+        except ValueError as err:
+            raise CommandRefused(str(err) + '. Require date format YYYY-MM-DD.') from err
+
+    if amount != None:
+        try:
+            amount = BankTable.toCents(amount) / 100
+        except ValueError as err:
+            raise CommandRefused(str(err)) from err
+
+    # Ownership is checked by the UPDATE itself
+    result = await ctx.bot.brisket_db.run(BankTable.updateBankLog, xactid, amount, date, note, member_id=ctx.author_id)
+    _checkMutation(ctx, result, f"Transaction #{xactid} does not exist.")
 
-@slash.subcommand(base='bank',
+@subcommand(base='bank',
     name='view',
     description='Show donation logs',
     base_default_permission=False,
@@ -239,52 +617,37 @@ async def _bank_edit(ctx: SlashContext, xactid:int, amount:str=None, date:str=No
             required=False
         ),
         create_option(name='lastn',
-            description="Display the last N donations",
+            description=f"Display the last N donations, at most {MAX_VIEW_ROWS}",
             required=False,
             option_type=SlashCommandOptionType.INTEGER
         )
-    ])
-async def _bank_print(ctx:SlashContext, user:discord.Member=None, lastn:int=5):   
+    ] + view_date_options)
+@METRICS.timed
+async def _bank_print(ctx:SlashContext, user:discord.Member=None, lastn:int=5, since:str=None, until:str=None):   
+    lastn = min(lastn, MAX_VIEW_ROWS)
+    try:
+        since, until = _dateRange(since, until)
+    except ValueError as err:
+        await ctx.send(str(err) + '. Require date format YYYY-MM-DD.')
+        return
+
     if user != None:
-        member_id = user.id
-        results = brisket_db.query(f"""SELECT 
-            {BankTable.XACTID_COL},{BankTable.DATE_COL}, {BankTable.MEMBERID_COL}, {BankTable.AMNT_COL}, {BankTable.NOTE_COL}
-            FROM {BankTable.TABLE_NAME} 
-            WHERE {BankTable.MEMBERID_COL} = {member_id} 
-            ORDER BY {BankTable.DATE_COL} DESC 
-            LIMIT {lastn}""")
+        await _sendView(ctx, 'bank.view.member', (user.id,), lastn, since, until)
     else:
-        results = brisket_db.query(f"""SELECT 
-            {BankTable.XACTID_COL},{BankTable.DATE_COL}, {BankTable.MEMBERID_COL}, {BankTable.AMNT_COL}, {BankTable.NOTE_COL}
-            FROM {BankTable.TABLE_NAME}  
-            ORDER BY {BankTable.DATE_COL} DESC 
-            LIMIT {lastn}""")
-    
-    dictList = bu.listDictToDictList(list(results))
-
-    member_names = [ctx.guild.get_member(id).display_name if id != None else None for id in dictList[BankTable.MEMBERID_COL]]
-    
-    new_dict = dictList
-    del new_dict[BankTable.MEMBERID_COL]
-    new_dict["Member"] = member_names
-        
-    string = bu.formatTable(new_dict)
-    await ctx.send(string)
+        await _sendView(ctx, 'bank.view.recent', (), lastn, since, until)
 
-@slash.subcommand(base='bank',
+@subcommand(base='bank',
     subcommand_group='balance',
     name='get',
     description='Show current company bank balance',
     base_default_permission=False,
 )
+@METRICS.timed
 async def _bank_get_balance(ctx:SlashContext):
-    results = brisket_db.query(f"SELECT {BankTable.AMNT_COL} FROM {BankTable.TABLE_NAME} ORDER BY {BankTable.XACTID_COL} ASC")
-    bal = 0
-    for r in results:
-        bal = bal + r[BankTable.AMNT_COL]
-    await ctx.send(f"Current Company Bank Balance: {bal // 0.01 / 100}")
+    results = await ctx.bot.brisket_db.namedQuery('bank.balance')
+    await ctx.send(f"Current Company Bank Balance: {BankTable.formatCents(results[0]['cents'])}")
 
-@slash.subcommand(base='bank',
+@subcommand(base='bank',
     subcommand_group='balance',
     name='setinit',
     description='Set initial bank balance. All logged donations will be summed into this value',
@@ -297,20 +660,68 @@ async def _bank_get_balance(ctx:SlashContext):
         )
     ]
 )
+@METRICS.timed
 @replydec
 async def _bank_set_balance(ctx:SlashContext, initbal:str):
-    initbal = float(initbal) // 0.01 / 100 # truncate to two decimal places
-    BankTable.updateBankLog(brisket_db, 0, initbal, date=datetime.date.today(), note="Initial Balance")
+    try:
+        initbal = BankTable.toCents(initbal) / 100
+    except ValueError as err:
+        raise CommandRefused(str(err)) from err
+    await ctx.bot.brisket_db.run(BankTable.updateBankLog, 0, initbal, date=datetime.date.today(), note="Initial Balance")
+
+@subcommand(base='bank',
+    name='stats',
+    description='Top donors and donations per week over a date range',
+    base_default_permission=False,
+    options=[
+        create_option(name='since',
+            description="First day as YYYY-MM-DD. Defaults to the start of this month.",
+            required=False,
+            option_type=SlashCommandOptionType.STRING
+        ),
+        create_option(name='until',
+            description="Last day as YYYY-MM-DD. Defaults to today.",
+            required=False,
+            option_type=SlashCommandOptionType.STRING
+        ),
+        create_option(name='top',
+            description="Number of donors to show",
+            required=False,
+            option_type=SlashCommandOptionType.INTEGER
+        )
+    ]
+)
+@METRICS.timed
+async def _bank_stats(ctx:SlashContext, since:str=None, until:str=None, top:int=10):
+    try:
+        until = datetime.date.fromisoformat(until) if until != None else datetime.date.today()
+        since = datetime.date.fromisoformat(since) if since != None else until.replace(day=1)
+    except ValueError as err:
+        await ctx.send(str(err) + '. Require date format YYYY-MM-DD.')
+        return
+    if since > until:
+        since, until = until, since
+
+    # Whole months are read from the monthly rollup; only the edge months touch the bank log
+    columns, rows = await ctx.bot.brisket_db.namedTable('bank.stats.donors', (*BankRollup.rangeParams(since, until), top))
+    weeks = max(((until - since).days + 1) / 7, 1)
+    cents_idx, count_idx = columns.index('cents'), columns.index('count')
+    columns = columns[:cents_idx] + ['Donated', 'Donations', 'Per week']
+    rows = [r[:cents_idx] + (BankTable.formatCents(r[cents_idx]), r[count_idx], BankTable.formatCents(round(r[cents_idx] / weeks)))
+        for r in rows]
+
+    await ctx.send(f"Top donors from {since} to {until}")
+    await _sendTable(ctx, columns, rows)
 #################################################################
 
 ## Skill Table Slash Commands ###################################
 skill_slash_choices = [create_choice(name=skill.name,value=skill.value) for skill in SkillDB.Skills]
 
-@slash.subcommand(base="skilllvls",
+@subcommand(base="skilllvls",
     name="add",
     description="Log a life skill level",
     base_default_permission=False,
-    base_permissions=all_perms,
+    base_permissions=ALL_PERMS,
     options=[
         create_option(name="skill",
             description="Trade Skill",
@@ -330,20 +741,21 @@ skill_slash_choices = [create_choice(name=skill.name,value=skill.value) for skil
         )
     ]
 )
+@METRICS.timed
 @replydec
 async def _skill_add(ctx:SlashContext,skill:int,lvl:int,date:str=None):
     if date != None:
         try:
             date = datetime.date.fromisoformat(date)
         except ValueError as err:
-            new_err = str(err) + '. Require date format YYYY-MM-DD.'
-            await ctx.send(new_err)
-            return
+            raise CommandRefused(str(err) + '. Require date format YYYY-MM-DD.') from err
 
     member_id = ctx.author_id
-    SkillDB.SkillLogTable.insertSkillLog(brisket_db, member_id=member_id,lvl=lvl,skill_id=skill, date=date)
+    await ctx.bot.brisket_db.insertBatched(SkillDB.SkillLogTable.insertSkillLogs,
+        SkillDB.SkillLogTable.buildSkillLog(member_id=member_id,lvl=lvl,skill_id=skill, date=date,
+            idem_key=int(ctx.interaction_id)))
 
-@slash.subcommand(base="skilllvls",
+@subcommand(base="skilllvls",
     name="edit",
     description="Log a life skill level",
     base_default_permission=False,
@@ -371,26 +783,22 @@ async def _skill_add(ctx:SlashContext,skill:int,lvl:int,date:str=None):
         )
     ]
 )
+@METRICS.timed
 @replydec
 async def _skill_edit(ctx:SlashContext, log_id:int, skill:int=None,lvl:int=None,date:str=None):
-    # Check if record exists
-    try:
-        skilllog = brisket_db[SkillDB.SkillLogTable.TABLE_NAME].get(log_id)
-    except NotFoundError:
-        await ctx.send(f"Transaction #{log_id} does not exist.")
-        return
+    # Dates are stored as ISO text; anything else is rejected before reaching the log
+    if date != None:
+        try:
+            date = datetime.date.fromisoformat(date)
+        except ValueError as err:
+            raise CommandRefused(str(err) + '. Require date format YYYY-MM-DD.') from err
 
-    # Check that caller created record to delete
-    caller_id = ctx.author_id
-    record_id = skilllog[SkillDB.SkillLogTable.MEMBERID_COL] 
-    if record_id != caller_id:
-        record_name = ctx.guild.get_member(record_id).display_name
-        await ctx.send(f"You do not have permission to modify this record by {record_name}.")
-    else:
-        SkillDB.SkillLogTable.updateSkillLog(brisket_db, log_id, skill, lvl, date)
+    # Ownership is checked by the UPDATE itself
+    result = await ctx.bot.brisket_db.run(SkillDB.SkillLogTable.updateSkillLog, log_id, skill, lvl, date, member_id=ctx.author_id)
+    _checkMutation(ctx, result, f"Transaction #{log_id} does not exist.")
 
 
-@slash.subcommand(base="skilllvls",
+@subcommand(base="skilllvls",
     name="delete",
     description="Delete a trade skill level",
     base_default_permission=False,
@@ -402,26 +810,48 @@ async def _skill_edit(ctx:SlashContext, log_id:int, skill:int=None,lvl:int=None,
         )
     ]
 )
+@METRICS.timed
 @replydec
 async def _skill_delete(ctx:SlashContext, log_id:int):
-    # Check if record exists
-    try:
-        skilllog = brisket_db[SkillDB.SkillLogTable.TABLE_NAME].get(log_id)
-    except NotFoundError:
-        await ctx.send(f"Transaction #{log_id} does not exist.")
-        return
+    # Ownership is checked by the DELETE itself
+    result = await ctx.bot.brisket_db.run(SkillDB.SkillLogTable.deleteSkillLog, log_id, member_id=ctx.author_id)
+    _checkMutation(ctx, result, f"Transaction #{log_id} does not exist.")
 
-    # Check that caller created record to delete
-    caller_id = ctx.author_id
-    record_id = skilllog[SkillDB.SkillLogTable.MEMBERID_COL] 
-    if record_id != caller_id:
-        record_name = ctx.guild.get_member(record_id).display_name
-        await ctx.send(f"You do not have permission to modify this record by {record_name}.")
-        return
-    else:
-        SkillDB.SkillLogTable.deleteSkillLog(brisket_db, log_id)
+async def _skillView(brisket_db:AsyncBrisketDB, member_id:int, skill:int, lastn:int, best:bool, since:str, until:str) -> Tuple[List[str], List[tuple], List[dict]]:
+    """Columns, rows and page buttons of the skill view selected by the options of /skilllvls view
+    """
+    # Best levels over a date range are ranked from the log rather than the current-level tables
+    ranged = (since, until) != (MIN_DATE, MAX_DATE)
 
-@slash.subcommand(base="skilllvls",
+    # If no parameters passed, show last N entries
+    if member_id == None and skill == None:
+        return await _viewPage(brisket_db, 'skill.view.recent', (), lastn, since, until)
+    
+    # Else if both user and skill provided show last N entries of users entries for specified skill
+    elif member_id != None and skill != None:
+        return await _viewPage(brisket_db, 'skill.view.member_skill', (skill, member_id), lastn, since, until)
+    
+    ## If this point reached, then either member_id or skill is None, but not both ##
+
+    # Else if no user provided but skill provided, show last N entries for specified skill.
+    # If best specified, return lastn players with highest level in that skill
+    elif skill != None: 
+        if best and ranged:
+            return (*await brisket_db.namedTable('skill.view.skill_best.range', (skill, since, until, lastn)), None)
+        elif best:
+            return (*await brisket_db.namedTable('skill.view.skill_best', (skill, lastn)), None)
+        else:
+            return await _viewPage(brisket_db, 'skill.view.skill', (skill,), lastn, since, until)
+            
+    # Else if no skill provided but user provided, show user's most recent entry for each skill
+    # If best specified, return user's highest level in each skill
+    elif member_id != None:
+        if ranged:
+            return (*await brisket_db.namedTable('skill.view.member_best.range', (member_id, since, until)), None)
+        else:
+            return (*await brisket_db.namedTable('skill.view.member_best', (member_id,)), None)
+
+@subcommand(base="skilllvls",
     name="view",
     description="Display skill logs",
     base_default_permission=False,
@@ -438,7 +868,7 @@ async def _skill_delete(ctx:SlashContext, log_id:int):
             required=False
         ),
         create_option(name='lastn',
-            description="Display the last N skill logs",
+            description=f"Display the last N skill logs, at most {MAX_VIEW_ROWS}",
             required=False,
             option_type=SlashCommandOptionType.INTEGER
         ),
@@ -447,85 +877,33 @@ async def _skill_delete(ctx:SlashContext, log_id:int):
             required=False,
             option_type=SlashCommandOptionType.BOOLEAN
         )
-    ]
+    ] + view_date_options
 )
-async def _skill_show(ctx:SlashContext, user:Member=None, skill:int=None, lastn:int=5, best:bool=False):
+@METRICS.timed
+async def _skill_show(ctx:SlashContext, user:Member=None, skill:int=None, lastn:int=5, best:bool=False, since:str=None, until:str=None):
     member_id = None
+    lastn = min(lastn, MAX_VIEW_ROWS)
+    try:
+        since, until = _dateRange(since, until)
+    except ValueError as err:
+        await ctx.send(str(err) + '. Require date format YYYY-MM-DD.')
+        return
 
     # Get specified user and skill IDs
     if user != None:
         member_id = user.id
 
-    # If no parameters passed, show last N entries
-    if member_id == None and skill == None:
-        query_str = f"""SELECT * 
-            FROM {SkillDB.SkillLogTable.TABLE_NAME}
-            ORDER BY {SkillDB.SkillLogTable.DATE_COL} DESC
-            LIMIT {lastn}"""
-    
-    # Else if both user and skill provided show last N entries of users entries for specified skill
-    elif member_id != None and skill != None:
-        query_str = f"""SELECT *
-        FROM {SkillDB.SkillLogTable.TABLE_NAME}
-        WHERE {SkillDB.SkillLogTable.SKILLID_COL} = {skill} 
-            AND {SkillDB.SkillLogTable.MEMBERID_COL} = {member_id}
-        ORDER BY {SkillDB.SkillLogTable.DATE_COL} DESC
-        LIMIT {lastn}
-        """
-    
-    ## If this point reached, then either member_id or skill is None, but not both ##
-
-    # Else if no user provided but skill provided, show last N entries for specified skill.
-    # If best specified, return lastn players with highest level in that skill
-    elif skill != None: 
-        if best:
-            query_str = f"""SELECT t1.*
-                FROM {SkillDB.SkillLogTable.TABLE_NAME} t1
-                INNER JOIN (SELECT {SkillDB.SkillLogTable.MEMBERID_COL}, {SkillDB.SkillLogTable.SKILLID_COL}, MAX({SkillDB.SkillLogTable.LEVEL_COL}) max_lvl
-                    FROM {SkillDB.SkillLogTable.TABLE_NAME}
-                    GROUP BY {SkillDB.SkillLogTable.MEMBERID_COL}, {SkillDB.SkillLogTable.SKILLID_COL}
-                    HAVING {SkillDB.SkillLogTable.SKILLID_COL} = {skill}) t2
-                ON t1.{SkillDB.SkillLogTable.MEMBERID_COL} = t2.{SkillDB.SkillLogTable.MEMBERID_COL} 
-                AND t1.{SkillDB.SkillLogTable.LEVEL_COL} = t2.max_lvl
-                AND t1.{SkillDB.SkillLogTable.SKILLID_COL} = t2.{SkillDB.SkillLogTable.SKILLID_COL}
-                ORDER BY {SkillDB.SkillLogTable.LEVEL_COL} DESC
-                LIMIT {lastn}
-                """
-        else:
-            query_str = f"""SELECT *
-            FROM {SkillDB.SkillLogTable.TABLE_NAME}
-            WHERE {SkillDB.SkillLogTable.SKILLID_COL} = {skill}
-            ORDER BY {SkillDB.SkillLogTable.DATE_COL} ASC
-            LIMIT {lastn}
-            """
-            
-    # Else if no skill provided but user provided, show user's most recent entry for each skill
-    # If best specified, return user's highest level in each skill
-    elif member_id != None:
-        query_str = f"""SELECT t1.*
-                FROM {SkillDB.SkillLogTable.TABLE_NAME} t1
-                INNER JOIN (SELECT {SkillDB.SkillLogTable.MEMBERID_COL}, {SkillDB.SkillLogTable.SKILLID_COL}, MAX({SkillDB.SkillLogTable.LEVEL_COL}) max_lvl
-                    FROM {SkillDB.SkillLogTable.TABLE_NAME}
-                    GROUP BY {SkillDB.SkillLogTable.MEMBERID_COL}, {SkillDB.SkillLogTable.SKILLID_COL}
-                    HAVING {SkillDB.SkillLogTable.MEMBERID_COL} = {member_id}) t2
-                ON t1.{SkillDB.SkillLogTable.MEMBERID_COL} = t2.{SkillDB.SkillLogTable.MEMBERID_COL} 
-                AND t1.{SkillDB.SkillLogTable.LEVEL_COL} = t2.max_lvl
-                AND t1.{SkillDB.SkillLogTable.SKILLID_COL} = t2.{SkillDB.SkillLogTable.SKILLID_COL}
-                ORDER BY {SkillDB.SkillLogTable.LEVEL_COL} DESC
-                """
-
-    results = brisket_db.query(query_str)
-    table_str = bu.formatTable(bu.listDictToDictList(list(results)))
-    await ctx.send(table_str)
+    await _sendCachedView(ctx, _viewKey('skilllvls view', ctx.guild_id, member_id, skill, lastn, best, since, until), SKILL_VIEW_TABLES,
+        lambda: _skillView(ctx.bot.brisket_db, member_id, skill, lastn, best, since, until))
 #################################################################
         
 ## Weapon Table Slash Commands ##################################
 weapon_slash_choices = [create_choice(name=weap.name, value=weap.value) for weap in WeaponDB.Weapons]
-@slash.subcommand(base='weaponlog',
+@subcommand(base='weaponlog',
     name='add',
     description="Record weapon level",
     base_default_permission=False,
-    base_permissions=brisket_perms,
+    base_permissions=BRISKET_PERMS,
     options=[
         create_option(name="weapon",
             description="Choose a weapon",
@@ -545,21 +923,22 @@ weapon_slash_choices = [create_choice(name=weap.name, value=weap.value) for weap
         )
     ]
 )
+@METRICS.timed
 @replydec
 async def _weapon_add(ctx:SlashContext,weapon:int,lvl:int,date:str=None):
     if date != None:
         try:
             date = datetime.date.fromisoformat(date)
         except ValueError as err:
-            new_err = str(err) + '. Require date format YYYY-MM-DD.'
-            await ctx.send(new_err)
-            return
+            raise CommandRefused(str(err) + '. Require date format YYYY-MM-DD.') from err
 
     id = ctx.author_id
-    WeaponDB.WeaponLogTable.insertWeaponLog(brisket_db, member_id=id,weapon_id=weapon,lvl=lvl,date=date)
+    await ctx.bot.brisket_db.insertBatched(WeaponDB.WeaponLogTable.insertWeaponLogs,
+        WeaponDB.WeaponLogTable.buildWeaponLog(member_id=id,weapon_id=weapon,lvl=lvl,date=date,
+            idem_key=int(ctx.interaction_id)))
     
 
-@slash.subcommand(base='weaponlog',
+@subcommand(base='weaponlog',
     name='delete',
     description="Delete company bank donation",
     base_default_permission=False,
@@ -571,26 +950,14 @@ async def _weapon_add(ctx:SlashContext,weapon:int,lvl:int,date:str=None):
         )
     ]
 )
+@METRICS.timed
 @replydec
 async def _weapon_delete(ctx:SlashContext,logid:int):
-    # Check if record exists
-    try:
-        weapon_log = brisket_db[WeaponDB.WeaponLogTable.TABLE_NAME].get(logid)
-    except NotFoundError:
-        await ctx.send(f"Weapon Log #{logid} does not exist.")
-        return
+    # Ownership is checked by the DELETE itself
+    result = await ctx.bot.brisket_db.run(WeaponDB.WeaponLogTable.deleteWeaponLog, logid, member_id=ctx.author_id)
+    _checkMutation(ctx, result, f"Weapon Log #{logid} does not exist.")
 
-    # Check that caller created record to delete
-    caller_id = ctx.author_id
-    record_id = weapon_log[WeaponDB.WeaponLogTable.MEMBERID_COL] 
-    if record_id != caller_id:
-        record_name = ctx.guild.get_member(record_id).display_name
-        await ctx.send(f"You do not have permission to modify this record by {record_name}.")
-        return
-    else:
-        WeaponDB.WeaponLogTable.deleteWeaponLog(brisket_db, logid)
-
-@slash.subcommand(base='weaponlog',
+@subcommand(base='weaponlog',
     name='edit',
     description="Edit an existing record.",
     base_default_permission=False,
@@ -617,27 +984,57 @@ async def _weapon_delete(ctx:SlashContext,logid:int):
             option_type=SlashCommandOptionType.STRING
         )
     ])
+@METRICS.timed
 @replydec
 async def _weapon_edit(ctx: SlashContext, logid:int, weapon:int=None, lvl:int=None, date:str=None,):
-    # Check if record exists
-    try:
-        weapon_log = brisket_db[WeaponDB.WeaponLogTable.TABLE_NAME].get(logid)
-    except NotFoundError:
-        await ctx.send(f"Weapon Log #{logid} does not exist.")
-        return
+    # Dates are stored as ISO text; anything else is rejected before reaching the log
+    if date != None:
+        try:
+            date = datetime.date.fromisoformat(date)
+        except ValueError as err:
+            raise CommandRefused(str(err) + '. Require date format YYYY-MM-DD.') from err
+
+    # Ownership is checked by the UPDATE itself
+    result = await ctx.bot.brisket_db.run(WeaponDB.WeaponLogTable.updateWeaponLog, logid, weapon_id=weapon, lvl=lvl, date=date, member_id=ctx.author_id)
+    _checkMutation(ctx, result, f"Weapon Log #{logid} does not exist.")
+
+
+async def _weaponView(brisket_db:AsyncBrisketDB, member_id:int, weapon:int, lastn:int, best:bool, since:str, until:str) -> Tuple[List[str], List[tuple], List[dict]]:
+    """Columns, rows and page buttons of the weapon view selected by the options of /weaponlog view
+    """
+    # Best levels over a date range are ranked from the log rather than the current-level tables
+    ranged = (since, until) != (MIN_DATE, MAX_DATE)
+
+    # If no parameters passed, show last N entries
+    if member_id == None and weapon == None:
+        return await _viewPage(brisket_db, 'weapon.view.recent', (), lastn, since, until)
     
-    # Check that caller created record to delete
-    caller_id = ctx.author_id
-    record_id = weapon_log[WeaponDB.WeaponLogTable.MEMBERID_COL] 
-    if record_id != caller_id:
-        record_name = ctx.guild.get_member(record_id).display_name
-        await ctx.send(f"You do not have permission to modify this record by {record_name}.")
-        return
-    else:
-        WeaponDB.WeaponLogTable.updateWeaponLog(brisket_db, logid, weapon_id=weapon, lvl=lvl, date=date)
+    # Else if both user and skill provided show last N entries of users entries for specified skill
+    elif member_id != None and weapon != None:
+        return await _viewPage(brisket_db, 'weapon.view.member_weapon', (weapon, member_id), lastn, since, until)
+    
+    ## If this point reached, then either member_id or skill is None, but not both ##
 
+    # Else if no user provided but skill provided, show last N entries for specified skill.
+    # If best specified, return lastn players with highest level in that skill
+    elif weapon != None: 
+        if best and ranged:
+            return (*await brisket_db.namedTable('weapon.view.weapon_best.range', (weapon, since, until, lastn)), None)
+        elif best:
+            # Served from the in-memory leaderboard rather than aggregating the log
+            return (*await _leaderboardTable(brisket_db, brisket_db.weapon_leaderboard.top(weapon, lastn)), None)
+        else:
+            return await _viewPage(brisket_db, 'weapon.view.weapon', (weapon,), lastn, since, until)
+            
+    # Else if no skill provided but user provided, show user's most recent entry for each skill
+    # If best specified, return user's highest level in each skill
+    elif member_id != None:
+        if ranged:
+            return (*await brisket_db.namedTable('weapon.view.member_best.range', (member_id, since, until)), None)
+        else:
+            return (*await _leaderboardTable(brisket_db, brisket_db.weapon_leaderboard.memberBest(member_id)), None)
 
-@slash.subcommand(base="weaponlog",
+@subcommand(base="weaponlog",
     name="view",
     description="Display weapon logs",
     base_default_permission=False,
@@ -654,7 +1051,7 @@ async def _weapon_edit(ctx: SlashContext, logid:int, weapon:int=None, lvl:int=No
             required=False
         ),
         create_option(name='lastn',
-            description="Display the last N skill logs",
+            description=f"Display the last N skill logs, at most {MAX_VIEW_ROWS}",
             required=False,
             option_type=SlashCommandOptionType.INTEGER
         ),
@@ -663,78 +1060,70 @@ async def _weapon_edit(ctx: SlashContext, logid:int, weapon:int=None, lvl:int=No
             required=False,
             option_type=SlashCommandOptionType.BOOLEAN
         )
-    ]
+    ] + view_date_options
 )
-async def _weapon_show(ctx:SlashContext, user:Member=None, weapon:int=None, lastn:int=5, best:bool=False):
+@METRICS.timed
+async def _weapon_show(ctx:SlashContext, user:Member=None, weapon:int=None, lastn:int=5, best:bool=False, since:str=None, until:str=None):
     member_id = None
+    lastn = min(lastn, MAX_VIEW_ROWS)
+    try:
+        since, until = _dateRange(since, until)
+    except ValueError as err:
+        await ctx.send(str(err) + '. Require date format YYYY-MM-DD.')
+        return
     
     # Get specified user and skill IDs
     if user != None:
         member_id = user.id
 
-    # If no parameters passed, show last N entries
-    if member_id == None and weapon == None:
-        query_str = f"""SELECT * 
-            FROM {WeaponDB.WeaponLogTable.TABLE_NAME}
-            ORDER BY {WeaponDB.WeaponLogTable.DATE_COL} DESC
-            LIMIT {lastn}"""
-    
-    # Else if both user and skill provided show last N entries of users entries for specified skill
-    elif member_id != None and weapon != None:
-        query_str = f"""SELECT *
-        FROM {WeaponDB.WeaponLogTable.TABLE_NAME}
-        WHERE {WeaponDB.WeaponLogTable.WEAPONID_COL} = {weapon} 
-            AND {WeaponDB.WeaponLogTable.MEMBERID_COL} = {member_id}
-        ORDER BY {WeaponDB.WeaponLogTable.DATE_COL} DESC
-        LIMIT {lastn}
-        """
-    
-    ## If this point reached, then either member_id or skill is None, but not both ##
-
-    # Else if no user provided but skill provided, show last N entries for specified skill.
-    # If best specified, return lastn players with highest level in that skill
-    elif weapon != None: 
-        if best:
-            query_str = f"""SELECT t1.*
-                FROM {WeaponDB.WeaponLogTable.TABLE_NAME} t1
-                INNER JOIN (SELECT {WeaponDB.WeaponLogTable.MEMBERID_COL}, {WeaponDB.WeaponLogTable.WEAPONID_COL}, MAX({WeaponDB.WeaponLogTable.LEVEL_COL}) max_lvl
-                    FROM {WeaponDB.WeaponLogTable.TABLE_NAME}
-                    GROUP BY {WeaponDB.WeaponLogTable.MEMBERID_COL}, {WeaponDB.WeaponLogTable.WEAPONID_COL}
-                    HAVING {WeaponDB.WeaponLogTable.WEAPONID_COL} = {weapon}) t2
-                ON t1.{WeaponDB.WeaponLogTable.MEMBERID_COL} = t2.{WeaponDB.WeaponLogTable.MEMBERID_COL} 
-                AND t1.{WeaponDB.WeaponLogTable.LEVEL_COL} = t2.max_lvl
-                AND t1.{WeaponDB.WeaponLogTable.WEAPONID_COL} = t2.{WeaponDB.WeaponLogTable.WEAPONID_COL}
-                ORDER BY {WeaponDB.WeaponLogTable.LEVEL_COL} DESC
-                LIMIT {lastn}
-                """
-        else:
-            query_str = f"""SELECT *
-            FROM {WeaponDB.WeaponLogTable.TABLE_NAME}
-            WHERE {WeaponDB.WeaponLogTable.WEAPONID_COL} = {weapon}
-            ORDER BY {WeaponDB.WeaponLogTable.DATE_COL} ASC
-            LIMIT {lastn}
-            """
-            
-    # Else if no skill provided but user provided, show user's most recent entry for each skill
-    # If best specified, return user's highest level in each skill
-    elif member_id != None:
-        query_str = f"""SELECT t1.*
-                FROM {WeaponDB.WeaponLogTable.TABLE_NAME} t1
-                INNER JOIN (SELECT {WeaponDB.WeaponLogTable.MEMBERID_COL}, {WeaponDB.WeaponLogTable.WEAPONID_COL}, MAX({WeaponDB.WeaponLogTable.LEVEL_COL}) max_lvl
-                    FROM {WeaponDB.WeaponLogTable.TABLE_NAME}
-                    GROUP BY {WeaponDB.WeaponLogTable.MEMBERID_COL}, {WeaponDB.WeaponLogTable.WEAPONID_COL}
-                    HAVING {WeaponDB.WeaponLogTable.MEMBERID_COL} = {member_id}) t2
-                ON t1.{WeaponDB.WeaponLogTable.MEMBERID_COL} = t2.{WeaponDB.WeaponLogTable.MEMBERID_COL} 
-                AND t1.{WeaponDB.WeaponLogTable.LEVEL_COL} = t2.max_lvl
-                AND t1.{WeaponDB.WeaponLogTable.WEAPONID_COL} = t2.{WeaponDB.WeaponLogTable.WEAPONID_COL}
-                ORDER BY {WeaponDB.WeaponLogTable.LEVEL_COL} DESC
-                """
-
-    results = brisket_db.query(query_str)
-    table_str = bu.formatTable(bu.listDictToDictList(list(results)))
-    await ctx.send(table_str)
+    await _sendCachedView(ctx, _viewKey('weaponlog view', ctx.guild_id, member_id, weapon, lastn, best, since, until), WEAPON_VIEW_TABLES,
+        lambda: _weaponView(ctx.bot.brisket_db, member_id, weapon, lastn, best, since, until))
 #################################################################
 
 
-    
-bot.run(TOKEN)
\ No newline at end of file
+## Application ##################################################
+def create_app(config:BotConfig, startup:StartupReport=None) -> Tuple[BrisketBot, SlashCommand, AsyncBrisketDB]:
+    """Build a bot instance: its database, and a Discord client with every slash command registered.
+    Nothing connects to Discord until the bot is run, so handlers can be driven in process, e.g. against ':memory:'.
+
+    :param config: Settings of the instance
+    :type config: BotConfig
+    :param startup: Startup report completed once the bot is ready, defaults to None
+    :type startup: StartupReport, optional
+    :return: The bot, its slash command registry and its database
+    :rtype: Tuple[BrisketBot, SlashCommand, AsyncBrisketDB]
+    """
+    # All database work is run on AsyncBrisketDB's dedicated thread to keep the event loop responsive
+    slow_log = openSlowQueryLog(config.slow_query_log, config.slow_query_ms) if config.slow_query_log else None
+    brisket_db = AsyncBrisketDB(config.db_file, profile=PROFILES[config.db_profile], slow_log=slow_log)
+
+    intents = discord.Intents.default()
+    intents.members = True
+    bot = BrisketBot(config, brisket_db, startup, command_prefix=CMD_FLAG, intents=intents)
+    # Synced from on_ready through syncIfChanged rather than unconditionally by SlashCommand
+    slash = SlashCommand(bot, sync_commands=False)
+    registerCommands(slash, commandPermissions(config))
+
+    # Optional features, enabled through BRISKET_FEATURES
+    loadPlugins(bot, slash, report=startup)
+    return bot, slash, brisket_db
+
+def run(config:BotConfig=None):
+    """Run a bot until it is closed
+
+    :param config: Settings of the instance, defaults to configFromEnv()
+    :type config: BotConfig, optional
+    """
+    if config is None:
+        config = configFromEnv()
+
+    # The bot's own loggers report at INFO; everything else, discord.py included, only from WARNING
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+    logging.getLogger('brisket').setLevel(logging.INFO)
+
+    bot, _, _ = create_app(config, startup)
+    bot.run(config.token)
+
+
+if __name__ == "__main__":
+    run()
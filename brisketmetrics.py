@@ -0,0 +1,229 @@
+"""
+Per-command metrics: latency histograms, error counts and the database work done on each command's behalf.
+
+Handlers are wrapped with METRICS.timed, which times every invocation and counts the ones that raise.
+The command being served is carried in a context variable; AsyncBrisketDB runs its jobs inside a copy of the caller's
+context, so on the database threads the time of each job, and the statements and virtual machine steps reported
+by the sqlite3 trace and progress callbacks installed by instrument(), are charged to that command.
+A batch of coalesced inserts is charged to the command whose row started or filled the batch.
+
+This module only uses the standard library.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import math
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+log = logging.getLogger('brisket.metrics')
+
+# Number of SQLite virtual machine instructions between two calls of the progress handler
+PROGRESS_STEPS = 1000
+
+
+class Histogram():
+    """Latency histogram with geometrically growing buckets; quantiles are accurate to one bucket (<growth> - 1)
+
+    :param lowest: Upper bound of the first bucket in milliseconds, defaults to 0.1
+    :type lowest: float, optional
+    :param growth: Ratio between the bounds of consecutive buckets, defaults to 1.25
+    :type growth: float, optional
+    :param buckets: Number of buckets; larger values land in the last one, defaults to 64
+    :type buckets: int, optional
+    """
+
+    def __init__(self, lowest:float=0.1, growth:float=1.25, buckets:int=64):
+        self.lowest = lowest
+        self.growth = growth
+        self.counts = [0] * buckets
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._log_growth = math.log(growth)
+
+    def record(self, ms:float):
+        if ms <= self.lowest:
+            idx = 0
+        else:
+            idx = min(math.ceil(math.log(ms / self.lowest) / self._log_growth), len(self.counts) - 1)
+        self.counts[idx] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def quantile(self, q:float) -> float:
+        """Upper bound of the bucket holding the <q> quantile, in milliseconds; 0 when empty
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.lowest * self.growth ** idx, self.max_ms)
+        return self.max_ms
+
+
+class CommandStats():
+    """Counters of one command. Updated from the event loop and the database threads under the owning Metrics' lock
+    """
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.db_s = 0.0
+        self.db_jobs = 0
+        self.statements = 0
+        self.vm_steps = 0
+
+
+# Stats of the command being served in the current context, None outside of a timed handler
+_current = contextvars.ContextVar('brisket_command', default=None)
+
+
+class Metrics():
+    """Per-command statistics of the timed handlers
+    """
+
+    def __init__(self):
+        self._commands : Dict[str, CommandStats] = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def command(self, name:str) -> CommandStats:
+        with self._lock:
+            stats = self._commands.get(name)
+            if stats is None:
+                stats = self._commands[name] = CommandStats()
+            return stats
+
+    def timed(self, func:Callable) -> Callable:
+        """Decorator recording the latency and errors of an async command handler taking the context first.
+        Slash commands are named after the invoked command, e.g. 'bank add'; component callbacks after their custom_id prefix.
+        """
+        @functools.wraps(func)
+        async def wrapper(ctx, *args, **kwargs):
+            stats = self.command(commandName(ctx))
+            token = _current.set(stats)
+            start = time.perf_counter()
+            try:
+                return await func(ctx, *args, **kwargs)
+            except BaseException:
+                with self._lock:
+                    stats.errors += 1
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                _current.reset(token)
+                with self._lock:
+                    stats.latency.record(1000 * elapsed)
+
+        return wrapper
+
+    def chargeDB(self, func:Callable, *args, **kwargs):
+        """Call func(*args, **kwargs) and charge its duration to the command being served, if any.
+        Meant to run on a database thread inside the context copied from the caller.
+        """
+        stats = _current.get()
+        if stats is None:
+            return func(*args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stats.db_s += elapsed
+                stats.db_jobs += 1
+
+    def instrument(self, conn:sqlite3.Connection):
+        """Count the statements and virtual machine steps <conn> runs for each command.
+        Must be called on the thread owning <conn>.
+        """
+        conn.set_trace_callback(self._traced)
+        conn.set_progress_handler(self._progressed, PROGRESS_STEPS)
+
+    def _traced(self, statement:str):
+        stats = _current.get()
+        if stats is not None:
+            with self._lock:
+                stats.statements += 1
+
+    def _progressed(self) -> int:
+        stats = _current.get()
+        if stats is not None:
+            with self._lock:
+                stats.vm_steps += PROGRESS_STEPS
+        # Any other return value interrupts the running statement
+        return 0
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Summary of every command called at least once, times in milliseconds
+        """
+        with self._lock:
+            return {name : {
+                    'calls' : s.latency.count,
+                    'errors' : s.errors,
+                    'p50_ms' : s.latency.quantile(0.50),
+                    'p95_ms' : s.latency.quantile(0.95),
+                    'p99_ms' : s.latency.quantile(0.99),
+                    'max_ms' : s.latency.max_ms,
+                    'db_ms' : 1000 * s.db_s / s.latency.count,
+                    'statements' : s.statements / s.latency.count,
+                    'vm_steps' : s.vm_steps / s.latency.count
+                } for name, s in sorted(self._commands.items()) if s.latency.count}
+
+    # Columns of table(); DB ms, SQL and VM steps are per call
+    TABLE_COLUMNS = ['Command', 'Calls', 'Errors', 'p50 ms', 'p95 ms', 'p99 ms', 'DB ms', 'SQL', 'VM steps']
+
+    def table(self) -> Tuple[List[str], List[tuple]]:
+        """snapshot() laid out as columns and rows, for brisketutils.renderTable
+        """
+        return self.TABLE_COLUMNS, [(name, s['calls'], s['errors'], f"{s['p50_ms']:.1f}", f"{s['p95_ms']:.1f}",
+            f"{s['p99_ms']:.1f}", f"{s['db_ms']:.1f}", f"{s['statements']:.1f}", f"{s['vm_steps']:.0f}")
+            for name, s in self.snapshot().items()]
+
+    def logLine(self) -> str:
+        """One-line summary of every command since startup
+        """
+        parts = [f"{name} n={s['calls']} err={s['errors']} p50={s['p50_ms']:.1f}ms p95={s['p95_ms']:.1f}ms "
+            f"p99={s['p99_ms']:.1f}ms db={s['db_ms']:.1f}ms" for name, s in self.snapshot().items()]
+        return f"command metrics over {time.time() - self.started:.0f}s: " + ('; '.join(parts) if parts else "no commands")
+
+    async def logPeriodically(self, interval:float):
+        """Log logLine() at INFO level every <interval> seconds, until cancelled
+        """
+        while True:
+            await asyncio.sleep(interval)
+            log.info(self.logLine())
+
+
+def commandName(ctx) -> str:
+    """Metrics name of the command served by <ctx>
+    """
+    custom_id = getattr(ctx, 'custom_id', None)
+    if custom_id is not None:
+        return custom_id.split('|', 1)[0]
+    return ' '.join(p for p in (ctx.name, ctx.subcommand_group, ctx.subcommand_name) if p)
+
+
+METRICS = Metrics()
+
+
+if __name__ == "__main__":
+    import random
+
+    hist = Histogram()
+    samples = sorted(random.lognormvariate(1, 1) for _ in range(10000))
+    for ms in samples:
+        hist.record(ms)
+    for q in (0.50, 0.95, 0.99):
+        exact = samples[math.ceil(q * len(samples)) - 1]
+        print(f"p{int(100 * q)}: exact {exact:.2f} ms, histogram {hist.quantile(q):.2f} ms")
@@ -0,0 +1,132 @@
+"""
+Startup helpers: lazy imports for heavy optional dependencies, feature-gated plugin loading,
+and a report of where startup time went (per-module import cost and time to on_ready).
+
+This module must stay cheap to import; it only uses the standard library.
+"""
+import builtins
+import importlib
+import importlib.util
+import os
+import sys
+import time
+from typing import Dict, List
+
+
+class _MissingModule():
+    """Stands in for an optional dependency that is not installed; fails only when actually used
+    """
+
+    def __init__(self, name:str):
+        self._name = name
+
+    def __getattr__(self, attr):
+        raise ImportError(f"Optional dependency '{self._name}' is not installed")
+
+
+class _LazyModule():
+    """Proxy importing the real module on first attribute access
+    """
+
+    def __init__(self, name:str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+def lazyImport(name:str):
+    """Return a stand-in for module <name> that imports it on first attribute access,
+    so optional dependencies cost nothing until a command actually uses them.
+
+    :param name: Absolute module name, e.g. 'matplotlib.pyplot'
+    :type name: str
+    :return: The module if already imported, otherwise a lazy proxy, or a placeholder raising ImportError on use if it is not installed
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    # Only the top-level package is located; finding a submodule would execute its parent package
+    if importlib.util.find_spec(name.partition('.')[0]) is None:
+        return _MissingModule(name)
+    return _LazyModule(name)
+
+
+# Optional features: name -> module providing ``setup(bot, slash)``.
+# Each is imported, together with whatever heavy dependencies it needs, only when listed in BRISKET_FEATURES.
+PLUGINS : Dict[str, str] = {}
+
+def enabledFeatures() -> List[str]:
+    """Feature names listed in the comma-separated BRISKET_FEATURES environment variable
+    """
+    return [f.strip() for f in os.getenv('BRISKET_FEATURES', '').split(',') if f.strip()]
+
+def loadPlugins(bot, slash, features:List[str]=None, report:"StartupReport"=None) -> List[str]:
+    """Import and set up the plugin module of each enabled feature
+
+    :param bot: Bot the plugins register events on
+    :param slash: SlashCommand the plugins register commands on
+    :param features: Features to load, defaults to enabledFeatures()
+    :type features: List[str], optional
+    :param report: Startup report recording each plugin's load time, defaults to None
+    :type report: StartupReport, optional
+    :raises KeyError: If a feature has no registered plugin
+    :return: Names of the loaded features
+    :rtype: List[str]
+    """
+    if features is None:
+        features = enabledFeatures()
+
+    for feature in features:
+        start = time.perf_counter()
+        importlib.import_module(PLUGINS[feature]).setup(bot, slash)
+        if report is not None:
+            report.mark(f"plugin {feature}", time.perf_counter() - start)
+    return features
+
+
+class StartupReport():
+    """Records how long startup takes and which imports it was spent on.
+    Create it before any other import; it timestamps process start and wraps ``__import__``
+    to time every module imported for the first time until stop() is called.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.import_times = {}
+        self.marks = []
+        self._import = builtins.__import__
+        builtins.__import__ = self._timedImport
+
+    def _timedImport(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level != 0 or name in sys.modules:
+            return self._import(name, globals, locals, fromlist, level)
+
+        start = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            # Inclusive of the module's own imports
+            self.import_times.setdefault(name, time.perf_counter() - start)
+
+    def mark(self, label:str, duration:float=None):
+        """Record a milestone (time since start) or, if <duration> is given, a timed step
+        """
+        self.marks.append((label, duration if duration is not None else time.perf_counter() - self.start))
+
+    def stop(self):
+        """Stop timing imports
+        """
+        if builtins.__import__ == self._timedImport:
+            builtins.__import__ = self._import
+
+    def report(self, top:int=10) -> str:
+        """Milestones followed by the <top> most expensive top-level imports, in milliseconds
+        """
+        lines = [f"{label}: {1000 * t:.1f} ms" for label, t in self.marks]
+        top_level = sorted(((t, name) for name, t in self.import_times.items() if '.' not in name), reverse=True)
+        lines += [f"  import {name}: {1000 * t:.1f} ms" for t, name in top_level[:top]]
+        return '\n'.join(lines)
@@ -0,0 +1,78 @@
+"""
+Slash command sync that only talks to Discord when the command definitions changed.
+
+discord_slash's own sync fetches every scope's commands and permissions on each start, and pushes them whenever they differ.
+Instead the full payload it would send, option choices built from SkillDB.Skills and WeaponDB.Weapons and permissions
+included, is hashed together with the application and debug guild it targets. The hash of the last successful sync is
+kept in a local file, and a start with the same hash skips the sync entirely. Delete the file to force a sync,
+e.g. after editing the commands from the Discord developer portal.
+
+This module only uses the standard library.
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import Optional
+
+log = logging.getLogger('brisket.sync')
+
+
+async def commandHash(slash) -> str:
+    """SHA-256 of every command registered on <slash>, as sent to Discord, and of where they are sent.
+    Waits until the client is ready, like SlashCommand.to_dict.
+
+    :param slash: Slash command registry
+    :type slash: SlashCommand
+    :return: Hex digest
+    :rtype: str
+    """
+    payload = {
+        'application_id' : slash.req.application_id,
+        'debug_guild' : slash.debug_guild,
+        'commands' : await slash.to_dict()
+    }
+    # Key order is irrelevant to Discord; list order (commands, options, choices) is kept as registered
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def readHash(path:str) -> Optional[str]:
+    """Hash recorded in <path>, None if it does not exist yet
+    """
+    try:
+        with open(path) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def writeHash(path:str, digest:str):
+    """Record <digest> in <path>, replacing the file atomically so an interrupted write never leaves a partial hash
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(digest + '\n')
+    os.replace(tmp, path)
+
+
+async def syncIfChanged(slash, path:str) -> bool:
+    """Sync the commands of <slash> with Discord unless their hash matches the one recorded in <path> by the last sync.
+    The hash is only recorded once the sync succeeded, so a failed sync is retried on the next start.
+
+    :param slash: Slash command registry, created with sync_commands=False
+    :type slash: SlashCommand
+    :param path: File holding the hash of the last synced definitions
+    :type path: str
+    :return: Whether a sync was made
+    :rtype: bool
+    """
+    digest = await commandHash(slash)
+    if readHash(path) == digest:
+        log.info("Slash commands unchanged since the last sync (%s), skipping it", digest[:12])
+        return False
+
+    log.info("Slash command definitions changed (%s), syncing", digest[:12])
+    await slash.sync_all_commands()
+    writeHash(path, digest)
+    return True
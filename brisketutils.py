@@ -1,31 +1,326 @@
+import datetime
+import logging
 import sqlite_utils
-from discord_slash import SlashContext
-from typing import List
-import matplotlib as plt
-from sqlite_utils.db import NotFoundError, Table
-
-def checkRecordPermission(table:sqlite_utils.db.Table, column:str, pk_kwarg:str):
-    """When altering records, the ID of the user requesting alteration must match ID in record being altered.
-
-    :param fcn: [description]
-    :type fcn: [type]
-    :param ctxt: [description]
-    :type ctxt: SlashContext
-    :param id: [description]
-    :type id: int
-    :param table: [description]
-    :type table: sqlite_utils.db.Table
-    :param col: [description]
-    :type col: str
-    """
-    def decorator(func):
-        def inner(*args, **kwargs):
-            pk = kwargs[pk_kwarg]
-            try:
-                row = table.get(pk)
-            except NotFoundError:
-                print()
-    table.get(id)
+import threading
+from collections import OrderedDict
+from enum import IntEnum
+from typing import Awaitable, Callable, Hashable, Iterable, List, Optional, Sequence, Tuple
+from sqlite_utils.db import Table
+from brisketstartup import lazyImport
+
+# Optional plotting dependency; only loaded once something draws with it
+plt = lazyImport('matplotlib.pyplot')
+
+log = logging.getLogger('brisket.db')
+
+class MutationResult(IntEnum):
+    """Outcome of an ownership-guarded update or delete
+    """
+    DONE = 0
+    NOT_FOUND = 1
+    NOT_OWNER = 2
+
+def guardedUpdate(db:sqlite_utils.Database, table_name:str, pk_col:str, pk:int, values:dict,
+                  owner_col:str=None, owner_id:int=None) -> Tuple[MutationResult, Optional[int]]:
+    """Update the row <pk> of <table_name> in one statement, only if its <owner_col> equals <owner_id>.
+       The row is looked up separately only when nothing was updated, to tell a missing row from someone else's.
+       Does not commit.
+
+    :param db: Database containing the table
+    :type db: sqlite_utils.Database
+    :param table_name: Table to update
+    :type table_name: str
+    :param pk_col: Primary key column
+    :type pk_col: str
+    :param pk: Primary key of the row to update
+    :type pk: int
+    :param values: Column -> new value; if empty the ownership check alone is performed
+    :type values: dict
+    :param owner_col: Column holding the owner's ID, defaults to None
+    :type owner_col: str, optional
+    :param owner_id: Required owner, defaults to None for no ownership check
+    :type owner_id: int, optional
+    :return: The outcome, and the row's actual owner when the outcome is NOT_OWNER
+    :rtype: Tuple[MutationResult, Optional[int]]
+    """
+    if not values:
+        return _classifyUnchanged(db, table_name, pk_col, pk, owner_col, owner_id)
+
+    where, params = _guardClause(pk_col, pk, owner_col, owner_id)
+    assignments = ', '.join(f'[{c}] = ?' for c in values)
+    cursor = db.execute(f"UPDATE [{table_name}] SET {assignments} WHERE {where}", list(values.values()) + params)
+    if cursor.rowcount:
+        TABLE_VERSIONS.bump(table_name)
+        return MutationResult.DONE, None
+    return _classifyUnchanged(db, table_name, pk_col, pk, owner_col, owner_id)
+
+def guardedDelete(db:sqlite_utils.Database, table_name:str, pk_col:str, pk:int,
+                  owner_col:str=None, owner_id:int=None) -> Tuple[MutationResult, Optional[int]]:
+    """Delete the row <pk> of <table_name> in one statement, only if its <owner_col> equals <owner_id>.
+       Does not commit; see guardedUpdate.
+
+    :return: The outcome, and the row's actual owner when the outcome is NOT_OWNER
+    :rtype: Tuple[MutationResult, Optional[int]]
+    """
+    where, params = _guardClause(pk_col, pk, owner_col, owner_id)
+    cursor = db.execute(f"DELETE FROM [{table_name}] WHERE {where}", params)
+    if cursor.rowcount:
+        TABLE_VERSIONS.bump(table_name)
+        return MutationResult.DONE, None
+    return _classifyUnchanged(db, table_name, pk_col, pk, owner_col, owner_id)
+
+def _guardClause(pk_col:str, pk:int, owner_col:str, owner_id:int) -> Tuple[str, list]:
+    if owner_id is None:
+        return f"[{pk_col}] = ?", [pk]
+    return f"[{pk_col}] = ? AND [{owner_col}] = ?", [pk, owner_id]
+
+def _classifyUnchanged(db, table_name, pk_col, pk, owner_col, owner_id) -> Tuple[MutationResult, Optional[int]]:
+    # Outcome of a guarded statement that changed nothing, either because it failed or because it had nothing to change
+    row = db.execute(f"SELECT [{owner_col or pk_col}] FROM [{table_name}] WHERE [{pk_col}] = ?", [pk]).fetchone()
+    if row is None:
+        return MutationResult.NOT_FOUND, None
+    if owner_id is None or row[0] == owner_id:
+        return MutationResult.DONE, None
+    return MutationResult.NOT_OWNER, row[0]
+
+def insertRecords(db:sqlite_utils.Database, table_name:str, records:List[dict], idem_col:str=None) -> List[Optional[int]]:
+    """Insert rows into <table_name> with a single executemany and return their new rowids in insertion order.
+       Does not commit; callers are expected to wrap the call in a transaction (e.g. ``with db.conn:``).
+
+    :param db: Database to insert into
+    :type db: sqlite_utils.Database
+    :param table_name: Name of the table receiving the rows
+    :type table_name: str
+    :param records: Rows to insert. All dictionaries must have the same keys.
+    :type records: List[dict]
+    :param idem_col: Uniquely indexed idempotency key column, defaults to None.
+                     If given, a row whose key is already taken is skipped by the insert statement itself.
+    :type idem_col: str, optional
+    :return: rowid of each inserted row, or None for a row skipped as a duplicate
+    :rtype: List[Optional[int]]
+    """
+    if not records:
+        return []
+
+    cols = list(records[0].keys())
+    insert_sql = "INSERT INTO [{}] ({}) VALUES ({})".format(
+        table_name, ', '.join(f'[{c}]' for c in cols), ', '.join('?' for _ in cols))
+    if idem_col is not None:
+        insert_sql += f" ON CONFLICT ([{idem_col}]) DO NOTHING"
+    key_col = idem_col if idem_col in cols else None
+
+    # New rowids are allocated above the current maximum, so rows past it are exactly the ones inserted here
+    last_rowid = db.execute(f"SELECT MAX(rowid) FROM [{table_name}]").fetchone()[0]
+    db.conn.executemany(insert_sql, [[r[c] for c in cols] for r in records])
+    key_sql = f"[{key_col}]" if key_col is not None else "NULL"
+    new_rows = db.execute(f"SELECT rowid, {key_sql} FROM [{table_name}] WHERE rowid > ? ORDER BY rowid",
+        [last_rowid if last_rowid is not None else -1]).fetchall()
+    if new_rows:
+        TABLE_VERSIONS.bump(table_name)
+
+    # Inserted rows keep the order of <records>; a record was skipped if the next new row does not carry its key
+    row_ids = []
+    new_idx = 0
+    for r in records:
+        key = r[key_col] if key_col is not None else None
+        if new_idx < len(new_rows) and new_rows[new_idx][1] == key:
+            row_ids.append(new_rows[new_idx][0])
+            new_idx += 1
+        else:
+            row_ids.append(None)
+    return row_ids
+
+def addIdempotencyKey(db:sqlite_utils.Database, table_name:str, column:str, index_name:str):
+    """Add a nullable idempotency key column to <table_name> under a unique index.
+       Rows without a key are not constrained. Does not commit.
+    """
+    db.execute(f"ALTER TABLE [{table_name}] ADD COLUMN [{column}] INTEGER")
+    db.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS [{index_name}] ON [{table_name}] ([{column}])")
+
+class LRUCache():
+    """Bounded mapping which evicts its least recently used entry once <maxsize> entries are held
+
+    :param maxsize: Maximum number of entries, defaults to 256
+    :type maxsize: int, optional
+    """
+
+    def __init__(self, maxsize:int=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key:Hashable, loader:Callable):
+        """Value cached for <key>, calling <loader>(key) on a miss.
+        A loader result of None is returned but not cached.
+        """
+        if key in self._data:
+            return self.peek(key)
+
+        value = loader(key)
+        if value is not None:
+            self.put(key, value)
+        return value
+
+    def peek(self, key:Hashable):
+        """Value cached for <key>, marked as most recently used; None on a miss
+        """
+        if key not in self._data:
+            return None
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key:Hashable, value):
+        """Cache <value> for <key>, evicting the least recently used entry if the cache is full
+        """
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+class TableVersions():
+    """Write counter of each table, for invalidating results derived from it.
+
+    Writers call bump() as they change a table, before their transaction commits, so a reader may still see the old
+    rows under the new version. The writing thread therefore calls flush() once the transaction is over, bumping the
+    same tables again: a result read in between is tagged with a version that is already stale.
+    Versions are process-wide, so a write to one database also invalidates results derived from another; that only
+    costs a recomputation.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def bump(self, table_name:str):
+        """Record a write to <table_name> by the calling thread
+        """
+        with self._lock:
+            self._versions[table_name] = self._versions.get(table_name, 0) + 1
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = set()
+        pending.add(table_name)
+
+    def flush(self):
+        """Bump again every table the calling thread wrote since its last flush. Call once its writes are committed.
+        """
+        pending = getattr(self._local, 'pending', None)
+        if not pending:
+            return
+        self._local.pending = set()
+        with self._lock:
+            for table_name in pending:
+                self._versions[table_name] += 1
+
+    def get(self, table_names:Iterable[str]) -> Tuple[int, ...]:
+        """Current versions of <table_names>, in order
+        """
+        with self._lock:
+            return tuple(self._versions.get(t, 0) for t in table_names)
+
+# Bumped by every insert, update and delete helper, see TableVersions
+TABLE_VERSIONS = TableVersions()
+
+class ResponseCache():
+    """LRUCache of results derived from database tables, only serving an entry while none of the tables it was derived
+    from has been written since. Meant to be used from the event loop only.
+
+    :param maxsize: Maximum number of entries, defaults to 256
+    :type maxsize: int, optional
+    :param versions: Table write counters, defaults to TABLE_VERSIONS
+    :type versions: TableVersions, optional
+    """
+
+    def __init__(self, maxsize:int=256, versions:TableVersions=None):
+        self.versions = versions if versions is not None else TABLE_VERSIONS
+        self.hits = 0
+        self.misses = 0
+        # key -> (versions of the source tables when loaded, value)
+        self._entries = LRUCache(maxsize)
+
+    @property
+    def maxsize(self) -> int:
+        return self._entries.maxsize
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, key:Hashable, table_names:Tuple[str, ...], loader:Callable[[], Awaitable]):
+        """Value cached for <key>, awaiting loader() on a miss or once any of <table_names> has been written
+
+        :param key: Cache key, e.g. the command and its normalized options
+        :type key: Hashable
+        :param table_names: Tables the value is derived from
+        :type table_names: Tuple[str, ...]
+        :param loader: Coroutine function computing the value
+        :type loader: Callable[[], Awaitable]
+        """
+        # Read before loading, so a write landing while the loader runs leaves the entry already stale
+        versions = self.versions.get(table_names)
+        entry = self._entries.peek(key)
+        if entry is not None and entry[0] == versions:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        value = await loader()
+        self._entries.put(key, (versions, value))
+        return value
+
+def parseDate(value) -> Optional[datetime.date]:
+    """Leniently parse a logged date: 'Y-M-D' with or without zero padding, optionally followed by a time
+    after a space or 'T'. None if <value> is not such a date.
+    """
+    if isinstance(value, datetime.date):
+        return value if not isinstance(value, datetime.datetime) else value.date()
+    if not isinstance(value, str):
+        return None
+    parts = value.strip().split(' ')[0].split('T')[0].split('-')
+    if len(parts) != 3:
+        return None
+    try:
+        return datetime.date(int(parts[0]), int(parts[1]), int(parts[2]))
+    except ValueError:
+        return None
+
+def normalizeDates(db:sqlite_utils.Database, table_name:str, column:str) -> int:
+    """Rewrite the values of a date column to ISO 'YYYY-MM-DD' text, so they sort and compare chronologically.
+       Values are parsed with parseDate, so unpadded dates such as '2021-3-5' are fixed too.
+       Values that still cannot be read as a date are left as they are and logged. Does not commit.
+
+    :return: Number of rows rewritten
+    :rtype: int
+    """
+    rewrites = []
+    unparsed = []
+    for rowid, value in db.execute(f"SELECT rowid, [{column}] FROM [{table_name}] WHERE [{column}] IS NOT NULL"):
+        date = parseDate(value)
+        if date is None:
+            unparsed.append((rowid, value))
+        elif date.isoformat() != value:
+            rewrites.append((date.isoformat(), rowid))
+
+    db.conn.executemany(f"UPDATE [{table_name}] SET [{column}] = ? WHERE rowid = ?", rewrites)
+    if unparsed:
+        log.warning("%s.%s: %d value(s) are not dates and were left as they are, e.g. rowid %s: %r",
+            table_name, column, len(unparsed), *unparsed[0])
+    return len(rewrites)
+
+def replaceIndexes(db:sqlite_utils.Database, table_name:str, indexes:dict, replaced:List[str]):
+    """Drop the indexes named in <replaced> and create <indexes> on <table_name>. Does not commit.
+
+    :param indexes: Index name -> indexed columns, in order
+    :type indexes: dict
+    :param replaced: Names of indexes superseded by <indexes>
+    :type replaced: List[str]
+    """
+    for name in replaced:
+        db.execute(f"DROP INDEX IF EXISTS [{name}]")
+    for name, cols in indexes.items():
+        db.execute(f"CREATE INDEX IF NOT EXISTS [{name}] ON [{table_name}] ({', '.join(f'[{c}]' for c in cols)})")
 
 def listDictToDictList(listdict:List[dict]):
     """Converts a list of dictionaries to a dictionary of lists.
@@ -52,22 +347,89 @@ def dictListToListDict(dictlist:dict):
     """
     return [dict(zip(dictlist,t)) for t in zip(*dictlist.values())]
 
+# Discord rejects messages longer than this many characters
+DISCORD_MSG_LIMIT = 2000
+# Longer cells (e.g. bank notes) are cut by renderTable, so one long value does not widen every line of the table
+MAX_CELL_WIDTH = 32
+_FENCE = "```"
+_ELLIPSIS = "…"
+
+def _cell(value, max_width:int=None) -> str:
+    text = str(value)
+    if max_width is not None and len(text) > max_width:
+        return text[:max_width - 1] + _ELLIPSIS
+    return text
+
+def tableLines(columns:Sequence[str], rows:Iterable[Sequence], max_width:int=None) -> List[str]:
+    """Lay out a table as text lines, each column as wide as its widest cell.
+    The first two lines are the header and its underline.
+
+    :param columns: Column names
+    :type columns: Sequence[str]
+    :param rows: Row tuples (e.g. straight from a cursor), one value per column
+    :type rows: Iterable[Sequence]
+    :param max_width: Cells longer than this are truncated with an ellipsis, defaults to None (no limit)
+    :type max_width: int, optional
+    :rtype: List[str]
+    """
+    cells = [[_cell(v, max_width) for v in row] for row in rows]
+    widths = [len(str(c)) for c in columns]
+    for row in cells:
+        for i, cell in enumerate(row):
+            if len(cell) > widths[i]:
+                widths[i] = len(cell)
+
+    def line(values):
+        return '|' + '|'.join(v.center(w) for v, w in zip(values, widths)) + '|'
+
+    header = line([str(c) for c in columns])
+    return [header, '-' * len(header)] + [line(row) for row in cells]
+
+def renderTable(columns:Sequence[str], rows:Iterable[Sequence], limit:int=DISCORD_MSG_LIMIT,
+                max_width:int=MAX_CELL_WIDTH) -> List[str]:
+    """Render a table as code-block messages of at most <limit> characters each.
+    Pages break on row boundaries and each repeats the header; lines too wide to leave room for a row are truncated.
+
+    :param columns: Column names
+    :type columns: Sequence[str]
+    :param rows: Row tuples, one value per column
+    :type rows: Iterable[Sequence]
+    :param limit: Maximum length of a page, defaults to DISCORD_MSG_LIMIT
+    :type limit: int, optional
+    :param max_width: Cells longer than this are truncated with an ellipsis, defaults to MAX_CELL_WIDTH
+    :type max_width: int, optional
+    :return: Pages in order; a table without rows renders as its header alone
+    :rtype: List[str]
+    """
+    # Lines are capped so that a page always fits the header, its underline and at least one row
+    width = (limit - 2 * len(_FENCE) - 4) // 3
+    if width < 1:
+        raise ValueError(f"Page limit {limit} is too small for a table")
+    header, underline, *body = (l[:width] for l in tableLines(columns, rows, max_width))
+
+    opening = f"{_FENCE}\n{header}\n{underline}\n"
+    room = limit - len(opening) - len(_FENCE)
+
+    pages = []
+    page, used = [], 0
+    for line in body:
+        if page and used + len(line) + 1 > room:
+            pages.append(opening + ''.join(page) + _FENCE)
+            page, used = [], 0
+        page.append(line + '\n')
+        used += len(line) + 1
+    pages.append(opening + ''.join(page) + _FENCE)
+    return pages
+
 def formatTable(dictlist:dict)->str:
     """Provided a dictionary of lists, format contents into a printable table string
 
-    :param dictlist: [description]
+    :param dictlist: Column name -> column values
     :type dictlist: dict
-    :return: [description]
+    :return: Table text, one line per row
     :rtype: str
     """
-    header_str = '|'.join(k.center(10) for k in dictlist.keys())
-    header_str = '|'+header_str + '|\n'
-    header_str = header_str + len(header_str)*'-'+'\n'
-    for row in zip(*dictlist.values()):
-        for s in row:
-            header_str = header_str + '|' + str(s).center(10)
-        header_str = header_str + '|\n'
-    return header_str
+    return '\n'.join(tableLines(list(dictlist.keys()), zip(*dictlist.values()))) + '\n'
 
 def printTable(table:Table):
     for r in table.rows:
@@ -0,0 +1,66 @@
+"""
+The bank ledger and monthly rollup are kept current by triggers on the bank log; after any mix of inserts, updates
+and deletes, including undated rows left over from legacy databases, both must reconcile with the log.
+"""
+import datetime
+
+import pytest
+
+from BankDB import BankLedger, BankRollup, BankTable
+from BrisketDB import BrisketDB
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = BrisketDB(str(tmp_path / 'brisket.db'))
+    yield db
+    db.conn.close()
+
+
+def insertUndated(db, member_id:int, amount:float) -> int:
+    # Legacy rows could be logged without a date; the bot itself always sets one
+    with db.conn:
+        return db[BankTable.TABLE_NAME].insert({BankTable.MEMBERID_COL : member_id, BankTable.AMNT_COL : amount,
+            BankTable.DATE_COL : None}).last_pk
+
+
+def assertConsistent(db):
+    assert BankLedger.reconcile(db) == []
+    assert BankRollup.reconcile(db) == []
+
+
+def test_triggers_follow_inserts_updates_and_deletes(db):
+    march = datetime.date(2021, 3, 5)
+    ids = [BankTable.insertBankLog(db, 1, 100.25, march), BankTable.insertBankLog(db, 1, 50, march),
+        BankTable.insertBankLog(db, 2, 12.5, datetime.date(2021, 4, 1)), BankTable.insertBankLog(db, None, 1000)]
+    assertConsistent(db)
+
+    BankTable.updateBankLog(db, ids[0], amount=80)
+    BankTable.updateBankLog(db, ids[1], date=datetime.date(2021, 5, 30))
+    assertConsistent(db)
+
+    for xact_id in ids:
+        BankTable.deleteBankLog(db, xact_id)
+    assertConsistent(db)
+    assert db[BankRollup.TABLE_NAME].count == 0
+
+
+def test_undated_rows_are_left_out_of_the_rollup(db):
+    ids = [insertUndated(db, 2, 5), insertUndated(db, 2, 7)]
+    assertConsistent(db)
+    assert db[BankRollup.TABLE_NAME].count == 0
+
+    # Dating a row brings it into the rollup, and deleting it takes it out again
+    BankTable.updateBankLog(db, ids[0], date=datetime.date(2021, 6, 1))
+    assertConsistent(db)
+    for xact_id in ids:
+        BankTable.deleteBankLog(db, xact_id)
+    assertConsistent(db)
+    assert db[BankRollup.TABLE_NAME].count == 0
+
+
+def test_rebuilt_rollup_reconciles(db):
+    insertUndated(db, 3, 9)
+    BankTable.insertBankLog(db, 3, 1, datetime.date(2021, 7, 4))
+    BankRollup.rebuildRollup(db)
+    assertConsistent(db)
@@ -0,0 +1,40 @@
+"""
+Log dates are normalized to ISO 'YYYY-MM-DD' text, so date ranges and their indexes compare them chronologically.
+"""
+import datetime
+
+import pytest
+
+import brisketutils
+from BankDB import BankTable
+from BrisketDB import BrisketDB
+from CharacterDB import CharacTable
+from SkillDB import SkillLogTable
+from WeaponDB import WeaponLogTable
+
+LOGS = [BankTable, SkillLogTable, WeaponLogTable, CharacTable]
+
+
+@pytest.mark.parametrize('value, date', [
+    ('2021-03-05', datetime.date(2021, 3, 5)),
+    ('2021-3-5', datetime.date(2021, 3, 5)),
+    ('2021-12-1 10:00:00', datetime.date(2021, 12, 1)),
+    ('2021-03-06T23:59', datetime.date(2021, 3, 6)),
+    (datetime.date(2021, 1, 2), datetime.date(2021, 1, 2)),
+    ('garbage', None),
+    ('2021-02-30', None),
+    (None, None),
+])
+def test_parse_date(value, date):
+    assert brisketutils.parseDate(value) == date
+
+
+@pytest.mark.parametrize('log', LOGS, ids=lambda t: t.TABLE_NAME)
+def test_normalize_dates(tmp_path, log):
+    db = BrisketDB(str(tmp_path / 'brisket.db'))
+    with db.conn:
+        db.execute(f"DELETE FROM [{log.TABLE_NAME}]")
+        db[log.TABLE_NAME].insert_all({log.DATE_COL : d} for d in ['2021-3-5', '2021-03-06 10:00:00', 'garbage', None])
+        log.normalizeDates(db)
+    assert [r[log.DATE_COL] for r in db[log.TABLE_NAME].rows] == ['2021-03-05', '2021-03-06', 'garbage', None]
+    db.conn.close()
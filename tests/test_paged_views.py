@@ -0,0 +1,69 @@
+"""
+Keyset-paginated views must list every row exactly once, in order, whichever way they are paged, undated rows
+(left over from legacy databases) included unless a date range is given.
+"""
+import pytest
+
+from BankDB import BankTable
+from BrisketDB import BrisketDB
+from BrisketQueries import MAX_DATE, MIN_DATE, QUERIES
+
+DATES = ['2021-03-05', None, '2021-03-05', '2021-01-02', None, '2021-12-31', '2021-03-05']
+MEMBER_ID = 7
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = BrisketDB(str(tmp_path / 'brisket.db'))
+    with db.conn:
+        db.execute(f"DELETE FROM [{BankTable.TABLE_NAME}]")
+        db[BankTable.TABLE_NAME].insert_all({BankTable.MEMBERID_COL : MEMBER_ID, BankTable.AMNT_COL : i,
+            BankTable.DATE_COL : date} for i, date in enumerate(DATES))
+    yield db
+    db.conn.close()
+
+
+def expected(db, since=None, until=None):
+    # Newest first, undated rows last, ties broken by newest transaction
+    rows = [(r[BankTable.DATE_COL], r[BankTable.XACTID_COL]) for r in db[BankTable.TABLE_NAME].rows
+        if since is None or (r[BankTable.DATE_COL] is not None and since <= r[BankTable.DATE_COL] <= until)]
+    rows.sort(key=lambda r: (r[0] is not None, r[0] or '', r[1]), reverse=True)
+    return [pk for _, pk in rows]
+
+
+def pageThrough(db, name, filters, bounds, size):
+    """Primary keys of <name> read forward with .next from the first page, then backward with .prev from the last row
+    """
+    def page(query, key=()):
+        columns, rows = QUERIES.executeTable(db, query, (*filters, *bounds, *key, size))
+        date_idx, pk_idx = (columns.index(c) for c in QUERIES.pageKey(name))
+        return [(r[date_idx], r[pk_idx]) for r in rows]
+
+    forward = page(name)
+    while rows := page(f"{name}.next", forward[-1]):
+        forward += rows
+
+    backward = [forward[-1]]
+    while rows := page(f"{name}.prev", backward[-1]):
+        backward += rows
+    return [pk for _, pk in forward], [pk for _, pk in reversed(backward)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 10])
+@pytest.mark.parametrize('name, filters', [('bank.view.recent', ()), ('bank.view.member', (MEMBER_ID,))])
+def test_open_views_list_undated_rows(db, name, filters, size):
+    forward, backward = pageThrough(db, name, filters, (), size)
+    assert forward == expected(db)
+    assert backward == forward
+
+
+@pytest.mark.parametrize('size', [1, 3])
+def test_ranged_views_skip_undated_rows(db, size):
+    forward, backward = pageThrough(db, 'bank.view.recent.range', (), ('2021-01-01', '2021-06-30'), size)
+    assert forward == expected(db, '2021-01-01', '2021-06-30')
+    assert backward == forward
+
+
+def test_open_range_covers_every_dated_row(db):
+    dated = [pk for pk in expected(db) if db[BankTable.TABLE_NAME].get(pk)[BankTable.DATE_COL] is not None]
+    assert [r[0] for r in QUERIES.executeTable(db, 'bank.view.recent.range', (MIN_DATE, MAX_DATE, 100))[1]] == dated
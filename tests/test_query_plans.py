@@ -0,0 +1,45 @@
+"""
+Every registered view query must be served by index searches, on a freshly migrated schema and once the planner
+has statistics (ANALYZE over synthetic rows), since plans can change with them.
+"""
+import pytest
+
+from BankDB import BankTable
+from BrisketDB import BrisketDB
+from BrisketQueries import QUERIES, paramCount, queryPlan
+from SkillDB import SkillLogTable
+from WeaponDB import WeaponLogTable
+from benchmarks import synthetic_guild
+
+# Date-range shapes and the (MemberID, Date) / (Date) indexes serving them.
+# Migration 8 replaced the plain date indexes of migration 7 with covering ones over the same leading columns.
+DATE_RANGE_INDEXES = {
+    'bank.view.recent.range' : BankTable.DATE_COVER_IDX,
+    'bank.view.member.range' : BankTable.MEMBER_DATE_COVER_IDX,
+    'bank.stats.donors' : BankTable.DATE_COVER_IDX,
+    'skill.view.recent.range' : SkillLogTable.DATE_COVER_IDX,
+    'skill.view.member_best.range' : SkillLogTable.MEMBER_DATE_COVER_IDX,
+    'weapon.view.recent.range' : WeaponLogTable.DATE_COVER_IDX,
+    'weapon.view.member_best.range' : WeaponLogTable.MEMBER_DATE_COVER_IDX,
+}
+
+
+@pytest.fixture(scope='module', params=['fresh', 'analyzed'])
+def db(request, tmp_path_factory):
+    db = BrisketDB(str(tmp_path_factory.mktemp(request.param) / 'brisket.db'))
+    if request.param == 'analyzed':
+        synthetic_guild.populate(db, members=50, rows=20000)
+        db.execute("ANALYZE")
+    yield db
+    db.conn.close()
+
+
+def test_no_full_scans(db):
+    assert QUERIES.fullScans(db) == {}
+
+
+@pytest.mark.parametrize('name, index', sorted(DATE_RANGE_INDEXES.items()))
+def test_date_ranges_use_date_indexes(db, name, index):
+    sql = QUERIES.sql(name)
+    plan = queryPlan(db, sql, [None] * paramCount(sql))
+    assert any(f"INDEX {index} " in step and "Date>" in step for step in plan), '\n'.join(plan)